@@ -3,9 +3,9 @@
 import os, sys
 import time
 
-from flask import Flask, request
-from tinydb import TinyDB, where
-from PM3.model.process import Process
+from flask import Flask, Response, g, request
+from pydantic import ValidationError
+from PM3.model.process import Process, ProcessRow, stop_trees
 from PM3.model.pm3_protocol import RetMsg, KillMsg, alive_gone
 import logging
 from collections import namedtuple
@@ -14,9 +14,23 @@ import dsnparse
 import psutil
 from pathlib import Path
 from PM3.libs.pm3table import Pm3Table, ION
+from PM3.libs.storage import make_engine
+from PM3.libs.reaper import ChildReaper
+from PM3.libs.supervisor import Supervisor
+from PM3.libs.sampler import MetricsSampler, SAMPLE_ATTRS
+from PM3.libs.query import Query, QueryError
+from PM3.libs import exporter
+from PM3.libs.logpipe import make_capture
+from PM3.libs.logstream import log_lines, STREAMS
+from PM3.libs.events import EventLog
+from PM3.libs.server import serve, serve_unix
+from PM3.libs.unixsocket import socket_path
 import signal
 import json
 import threading
+import atexit
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 pm3_home_dir = os.path.expanduser('~/.pm3')
 config_file = f'{pm3_home_dir}/config.ini'
@@ -28,23 +42,58 @@ if not os.path.isfile(config_file):
 config = ConfigParser()
 config.read(config_file)
 
-pm3_db_name = config['main_section'].get('pm3_db')
+pm3_db_flush_interval = config['main_section'].getfloat('pm3_db_flush_interval', fallback=1.0)
+db_engine = make_engine(config['main_section'])
+pm3_db_name = db_engine.path
 pm3_db_lock_file = pm3_db_name + ".lock"
-db = TinyDB(pm3_db_name)
 
-tbl = db.table(config['main_section'].get('pm3_db_process_table'))
-ptbl = Pm3Table(tbl, lock_file=pm3_db_lock_file)
+ptbl = Pm3Table(db_engine, lock_file=pm3_db_lock_file,
+                id_reuse=config['main_section'].getboolean('pm3_id_reuse', fallback=False))
 
 backend_process_name = config['backend'].get('name') or '__backend__'
 cron_checker_process_name = config['cron_checker'].get('name') or '__cron_checker__'
 
+# La supervisione dell'autorun e' fatta dal backend,
+# il __cron_checker__ esterno resta opzionale
+supervisor_enabled = config['backend'].getboolean('supervisor', fallback=True)
+supervisor_interval = config['backend'].getfloat('supervisor_interval',
+                                                 fallback=config['cron_checker'].getfloat('sleep_time', fallback=5))
+cron_checker_enabled = config['cron_checker'].getboolean('enabled', fallback=not supervisor_enabled)
+
+# Cattura di stdout/stderr dei processi con rotazione dei log
+if not config.has_section('log'):
+    config.add_section('log')
+logcapture = make_capture(config['log'])
+# Listener sul socket unix, avviato in main()
+unix_server = None
+
+# Ultimi eventi (uscite, crash, riavvii) con la coda dell'output
+events = EventLog(config['backend'].getint('events_size', fallback=100))
+event_tail_lines = config['backend'].getint('event_tail_lines', fallback=100)
+
 app = Flask(__name__)
 
+# Latenza delle richieste per /metrics
+http_latency = exporter.Histogram()
+
+@app.before_request
+def _request_start():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _request_end(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unknown'
+        http_latency.observe(endpoint, time.perf_counter() - start)
+    return response
+
 
 # Processi avviati localmente con popen:
 # key = pid
 # value = processo Popen
 local_popen_process = {}
+reaper = ChildReaper()
 
 def _resp(res: RetMsg) -> dict:
     if res.err:
@@ -54,63 +103,139 @@ def _resp(res: RetMsg) -> dict:
     return res.model_dump()
 
 def _insert_process(proc: Process, rewrite=False):
-    proc.pm3_id = ptbl.next_id() if proc.pm3_id is None else proc.pm3_id
-
-    if tbl.contains(where('pm3_name') == proc.pm3_name):
+    # next_id, checks and insert must be atomic with concurrent /new requests
+    with ptbl.transaction():
+        reserved = proc.pm3_id is None
+        if reserved:
+            proc.pm3_id = ptbl.reserve_id()
+        ret = _insert_locked(proc, rewrite)
+        if reserved and ret != 'OK':
+            ptbl.release_id(proc.pm3_id)
+        return ret
+
+def _insert_locked(proc: Process, rewrite=False):
+    # Called inside ptbl.transaction() with proc.pm3_id already set
+    if ptbl.check_exist(proc.pm3_name, col='pm3_name'):
         if not rewrite:
             proc.pm3_name = f'{proc.pm3_name}_{proc.pm3_id}'
 
-    if tbl.contains(where('pm3_id') == proc.pm3_id):
+    if ptbl.check_exist(proc.pm3_id):
         if rewrite:
-            tbl.remove(where('pm3_id') == proc.pm3_id)
-            tbl.insert(proc.model_dump())
+            ptbl.delete(proc)
+            ptbl.insert(proc)
             return 'OK'
         return 'ID_ALREADY_EXIST'
-    elif tbl.contains(where('pm3_name') == proc.pm3_name):
+    elif ptbl.check_exist(proc.pm3_name, col='pm3_name'):
         return 'NAME_ALREADY_EXIST'
     else:
-        tbl.insert(proc.model_dump())
+        ptbl.insert(proc)
         return 'OK'
 
-def _start_process(proc, ion) -> RetMsg:
-    if proc.is_running:
-        # Already running
-        msg = f'process {proc.pm3_name} (id={proc.pm3_id}) already running with pid {proc.pid}'
+def _insert_msg(proc: Process, ret: str) -> RetMsg:
+    if ret == 'ID_ALREADY_EXIST':
+        msg = f'process with id={proc.pm3_id} already exist'
         return RetMsg(msg=msg, warn=True)
-    elif proc.restart >= proc.max_restart:
-        # Max request exceded
-        msg = f'ERROR, process {proc.pm3_name} (id={proc.pm3_id}) exceded max_restart {proc.restart}/{proc.max_restart}'
+    elif ret == 'NAME_ALREADY_EXIST':
+        msg = f'process with name={proc.pm3_name} already exist'
         return RetMsg(msg=msg, err=True)
+    elif ret == 'OK':
+        msg = f'process [bold]{proc.pm3_name}[/bold] with id={proc.pm3_id} was added'
+        return RetMsg(msg=msg, err=False)
     else:
-        try:
-            p = proc.run()
-            local_popen_process[proc.pid] = p
-            if not ptbl.update(proc):
-                # Update Error
-                msg = f'Error updating {proc}'
-                return RetMsg(msg=msg, err=True)
-        except FileNotFoundError as e:
-            #print(e)
-            # File not found
-            msg = f'File Not Found: {e.filename} {Path(proc.cwd, proc.cmd).as_posix()} ({ion.type}={ion.data})'
-            return RetMsg(msg=msg, err=True)
-        else:
-            # OK, process started
-            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) started with pid {proc.pid}'
-            return RetMsg(msg=msg, err=False)
+        msg = f'Strange Error :('
+        return RetMsg(msg=msg, err=True)
 
+# Operazioni di gruppo (start di piu' processi) eseguite in parallelo
+group_pool = ThreadPoolExecutor(max_workers=config['backend'].getint('group_workers', fallback=8),
+                                thread_name_prefix='pm3_group')
+# key = pm3_id, value = lock of the start of that process
+_start_locks = {}
+_start_locks_guard = threading.Lock()
 
+def _start_lock(pm3_id) -> threading.Lock:
+    with _start_locks_guard:
+        return _start_locks.setdefault(pm3_id, threading.Lock())
 
-def ps_proc_as_dict(ps_proc):
-    '''
-    Versione corretta di psutil.Process().as_dict()
-    La versione originale non aggiorna i valori di CPU
-    :param ps_proc:
-    :return:
-    '''
-    ppad = ps_proc.as_dict()
-    ppad['cpu_percent'] = ps_proc.cpu_percent(interval=0.1)
-    return ppad
+def _start_process(proc, ion) -> RetMsg:
+    # Supervisor, reaper and /start can race on the same process:
+    # the pid is checked and the process spawned under its own lock,
+    # different processes start in parallel
+    with _start_lock(proc.pm3_id):
+        doc = ptbl.select(proc)
+        if doc is not None and doc['pid'] != proc.pid:
+            # Started by someone else in the meantime
+            proc.pid = doc['pid']
+            proc.pid_create_time = doc.get('pid_create_time')
+        if proc.is_running:
+            # Already running
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) already running with pid {proc.pid}'
+            return RetMsg(msg=msg, warn=True)
+        elif proc.restart >= proc.max_restart:
+            # Max request exceded
+            msg = f'ERROR, process {proc.pm3_name} (id={proc.pm3_id}) exceded max_restart {proc.restart}/{proc.max_restart}'
+            return RetMsg(msg=msg, err=True)
+        else:
+            # nohup processes must survive the backend: no pipes, they write the files
+            capture = logcapture is not None and not proc.nohup
+            fds = (logcapture.attach(proc.stdout, proc.stderr, proc.pm3_id, proc.tail_buffer_bytes)
+                   if capture else (None, None))
+            try:
+                p = proc.run(*fds)
+                local_popen_process[proc.pid] = p
+                # The new pid is stored before the reaper can see the exit
+                updated = ptbl.update(proc)
+                reaper.watch(p, partial(_on_child_exit, proc.pm3_id))
+                if not updated:
+                    # Update Error
+                    msg = f'Error updating {proc}'
+                    return RetMsg(msg=msg, err=True)
+            except FileNotFoundError as e:
+                #print(e)
+                # File not found
+                msg = f'File Not Found: {e.filename} {Path(proc.cwd, proc.cmd).as_posix()} ({ion.type}={ion.data})'
+                return RetMsg(msg=msg, err=True)
+            else:
+                # OK, process started
+                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) started with pid {proc.pid}'
+                return RetMsg(msg=msg, err=False)
+            finally:
+                # The child has its own copy of the write ends
+                if capture:
+                    logcapture.release(*fds)
+
+
+
+def _start_processes(pairs) -> list:
+    """Start a list of (proc, ion) on group_pool, the RetMsg in the same order"""
+    if len(pairs) <= 1:
+        return [_start_process(proc, ion) for proc, ion in pairs]
+    return list(group_pool.map(lambda pair: _start_process(*pair), pairs))
+
+def _summary(ion, n_procs, resp_list) -> str:
+    # Risultato aggregato delle operazioni su group:<nome> e tag:<nome>
+    if ion.type not in ('group', 'tag') or n_procs == 0:
+        return ''
+    err = sum(1 for i in resp_list if i['err'])
+    warn = sum(1 for i in resp_list if i['warn'] and not i['err'])
+    ok = len(resp_list) - err - warn
+    return f'{ion.type}={ion.data}: {n_procs} processes, results {ok} ok, {warn} warnings, {err} errors'
+
+def _supervised_start(proc, ion) -> RetMsg:
+    ret = _start_process(proc, ion)
+    if not ret.err and not ret.warn:
+        events.add('restart', pm3_id=proc.pm3_id, pm3_name=proc.pm3_name, pid=proc.pid,
+                   restart=proc.restart, unstable_restarts=proc.unstable_restarts)
+    return ret
+
+supervisor = Supervisor(ptbl, _supervised_start, interval=supervisor_interval,
+                        debug=config['cron_checker'].getboolean('debug', fallback=False))
+
+# Campionamento psutil in background, /ps legge l'ultimo snapshot
+sampler = MetricsSampler(ptbl.pids,
+                         period=config['backend'].getfloat('ps_sample_period', fallback=2.0),
+                         max_staleness=config['backend'].getfloat('ps_max_staleness', fallback=10.0),
+                         history_period=config['backend'].getfloat('metrics_period', fallback=10.0),
+                         history_size=config['backend'].getint('metrics_size', fallback=360))
 
 @app.get("/ping")
 def pong():
@@ -127,48 +252,215 @@ def new_process():
         ret = _insert_process(proc, rewrite=True)
     else:
         ret = _insert_process(proc)
+    return _resp(_insert_msg(proc, ret))
+
+@app.post("/new/bulk")
+@app.post("/new/bulk/rewrite")
+def new_processes():
+    """
+    Add a list of processes: all the entries are validated first (nothing
+    is added if one is invalid), then ids are allocated in one pass and
+    the processes inserted under one transaction. One result per entry.
+    """
+    rewrite = request.path.endswith('/rewrite')
+    data = request.json
+    if not isinstance(data, list):
+        return _resp(RetMsg(msg='a list of processes is expected', err=True))
+    procs, errors = [], []
+    for n, item in enumerate(data):
+        try:
+            procs.append(Process(**item))
+        except (ValidationError, TypeError) as e:
+            errors.append(RetMsg(msg=f'entry {n}: invalid process ({e})', err=True))
+    if errors:
+        return _resp(RetMsg(msg='no process added', payload=[_resp(i) for i in errors]))
+
+    with ptbl.transaction():
+        # The explicit ids of the batch are not given to the others
+        taken = {proc.pm3_id for proc in procs if proc.pm3_id is not None}
+        results = []
+        for proc in procs:
+            reserved = proc.pm3_id is None
+            if reserved:
+                proc.pm3_id = ptbl.reserve_id()
+                while proc.pm3_id in taken:
+                    proc.pm3_id = ptbl.reserve_id()
+            ret = _insert_locked(proc, rewrite)
+            if reserved and ret != 'OK':
+                ptbl.release_id(proc.pm3_id)
+            results.append(_insert_msg(proc, ret))
+    return _resp(RetMsg(msg='', payload=[_resp(i) for i in results]))
+
+
+# pid dei processi fermati da stop/rm: la loro uscita non e' un crash
+_stopping_pids = set()
+
+def _stop_processes(procs, timeout=5) -> list:
+    """
+    Stop the running procs together with stop_trees().
+    Return a list of (proc, KillMsg).
+    """
+    pids = {}
+    for proc in procs:
+        try:
+            running = proc.is_running
+        except psutil.NoSuchProcess:
+            running = False
+        if running:
+            # Escluso dall'autorun prima del kill, il reaper non deve riavviarlo
+            proc.autorun_exclude = True
+            ptbl.set_fields(proc.pm3_id, {'autorun_exclude': True})
+            pids[proc.pm3_id] = proc.pid
+            if proc.pid in local_popen_process:
+                # The reaper will see its exit
+                _stopping_pids.add(proc.pid)
 
-    if ret == 'ID_ALREADY_EXIST':
-        msg = f'process with id={proc.pm3_id} already exist'
-        return _resp(RetMsg(msg=msg, warn=True))
-    elif ret == 'NAME_ALREADY_EXIST':
-        msg = f'process with name={proc.pm3_name} already exist'
-        return _resp(RetMsg(msg=msg, err=True))
-    elif ret == 'OK':
-        msg = f'process [bold]{proc.pm3_name}[/bold] with id={proc.pm3_id} was added'
-        return _resp(RetMsg(msg=msg, err=False))
-    else:
-        msg = f'Strange Error :('
-        return _resp(RetMsg(msg=msg, err=True))
-
-
-def _local_kill(proc ):
-    p : Process = local_popen_process[proc.pid]
-    local_pid = p.pid
-    #p.kill()
-    Process.kill_proc_tree(local_pid)
-    for i in range(5):
-        _ = p.poll()
-        if not proc.is_running:
-            break
-        time.sleep(1)
+    trees = stop_trees(pids.values(), timeout=timeout)
+
+    out = []
+    for proc in procs:
+        gone, alive = trees.get(pids.get(proc.pm3_id), ([], []))
+        if len(gone) == 0 and len(alive) == 0:
+            out.append((proc, KillMsg(msg='NOT RUNNING', warn=True)))
+            continue
+        gone = [alive_gone(pid=ps.pid) for ps in gone]
+        alive = [alive_gone(pid=ps.pid) for ps in alive]
+        if len(alive) > 0:
+            out.append((proc, KillMsg(msg='OK', alive=alive, gone=gone, warn=True)))
+        else:
+            # Only pid: exit_code and the rest are written by the reaper
+            ptbl.set_fields(proc.pm3_id, {'pid': -1, 'pid_create_time': None}, where={'pid': proc.pid})
+            proc.pid, proc.pid_create_time = -1, None
+            out.append((proc, KillMsg(msg='OK', gone=gone)))
+    return out
+
+# Campi scritti dal reaper all'uscita di un processo
+EXIT_FIELDS = ('pid', 'pid_create_time', 'exit_code', 'unstable_restarts', 'crash_loop', 'next_restart_at')
+
+def _on_child_exit(pm3_id, p):
+    # Chiamata dal reaper appena un processo avviato da PM3 termina
+    local_popen_process.pop(p.pid, None)
+    # Under the start lock the pid can only be p.pid or -1 (set by /stop)
+    with _start_lock(pm3_id):
+        ion = ptbl.find_id_or_name(pm3_id)
+        if len(ion.proc) == 0:
+            # Removed
+            return
+        proc = ion.proc[0]
+        if proc.pid not in (p.pid, -1):
+            # Already restarted with another pid
+            return
+        proc.pid = -1
+        proc.pid_create_time = None
+        proc.exit_code = p.returncode
+        proc.register_exit()
+        # Only the exit fields, the others may be changed by the other requests
+        ptbl.set_fields(pm3_id, {k: getattr(proc, k) for k in EXIT_FIELDS})
+    logging.info(f'process {proc.pm3_name} (id={proc.pm3_id}) exited with code {p.returncode}')
+    _exit_event(proc, p)
+
+    if proc.autorun and not proc.autorun_exclude:
+        # The restart policy belongs to the supervisor
+        supervisor.wake()
+
+def _exit_event(proc, p):
+    # Evento con le ultime righe di output, letto fino all'EOF delle pipe
+    tail = []
+    if logcapture is not None:
+        logcapture.wait_closed(proc.pm3_id, timeout=0.5)
+        buf = logcapture.tails.get(proc.pm3_id)
+        if buf is not None:
+            tail = [{'stream': stream, 'line': line} for stream, line in buf.lines('both', last=event_tail_lines)]
+    restarting = proc.autorun and not proc.autorun_exclude
+    if p.pid in _stopping_pids:
+        _stopping_pids.discard(p.pid)
+        kind = 'stop'
     else:
-        return KillMsg(msg='OK', alive=[alive_gone(pid=local_pid),], warn=True)
-    # Elimino l'elemento dal dizionario
-    _ = local_popen_process.pop(local_pid, None)
-    return KillMsg(msg='OK', gone=[alive_gone(pid=local_pid), ])
-
-def _interal_poll():
-    for local_pid, p in local_popen_process.items():
-        p.poll()
-
-def _interal_poll_thread():
-    # Interrogazione ciclica dei processi avviati da PM3
-    # i processi contenuti in local_popen_process
-    # vanno periodicamente interrogati
+        kind = 'exit' if p.returncode == 0 else 'crash'
+    events.add(kind,
+               pm3_id=proc.pm3_id, pm3_name=proc.pm3_name, pid=p.pid, exit_code=p.returncode,
+               restart=proc.restart, crash_loop=proc.crash_loop,
+               next_restart_at=proc.next_restart_at if restarting else None, tail=tail)
+
+def _flush_thread():
+    # Le modifiche ai processi restano in memoria
+    # e vengono scritte su disco al massimo ogni pm3_db_flush_interval secondi
     while True:
-        _interal_poll()
-        time.sleep(1)
+        time.sleep(pm3_db_flush_interval)
+        try:
+            ptbl.flush()
+        except Exception as e:
+            logging.error(f'error writing {pm3_db_name}: {e}')
+
+def _shutdown(signum, frame):
+    ptbl.flush()
+    if logcapture is not None:
+        logcapture.flush()
+    if unix_server is not None:
+        unix_server.server_close()
+    os._exit(0)
+
+def _stop_msgs(proc, ret) -> list:
+    logging.debug(f'kill process {proc}: {ret}')
+    resp_list = []
+    if ret.msg == 'OK':
+        for pk in ret.gone:
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} was killed'
+            resp_list.append(_resp(RetMsg(msg=msg, err=False)))
+        for pk in ret.alive:
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} still alive'
+            resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+    elif ret.warn:
+        msg = f'process {proc.pm3_name} (id={proc.pm3_id}) not running'
+        resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+    else:
+        msg = f'strange Error'
+        resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+    return resp_list
+
+def _bulk_ions():
+    """ION of every id_or_name of the json list in the request body"""
+    data = request.json
+    if not isinstance(data, list):
+        return None
+    return [ptbl.find_id_or_name(str(i)) for i in data]
+
+def _not_found(ion) -> dict:
+    msg = f'process {ion.type}={ion.data} not found'
+    return _resp(RetMsg(msg=msg, err=True))
+
+@app.post("/stop/bulk")
+def stop_processes():
+    """Stop the processes of a list of id_or_name, waiting for all of them together"""
+    ions = _bulk_ions()
+    if ions is None:
+        return _resp(RetMsg(msg='a list of id_or_name is expected', err=True))
+    resp_list = []
+    procs = {}
+    for ion in ions:
+        if len(ion.proc) == 0:
+            resp_list.append(_not_found(ion))
+        for proc in ion.proc:
+            procs.setdefault(proc.pm3_id, proc)
+    for proc, ret in _stop_processes(list(procs.values())):
+        resp_list += _stop_msgs(proc, ret)
+    return _resp(RetMsg(msg='', payload=resp_list))
+
+@app.post("/start/bulk")
+def start_processes():
+    """Start the processes of a list of id_or_name"""
+    ions = _bulk_ions()
+    if ions is None:
+        return _resp(RetMsg(msg='a list of id_or_name is expected', err=True))
+    resp_list = []
+    pairs = {}
+    for ion in ions:
+        if len(ion.proc) == 0:
+            resp_list.append(_not_found(ion))
+        for proc in ion.proc:
+            pairs.setdefault(proc.pm3_id, (proc, ion))
+    resp_list += [_resp(i) for i in _start_processes(list(pairs.values()))]
+    return _resp(RetMsg(msg='', payload=resp_list))
 
 @app.get("/stop/<id_or_name>")
 @app.get("/restart/<id_or_name>")
@@ -181,82 +473,146 @@ def stop_and_rm_process(id_or_name):
         msg = f'process {ion.type}={ion.data} not found'
         resp_list.append(_resp(RetMsg(msg=msg, err=True)))
 
-    for proc in ion.proc:
-        if proc.pid in local_popen_process:
-            # Processi attivati da os.getpid() vanno trattati con popen
-            ret = _local_kill(proc)
-            logging.debug(f'local kill process {proc}')
-        else:
-            ret = proc.kill()
-            logging.debug(f'simple kill process {proc}')
-
-        if ret.msg == 'OK':
-            proc.autorun_exclude = True
-            ptbl.update(proc)
-            for pk in ret.gone:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} was killed'
-                resp_list.append(_resp(RetMsg(msg=msg, err=False)))
-        
-        elif ret.warn:
-            for pk in ret.alive:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} still alive'
-                resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
-            if len(ret.alive) == 0:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) not running'
-                resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
-        else:
-            msg = f'strange Error'
-            resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+    for proc, ret in _stop_processes(ion.proc):
+        resp_list += _stop_msgs(proc, ret)
 
         if request.path.startswith('/rm/'):
             if not ptbl.delete(proc):
                 msg = f'error updating {proc}'
                 resp_list.append(_resp(RetMsg(msg=msg, err=True)))
             else:
+                sampler.forget(proc.pm3_id)
+                with _start_locks_guard:
+                    _start_locks.pop(proc.pm3_id, None)
+                if logcapture is not None:
+                    logcapture.forget(proc.pm3_id)
                 msg = f'process {proc.pm3_name} (id={proc.pm3_id}) removed'
                 resp_list.append(_resp(RetMsg(msg=msg, err=False)))
 
     if request.path.startswith('/restart/'):
         resp_list += start_process(id_or_name)['payload']
 
-    ret_msg = RetMsg(msg='', payload=resp_list)
+    ret_msg = RetMsg(msg=_summary(ion, len(ion.proc), resp_list), payload=resp_list)
 
     return _resp(ret_msg)
 
+# Attributi psutil di /ps senza ?fields: quelli campionati piu' file e connessioni
+PS_DEFAULT_ATTRS = SAMPLE_ATTRS + ('open_files', 'net_connections')
+LS_FIELDS = set(Process.model_fields) | {'status'}
+LS_ALIASES = {'status': lambda doc: 'running' if doc.get('running') else 'stopped'}
+
+def _query_error(e):
+    return _resp(RetMsg(msg=str(e), err=True)), 400
+
 @app.get("/ls/<id_or_name>")
 def ls_process(id_or_name):
-    payload = []
-    ion = ptbl.find_id_or_name(id_or_name)
-    for proc in ion.proc:
-        # Aggiorno lo stato dei processi
-        _interal_poll()
-        # Trick for update pid
-        proc.is_running
-        ptbl.update(proc)
-        payload.append(proc)
-    return RetMsg(msg='OK', err=False, payload=payload).model_dump()
+    """
+    The process documents, or with ?format=rows only the ls columns:
+    {"columns": [...], "rows": [[...], ...]}
+    ?fields, filters (status=running|stopped or any field), ?sort, ?limit: see libs/query.py
+    """
+    try:
+        query = Query(request.args, known=LS_FIELDS, aliases=LS_ALIASES)
+        docs = query.apply([ptbl.refresh(doc) for doc in ptbl.find_docs(id_or_name).proc])
+    except QueryError as e:
+        return _query_error(e)
+    if request.args.get('format') == 'rows':
+        columns = query.columns(ProcessRow._fields)
+        payload = {'columns': columns, 'rows': [[doc.get(k) for k in columns] for doc in docs]}
+    else:
+        payload = [query.project(doc) for doc in docs]
+    # Same shape as RetMsg, without validating the payload again
+    return {'msg': 'OK', 'err': False, 'warn': False, 'payload': payload, 'err_code': 0}
 
 @app.get("/ps/<id_or_name>")
 def pstatus(id_or_name):
-    procs = []
+    """
+    psutil data of the processes and of their children, merged with the
+    process document. Only the psutil attributes needed by ?fields, the
+    filters and ?sort are read (any psutil attribute can be asked).
+    """
+    try:
+        query = Query(request.args, known=None)
+    except QueryError as e:
+        return _query_error(e)
+    attrs = PS_DEFAULT_ATTRS if query.fields is None else ()
+    attrs += tuple(i for i in query.needed() if i not in Process.model_fields)
+
+    payload = []
+    for doc in ptbl.find_docs(id_or_name).proc:
+        doc = ptbl.refresh(doc)
+        if doc['pid'] > 0:
+            # Process and children process
+            try:
+                rows = sampler.get(doc['pid'], attrs)
+            except ValueError as e:
+                return _query_error(e)
+            payload.extend({**doc, **ps_proc} for ps_proc in rows)
+
+    try:
+        payload = [query.project(row) for row in query.apply(payload)]
+    except QueryError as e:
+        return _query_error(e)
+    return {'msg': 'OK', 'err': False, 'warn': False, 'payload': payload, 'err_code': 0}
+
+@app.get("/metrics")
+def metrics_exporter():
+    # Prometheus text format, only cached data: a scrape never calls psutil
+    body = exporter.render(ptbl.all(), sampler.snapshot(), ptbl.stats(), http_latency, time.time())
+    return Response(body, content_type=exporter.CONTENT_TYPE)
+
+@app.get("/log/<id_or_name>")
+def log_stream(id_or_name):
+    # NDJSON, una riga per riga di log: ?lines=N&follow=1&stream=out|err|both
+    lines = request.args.get('lines', 10, type=int)
+    follow = request.args.get('follow', 'false').lower() in ('1', 'true', 'yes')
+    stream = request.args.get('stream', 'out')
+    if stream not in STREAMS:
+        return _resp(RetMsg(msg=f'stream must be one of {STREAMS}', err=True)), 400
+    ion = ptbl.find_id_or_name(id_or_name)
+    if follow and 'pm3.detach' in request.environ:
+        # Endless response: out of the worker pool of the server
+        request.environ['pm3.detach']()
+    return Response(log_lines(ion.proc, logcapture, lines, follow, stream),
+                    content_type='application/x-ndjson')
+
+@app.get("/tail/<id_or_name>")
+def tail_buffer(id_or_name):
+    # Output recente dalla memoria: ?lines=N&stream=out|err|both
+    lines = request.args.get('lines', 100, type=int)
+    stream = request.args.get('stream', 'both')
+    if stream not in STREAMS:
+        return _resp(RetMsg(msg=f'stream must be one of {STREAMS}', err=True)), 400
+    payload = []
     ion = ptbl.find_id_or_name(id_or_name)
     for proc in ion.proc:
-        # Trick for update pid
-        proc.is_running
-        if id_or_name == 0 and proc.pid != os.getpid():
-            proc.pid = os.getpid()
-        ptbl.update(proc)  # Aggiorno anche il database
-        procs.append(proc)
+        buf = logcapture.tails.get(proc.pm3_id) if logcapture is not None else None
+        rows = buf.lines(stream, last=lines) if buf is not None else []
+        payload.append({'pm3_id': proc.pm3_id, 'pm3_name': proc.pm3_name,
+                        'lines': [{'stream': s, 'line': line} for s, line in rows]})
+    return _resp(RetMsg(msg='OK', err=False, payload=payload))
 
+@app.get("/events")
+def events_list():
+    # ?since=seq per i soli eventi nuovi, ?id_or_name= per filtrare
+    since = request.args.get('since', 0, type=int)
+    id_or_name = request.args.get('id_or_name')
+    pm3_ids = None
+    if id_or_name is not None:
+        pm3_ids = {proc.pm3_id for proc in ptbl.find_id_or_name(id_or_name).proc}
+    return _resp(RetMsg(msg='OK', err=False, payload=events.since(since, pm3_ids)))
+
+@app.get("/metrics/<id_or_name>")
+def metrics_history(id_or_name):
+    # Storico delle metriche campionate, ?last=N per gli ultimi N campioni
+    last = request.args.get('last', type=int)
     payload = []
-    for proc in procs:
-        if proc.pid > 0:
-            payload.append({**proc.model_dump(), **ps_proc_as_dict(psutil.Process(proc.pid))})
-
-            # Children process
-            for ps_proc in psutil.Process(proc.pid).children(recursive=True):
-                payload.append({**proc.model_dump(), **ps_proc_as_dict(ps_proc)})
-
+    ion = ptbl.find_id_or_name(id_or_name)
+    for proc in ion.proc:
+        ring = sampler.history.get(proc.pm3_id)
+        payload.append({'pm3_id': proc.pm3_id,
+                        'pm3_name': proc.pm3_name,
+                        'metrics': ring.to_dict(last) if ring is not None else {}})
     return _resp(RetMsg(msg='OK', err=False, payload=payload))
 
 @app.get("/reset/<id_or_name>")
@@ -281,9 +637,8 @@ def start_process(id_or_name):
         msg = f'process {ion.type}={ion.data} not found'
         resp_list.append(_resp(RetMsg(msg=msg, err=True)))
 
-    for proc in ion.proc:
-        resp_list.append(_resp(_start_process(proc, ion)))
-    return _resp(RetMsg(msg='', payload=resp_list))
+    resp_list += [_resp(i) for i in _start_processes([(proc, ion) for proc in ion.proc])]
+    return _resp(RetMsg(msg=_summary(ion, len(ion.proc), resp_list), payload=resp_list))
 
 def _make_fake_backend(pid, cwd):
     proc = Process(cmd=config['backend'].get('cmd'),
@@ -330,22 +685,28 @@ def main():
     else:
         proc_backend = ion_backend.proc[0]
         proc_backend.pid = my_pid
+        proc_backend.pid_create_time = None
         proc_backend.cwd = my_cwd
         proc_backend.is_running
         ptbl.update(proc_backend)
 
 
     # __cron_checker__ process
-    ion_cron = ptbl.find_id_or_name(cron_checker_process_name)
-    if len(ion_cron.proc) == 0:
-        proc_cron = _make_cron_checker()
-        _insert_process(proc_cron)
-    else:
-        proc_cron = ion_cron.proc[0]
+    if cron_checker_enabled:
+        ion_cron = ptbl.find_id_or_name(cron_checker_process_name)
+        if len(ion_cron.proc) == 0:
+            proc_cron = _make_cron_checker()
+            _insert_process(proc_cron)
+        else:
+            proc_cron = ion_cron.proc[0]
+
+        ret_m = _resp(_start_process(proc_cron, ion_cron))
+        if ret_m['err'] is True:
+            print(ret_m)
 
-    ret_m = _resp(_start_process(proc_cron, ion_cron))
-    if ret_m['err'] is True:
-        print(ret_m)
+    if logcapture is not None:
+        logcapture.start()
+        atexit.register(logcapture.flush)
 
     # Autorun
     ion = ptbl.find_id_or_name('autorun_enabled')
@@ -356,11 +717,27 @@ def main():
             print(ret_m)
 
     # Threads
-    t1 = threading.Thread(target=_interal_poll_thread)
-    t1.start()
+    reaper.install_sigchld()
+    reaper.start()
+    if supervisor_enabled:
+        supervisor.start()
+    sampler.start()
+    t2 = threading.Thread(target=_flush_thread, daemon=True)
+    t2.start()
+
+    # Pending changes are written on shutdown
+    atexit.register(ptbl.flush)
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    # Unix socket for the local clients, TCP for remote and legacy ones
+    global unix_server
+    if path := socket_path(config):
+        unix_server = serve_unix(app, path, config['backend'])
+        if unix_server is not None:
+            atexit.register(unix_server.server_close)
 
     print(f'running on pid: {my_pid}')
-    app.run(debug=False, use_reloader=False, host=dsn.host, port=dsn.port)
+    serve(app, dsn.host, dsn.port, config['backend'])
     # il reloader non fa ricaricare correttamente il backend! perchè ci sono i threads
     # ricaricare a mano
 
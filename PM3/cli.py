@@ -7,9 +7,13 @@ import time
 import requests
 import argparse, argcomplete
 import logging
-from PM3.model.process import Process, ProcessStatus, ProcessStatusLight
+import functools
+from PM3.model.process import Process, ProcessStatus, ProcessStatusLight, ProcessRow, LIST_FIELDS
 from PM3.model.pm3_protocol import RetMsg
 from PM3.libs.system_scripts import pm3_scripts
+from PM3.libs import logindex
+from PM3.libs.follow import follow, line_head, COLORS
+from PM3.libs.client import Client
 import PM3.model.errors as PM3_errors
 from rich import print
 from rich.table import Table
@@ -18,22 +22,93 @@ import os, signal
 from pathlib import Path
 from configparser import ConfigParser
 import psutil
-import asyncio
-from pytailer import async_fail_tail
 import getpass
+import pendulum
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger()
 
 
 
-async def tailfile(f, lines=10):
-    with async_fail_tail(f, lines=lines) as tail:
-        async for line in tail:  # be careful: infinite loop!
-            print(line, end='', flush=True)
+def _parse_time(value: str) -> float:
+    # epoch, durata relativa (30s, 10m, 2h, 1d) oppure data/ora locale
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[-1:] in units and value[:-1].replace('.', '', 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    try:
+        return float(value)
+    except ValueError:
+        return pendulum.parse(value, tz=pendulum.local_timezone()).timestamp()
+
+def _print_log(ftt, args):
+    # Seek diretto: offset, intervallo di tempo dall'indice o lettura all'indietro
+    if args.offset is not None:
+        lines, next_offset = logindex.read_from(ftt, args.offset, lines=args.lines)
+    elif args.since is not None or args.until is not None:
+        start, end = logindex.time_range(ftt, args.since, args.until)
+        lines, next_offset = logindex.read_from(ftt, start, until_offset=end)
+    else:
+        lines, next_offset = logindex.tail(ftt, args.lines), None
+    for r in lines:
+        print(r, end='')
+    if args.offset is not None:
+        print(f"[yellow2] #### next offset: {next_offset} #### [/yellow2]")
+
+def _local_log(args):
+    # Lettura diretta dei file: stesso host e stesso utente del backend
+    res = _get(f"ls/{args.id_or_name or 'all'}")
+    if res and not res.err and args.follow:
+        # Un solo stream per tutti i processi selezionati
+        files = {}
+        for p in res.payload:
+            ftt = p['stdout'] if args.subparser == 'log' else p['stderr']
+            files.setdefault(ftt, p['pm3_name'])
+        follow(list(files.items()), lines=args.lines, colors=False if args.no_color else None)
+    elif res and not res.err:
+        for p in res.payload:
+            ftt = p['stdout'] if args.subparser == 'log' else p['stderr']
+            print()
+
+            if not Path(ftt).is_file():
+                print(f"[yellow] !!! file {ftt} don't exist !!! [/yellow]")
+                continue
+
+            print(f"[yellow2] #### {ftt} #### [/yellow2]")
+            _print_log(ftt, args)
+
+def _stream_log(args):
+    # Righe dal backend (/log), consumate man mano che arrivano
+    res = _get(f"ls/{args.id_or_name or 'all'}")
+    if not res or res.err:
+        _parse_retmsg(res)
+        return
+    names = [p['pm3_name'] for p in res.payload]
+    colors = sys.stdout.isatty() and not args.no_color
+    width = max((len(i) for i in names), default=0)
+    heads = {name: line_head(name.ljust(width), COLORS[n % len(COLORS)] if colors else None)
+             for n, name in enumerate(names)}
+    params = {'lines': args.lines, 'follow': args.follow, 'stream': 'out' if args.subparser == 'log' else 'err'}
+    try:
+        with _client().stream(f"log/{args.id_or_name or 'all'}", params) as r:
+            if r.status_code != 200:
+                print(f'[red]Connection Error ({r.status_code})[/red]')
+                return
+            for raw in r.iter_lines():
+                if not raw:
+                    # heartbeat
+                    continue
+                row = json.loads(raw)
+                head = heads.get(row['pm3_name'], '') if len(names) > 1 else ''
+                sys.stdout.write(f"{head}{row['line']}\n")
+                sys.stdout.flush()
+    except requests.exceptions.ConnectionError as e:
+        print(f'[red]{e}[/red]')
+    except KeyboardInterrupt:
+        pass
 
 def _clean_ls_proc(p: dict) -> dict:
     p.pop('pid')
+    p.pop('pid_create_time', None)
     p.pop('restart')
     p.pop('pm3_home')
     return p
@@ -60,24 +135,59 @@ def _setup():
         config['main_section'] = {
             'pm3_home_dir': pm3_home_dir,
             'pm3_db': f'{pm3_home_dir}/pm3_db.json',
+            'pm3_db_engine': 'sqlite',
+            'pm3_db_sqlite': f'{pm3_home_dir}/pm3_db.sqlite',
             'pm3_db_process_table': 'pm3_procs',
+            'pm3_db_flush_interval': 1.0,
+            'pm3_id_reuse': False,
             'main_interpreter': exe,
         }
         config['backend'] = {
             'name': '__backend__',
             'cmd': cmd_backend,
             'url': f'http://127.0.0.1:{tcp_port}/',
+            'socket': f'{pm3_home_dir}/pm3.sock',
+            'connect_timeout': 5,
+            'read_timeout': 60,
+            'supervisor': True,
+            'supervisor_interval': 5,
+            'ps_sample_period': 2,
+            'ps_max_staleness': 10,
+            'metrics_period': 10,
+            'metrics_size': 360,
+            'events_size': 100,
+            'event_tail_lines': 100,
+            'server': 'threaded',
+            'workers': 16,
+            'keep_alive': 5,
+            'group_workers': 8,
         }
         config['cron_checker'] = {
+            'enabled': False,
             'name': '__cron_checker__',
             'cmd': cmd_cron_checker,
             'sleep_time': 5,
             'debug': False
         }
+        config['log'] = {
+            'capture': True,
+            'max_bytes': 50 * 1024 * 1024,
+            'rotate_interval': 0,
+            'backup_count': 10,
+            'compress': False,
+            'buffer_size': 256 * 1024,
+            'flush_interval': 1.0,
+            'index': True,
+            'index_bytes': 1024 * 1024,
+            'tail_bytes': 64 * 1024,
+            'tail_max_bytes': 16 * 1024 * 1024,
+        }
         with open(config_file, 'w') as output_file:
             config.write(output_file)
 
+@functools.cache
 def _read_config():
+    # Letto una volta per processo
     pm3_home_dir = Path('~/.pm3').expanduser()
     config_file = f'{pm3_home_dir}/config.ini'
     if not Path(config_file).is_file():
@@ -109,33 +219,20 @@ def _make_script(filename, script, format_values=None, how_to_install=None, how_
         print('\n[yellow]HOW TO USE:[/yellow]')
         print(how_to_use)
 
-def _get(path) -> RetMsg:
-    config = _read_config()
-    base_url = config['backend'].get('url')
-    try:
-        r = requests.get(f'{base_url}/{path}', timeout=5)
-    except requests.exceptions.ConnectionError as e:
-        return RetMsg(err=True, msg=str(e))
+# Client del backend, uno per processo (sessione con keep-alive)
+_backend_client = None
 
-    if r.status_code == 200:
-        ret = r.json()
-        return RetMsg(**ret)
-    else:
-        return RetMsg(err=True, msg=f'Connection Error ({r.status_code})')
+def _client() -> Client:
+    global _backend_client
+    if _backend_client is None:
+        _backend_client = Client(_read_config())
+    return _backend_client
 
-def _post(path, jdata):
-    config = _read_config()
-    base_url = config['backend'].get('url')
-    try:
-        r = requests.post(f'{base_url}/{path}', json=jdata)
-    except requests.exceptions.ConnectionError:
-        return RetMsg(err=True, msg=f'Connection Error')
+def _get(path, params=None) -> RetMsg:
+    return _client().get(path, params)
 
-    if r.status_code == 200:
-        ret = r.json()
-        return RetMsg(**ret)
-    else:
-        return RetMsg(err=True, msg=f'Connection Error ({r.status_code})')
+def _post(path, jdata):
+    return _client().post(path, jdata)
 
 def _parse_retmsg(res: RetMsg):
     if res.err:
@@ -150,6 +247,9 @@ def _parse_retmsg(res: RetMsg):
                 print(f"[yellow]{pi.msg}[/yellow]")
             else:
                 print(f"[green]{pi.msg}[/green]")
+        if res.msg:
+            # Riepilogo delle operazioni su un gruppo
+            print(f"[bold]{res.msg}[/bold]")
 
     else:
         if res.warn:
@@ -158,34 +258,73 @@ def _parse_retmsg(res: RetMsg):
             print(f"[green]{res.msg}[/green]")
 
 
-def _ls(id_or_name='all', _format='table'):
-    res = _get(f'ls/{id_or_name}')
+def _query_params(args) -> dict:
+    # --fields/--sort/--limit/--filter di ls e ps, filtrati dal backend
+    params = {}
+    if getattr(args, 'fields', None):
+        params['fields'] = args.fields
+    if getattr(args, 'sort', None):
+        params['sort'] = args.sort
+    if getattr(args, 'limit', None) is not None:
+        params['limit'] = args.limit
+    for f in getattr(args, 'filter', None) or []:
+        key, _, value = f.partition('=')
+        params.setdefault(key, []).append(value)
+    return params
+
+def _ls(id_or_name='all', _format='table', params=None):
+    params = dict(params or {})
+    if _format == 'table':
+        # Solo le colonne della tabella, come tuple
+        params.pop('fields', None)
+        params['format'] = 'rows'
+    res = _get(f'ls/{id_or_name}', params)
     if res.err:
         _parse_retmsg(res)
         return ''
 
     if res:
-        payload_sorted = sorted(res.payload, key=lambda item: item.get("pm3_id"))
+        # Con --sort l'ordine e' quello del backend
+        by_id = 'sort' not in params
         if _format == 'table':
-            return _tabulate_ls(payload_sorted)
-        elif _format == 'json':
-            return json.dumps([Process(**i).model_dump() for i in payload_sorted], indent=2)
+            columns = res.payload['columns']
+            rows = [ProcessRow(**dict(zip(columns, r))) for r in res.payload['rows']]
+            return _tabulate_ls(sorted(rows, key=lambda row: row.pm3_id) if by_id else rows)
+        payload = sorted(res.payload, key=lambda item: item.get("pm3_id")) if by_id else res.payload
+        # Documenti gia' validati dal backend, solo i campi nell'ordine del modello
+        payload_sorted = [{k: i[k] for k in Process.model_fields if k in i} for i in payload]
+        if _format == 'json':
+            return json.dumps(payload_sorted, indent=2)
         else:
             return _show_list(payload_sorted)
     else:
         return '[yellow]there is nothing to look at[/yellow]'
 
-def _ps(id_or_name='all', _format='table'):
-    res = _get(f'ps/{id_or_name}')
+# Campi della tabella di pm3 ps: il backend legge solo questi
+PS_TABLE_FIELDS = ','.join(k for k in ProcessStatusLight.model_fields if k != 'time_ago')
+
+def _ps(id_or_name='all', _format='table', params=None):
+    params = dict(params or {})
+    if _format == 'table':
+        params['fields'] = PS_TABLE_FIELDS
+    res = _get(f'ps/{id_or_name}', params)
     if res.err:
         _parse_retmsg(res)
         return ''
 
     if not res.err:
         if res.payload:
-            payload_sorted = sorted(res.payload, key=lambda item: item.get("pm3_id"))
+            if 'sort' in params:
+                payload_sorted = res.payload
+            else:
+                payload_sorted = sorted(res.payload, key=lambda item: item.get("pm3_id"))
             if _format == 'table':
                 return _tabulate_ps(payload_sorted)
+            elif 'fields' in params:
+                # Solo i campi richiesti, nell'ordine richiesto, niente da validare
+                keys = list(dict.fromkeys(['pm3_id', 'pm3_name'] + params['fields'].split(',')))
+                payload_sorted = [{k: p.get(k) for k in keys} for p in payload_sorted]
+                return json.dumps(payload_sorted, indent=2) if _format == 'json' else _show_list(payload_sorted)
             elif _format == 'json':
                 return json.dumps([ProcessStatus(**p).model_dump() for p in payload_sorted], indent=2)
             else:
@@ -196,6 +335,60 @@ def _ps(id_or_name='all', _format='table'):
     else:
         return f'[red]{res.msg}[/red]'
 
+def _sparkline(values, width=20):
+    values = values[-width:]
+    if not values:
+        return ''
+    bars = '▁▂▃▄▅▆▇█'
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return bars[0] * len(values)
+    return ''.join(bars[int((v - lo) / (hi - lo) * (len(bars) - 1))] for v in values)
+
+def _human_bytes(n):
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(n) < 1024:
+            return f'{n:.0f}{unit}' if unit == 'B' else f'{n:.1f}{unit}'
+        n /= 1024
+    return f'{n:.1f}T'
+
+def _top(id_or_name='all', last=None):
+    res = _get(f'metrics/{id_or_name}' + (f'?last={last}' if last else ''))
+    if res.err:
+        _parse_retmsg(res)
+        return ''
+
+    table = Table(show_header=True, header_style="bold magenta")
+    for h in ('pm3_id', 'pm3_name', 'cpu %', 'cpu avg', 'cpu', 'rss', 'rss Δ', 'rss trend',
+              'threads', 'fds', 'read/s', 'write/s'):
+        table.add_column(h)
+
+    for p in sorted(res.payload, key=lambda item: item.get("pm3_id")):
+        m = p['metrics']
+        if not m or not m['time']:
+            table.add_row(str(p['pm3_id']), p['pm3_name'], *['-'] * 10)
+            continue
+        cpu, rss, t = m['cpu_percent'], m['rss'], m['time']
+        if len(t) > 1 and t[-1] > t[-2]:
+            dt = t[-1] - t[-2]
+            read_s = _human_bytes(max(0, m['read_bytes'][-1] - m['read_bytes'][-2]) / dt)
+            write_s = _human_bytes(max(0, m['write_bytes'][-1] - m['write_bytes'][-2]) / dt)
+        else:
+            read_s = write_s = '-'
+        table.add_row(str(p['pm3_id']),
+                      p['pm3_name'],
+                      f'{cpu[-1]:.1f}',
+                      f'{sum(cpu) / len(cpu):.1f}',
+                      _sparkline(cpu),
+                      _human_bytes(rss[-1]),
+                      _human_bytes(rss[-1] - rss[0]),
+                      _sparkline(rss),
+                      f'{m["num_threads"][-1]:.0f}',
+                      f'{m["num_fds"][-1]:.0f}',
+                      read_s,
+                      write_s)
+    return table
+
 def _show_list(data):
     out = []
     for row in data:
@@ -224,30 +417,24 @@ def _tabulate_ps(data):
         table.add_row(*items)
     return table
 
-def _tabulate_ls(data):
-    if len(data) == 0:
+def _tabulate_ls(rows):
+    if len(rows) == 0:
         return '[yellow]there is nothing to look at[/yellow]'
     c = Console()
 
     table = Table(show_header=True, header_style="bold yellow")
+    for h in LIST_FIELDS:
+        table.add_column(h)
 
-    for n, r in enumerate(data):
-        #r = Process(**r).model_dump()  # Validate and sort
-        r = Process(**r)  # Validate and sort
-        if n == 0:
-            for h, h_info in r.model_fields.items():
-                if h_info.json_schema_extra is not None and h_info.json_schema_extra.get('list') == True:
-                    table.add_column(h)
-
+    for r in rows:
         items = []
-        model = r.model_dump()
-        for k in table.columns:
-            if r.autorun is True and k == 'pid' and model['pid'] == -1:
+        for k in LIST_FIELDS:
+            if r.autorun is True and k == 'pid' and r.pid == -1:
                 items.append(f'[red]!!![/red]')
-            elif r.autorun is False and k == 'pid' and model['pid'] == -1:
+            elif r.autorun is False and k == 'pid' and r.pid == -1:
                 items.append(f'[gray]-[/gray]')
             else:
-                items.append(c.render_str(str( model[k.header] )))
+                items.append(c.render_str(str(getattr(r, k))))
         table.add_row(*items)
     return table
 
@@ -282,8 +469,8 @@ def _dump(args) -> str:
                 print(json.dumps(out, indent=4))
             return json.dumps(out, indent=4)
 
-def killtree(pid, killme=True, signal=9):
-    """Kill a process tree"""
+def killtree(pid, killme=True, signal=9, timeout=None):
+    """Kill a process tree, SIGKILL whoever is still alive after timeout"""
     myself = psutil.Process(int(pid))
     children = myself.children(recursive=True)
     if killme:
@@ -292,7 +479,10 @@ def killtree(pid, killme=True, signal=9):
         proc.send_signal(signal)
         logging.debug(f"send ing kill to {proc.pid}" )
 
-    return bool(psutil.wait_procs(children))
+    gone, alive = psutil.wait_procs(children, timeout=timeout)
+    for proc in alive:
+        proc.kill()
+    return bool(psutil.wait_procs(alive))
 
 
 def main():
@@ -325,6 +515,18 @@ def main():
     parser_ps.add_argument('-l', '--list', action='store_true', help='List format')
     parser_ps.add_argument('-j', '--json', action='store_true', help='Json format')
 
+    for parser_q in (parser_ls, parser_ps):
+        parser_q.add_argument('--fields', help='comma separated fields (list and json format)')
+        parser_q.add_argument('--filter', action='append', metavar='FIELD=VALUE',
+                       help='only the rows with this value (ls: status=running|stopped), repeatable')
+        parser_q.add_argument('--sort', help='sort by this field, -field for descending')
+        parser_q.add_argument('--limit', type=int, help='only the first n rows')
+
+    parser_top = subparsers.add_parser('top', help='process metrics history')
+    parser_top.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
+    parser_top.add_argument('-n', '--last', type=int, help='use only the last n samples')
+    parser_top.add_argument('-w', '--watch', type=float, nargs='?', const=2, help='refresh every n seconds')
+
     parser_new = subparsers.add_parser('new', help='create a new process')
     parser_new.add_argument('cmd', help='linux command')
     parser_new.add_argument('--cwd', dest='cwd', help='cwd of executable file')
@@ -337,18 +539,29 @@ def main():
     parser_new.add_argument('--stderr', dest='pm3_stderr', help='std err')
     parser_new.add_argument('--interpreter', dest='interpreter', help='interpreter path')
     parser_new.add_argument('--max-restart', dest='max_restart', type=int, default=1000, help='maximal restart times')
+    parser_new.add_argument('--restart-strategy', dest='restart_strategy', default='exponential',
+                            choices=['immediate', 'fixed', 'exponential'], help='autorun restart strategy')
+    parser_new.add_argument('--restart-delay', dest='restart_delay', type=float, default=0.1,
+                            help='restart delay (or backoff base) in seconds')
+    parser_new.add_argument('--min-uptime', dest='min_uptime', type=float, default=1.0,
+                            help='seconds of uptime before a run is considered stable')
+    parser_new.add_argument('--tail-bytes', dest='tail_buffer_bytes', type=int, default=None,
+                            help='recent output kept in memory by the backend (default: [log] tail_bytes)')
+    parser_new.add_argument('-g', '--group', dest='group', help='group, pm3 start group:<group>')
+    parser_new.add_argument('-t', '--tag', dest='tags', action='append', default=[],
+                            help='tag (repeatable or comma separated), pm3 start tag:<tag>')
 
     parser_edit = subparsers.add_parser('edit', help='edit existing process')
     parser_edit.add_argument('id_or_name', help='id or process name')
 
     parser_start = subparsers.add_parser('start', help='start a process by id or name')
-    parser_start.add_argument('id_or_name', help='id or process name')
+    parser_start.add_argument('id_or_name', help='id or process name, group:<group> or tag:<tag>')
 
     parser_stop = subparsers.add_parser('stop', help='stop a process by id or name')
-    parser_stop.add_argument('id_or_name', help='id or process name')
+    parser_stop.add_argument('id_or_name', help='id or process name, group:<group> or tag:<tag>')
 
     parser_restart = subparsers.add_parser('restart', help='restart a process by id or name')
-    parser_restart.add_argument('id_or_name', help='id or process name')
+    parser_restart.add_argument('id_or_name', help='id or process name, group:<group> or tag:<tag>')
 
     parser_restart = subparsers.add_parser('reset', help='reset process counter for id or name')
     parser_restart.add_argument('id_or_name', help='id or process name')
@@ -363,12 +576,22 @@ def main():
     parser_log = subparsers.add_parser('log', help='show log for a process')
     parser_log.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
     parser_log.add_argument('-f', '--follow', action='store_true', help='tail follow')
+    parser_log.add_argument('--no-color', action='store_true', help='no colored prefix')
+    parser_log.add_argument('--local', action='store_true', help='read the files instead of asking the backend')
     parser_log.add_argument('-n', '--lines', const=10, default=10, nargs='?', type=int, help='how many lines')
+    parser_log.add_argument('--since', type=_parse_time, help='lines captured after (epoch, date or 10m/2h/1d ago)')
+    parser_log.add_argument('--until', type=_parse_time, help='lines captured before (epoch, date or 10m/2h/1d ago)')
+    parser_log.add_argument('--offset', type=int, help='print --lines lines from this byte offset')
 
     parser_err = subparsers.add_parser('err', help='show log for a process')
     parser_err.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
     parser_err.add_argument('-f', '--follow', action='store_true', help='tail follow')
+    parser_err.add_argument('--no-color', action='store_true', help='no colored prefix')
+    parser_err.add_argument('--local', action='store_true', help='read the files instead of asking the backend')
     parser_err.add_argument('-n', '--lines', const=10, default=10, nargs='?', type=int, help='how many lines')
+    parser_err.add_argument('--since', type=_parse_time, help='lines captured after (epoch, date or 10m/2h/1d ago)')
+    parser_err.add_argument('--until', type=_parse_time, help='lines captured before (epoch, date or 10m/2h/1d ago)')
+    parser_err.add_argument('--offset', type=int, help='print --lines lines from this byte offset')
 
     parser_flush = subparsers.add_parser('flush', help='Flush logs')
     parser_flush.add_argument('id_or_name', help='id or process name')
@@ -440,7 +663,8 @@ def main():
                 # pid_to_kill = http_get(pid of backend) or msg['pid']
                 pid_to_kill = int(msg['pid'])
                 print(f"send kill sig to pid {pid_to_kill}")
-                if killtree(pid_to_kill):
+                # SIGTERM lets the backend write pending changes to the database
+                if killtree(pid_to_kill, signal=signal.SIGTERM, timeout=5):
                     print(f"[green]process with pid {pid_to_kill} killed[/green]")
                 else:
                     print(f"[red]can't stop process with pid: {pid_to_kill}[/red]")
@@ -473,12 +697,26 @@ def main():
     elif args.subparser == 'ls':
         id_or_name = args.id_or_name or 'all'
         format_ = 'list' if args.list else 'json' if args.json else 'table'
-        print(_ls(id_or_name, format_))
+        print(_ls(id_or_name, format_, _query_params(args)))
 
     elif args.subparser == 'ps':
         id_or_name = args.id_or_name or 'all'
         format_ = 'list' if args.list else 'json' if args.json else 'table'
-        print(_ps(id_or_name, format_))
+        print(_ps(id_or_name, format_, _query_params(args)))
+    elif args.subparser == 'top':
+        id_or_name = args.id_or_name or 'all'
+        if args.watch:
+            from rich.live import Live
+            try:
+                with Live(_top(id_or_name, args.last), auto_refresh=False) as live:
+                    while True:
+                        time.sleep(args.watch)
+                        live.update(_top(id_or_name, args.last), refresh=True)
+            except KeyboardInterrupt:
+                pass
+        else:
+            print(_top(id_or_name, args.last))
+
     elif args.subparser == 'edit':
         import subprocess
         from shutil import which
@@ -505,13 +743,10 @@ def main():
                     print(f' -> [red]{e}[/red]')
                     sys.exit(1)
 
-                for pr in prl:
-                    p = Process(**pr)
-
-                    post_dest = 'new/rewrite'
-                    res = _post(post_dest, p.model_dump())
-                    _parse_retmsg(res)
-                    logger.debug('done')
+                procs = [Process(**pr).model_dump() for pr in prl]
+                res = _post('new/bulk/rewrite', procs)
+                _parse_retmsg(res)
+                logger.debug('done')
 
             finally:
                 os.remove(tmpFile.name)
@@ -529,7 +764,13 @@ def main():
                     autorun=args.pm3_autorun,
                     stdout=args.pm3_stdout or '',
                     stderr=args.pm3_stderr or '',
-                    max_restart=args.max_restart)
+                    max_restart=args.max_restart,
+                    restart_strategy=args.restart_strategy,
+                    restart_delay=args.restart_delay,
+                    min_uptime=args.min_uptime,
+                    tail_buffer_bytes=args.tail_buffer_bytes,
+                    group=args.group,
+                    tags=[t for tag in args.tags for t in tag.split(',')])
         res = _post('new', p.model_dump())
         if res.err:
             print(res)
@@ -559,29 +800,10 @@ def main():
         _parse_retmsg(res)
 
     elif args.subparser in ('log', 'err'):
-        res = _get(f"ls/{args.id_or_name or 'all'}")
-        if res and not res.err:
-            for p in res.payload:
-                ftt = p['stdout'] if args.subparser == 'log' else p['stderr']
-                print()
-
-                if not Path(ftt).is_file():
-                    print(f"[yellow] !!! file {ftt} don't exist !!! [/yellow]")
-                    continue
-
-                print(f"[yellow2] #### {ftt} #### [/yellow2]")
-
-                try:
-                    if args.follow:
-                        asyncio.run(tailfile(ftt, lines=args.lines))
-                    else:
-                        with open(ftt, "r") as f1:
-                            last_line = f1.readlines()[-args.lines:]
-                            for r in last_line:
-                                print(r, end='')
-                except KeyboardInterrupt:
-                    #print('CTRL+C')
-                    pass
+        if args.local or args.since is not None or args.until is not None or args.offset is not None:
+            _local_log(args)
+        else:
+            _stream_log(args)
 
     elif args.subparser == 'flush':
         res = _get(f"ls/{args.id_or_name}")
@@ -603,6 +825,8 @@ def main():
                             continue
                         else:
                             open(Path(ftt), 'w').close()
+                            if Path(logindex.index_path(ftt)).is_file():
+                                open(logindex.index_path(ftt), 'w').close()
                             print(f"[yellow2] {ftt} is emptied [/yellow2]")
 
     elif args.subparser == 'dump':
@@ -621,6 +845,7 @@ def main():
                 print(f'[red]ERROR:[/red] {load_file} is not a valid json file')
                 print(f' -> [red]{e}[/red]')
                 sys.exit(1)
+        to_load = []
         for pr in prl:
             p = Process(**pr)
             if args.load_yes:
@@ -629,14 +854,18 @@ def main():
                 r = input(f'do you want load {p.pm3_name} ({p.pm3_id}) ?')
 
             if r == 'y':
-                post_dest = 'new' if args.load_rewrite is False else 'new/rewrite'
-                res = _post(post_dest, p.model_dump())
-                _parse_retmsg(res)
+                to_load.append(p.model_dump())
             elif r == 'n':
                 print(f'[yellow]skip import {p.pm3_name} ({p.pm3_id})[/yellow]')
             else:
                 print(f'[red]only y or n are accepted... skip[/red]')
 
+        if to_load:
+            # Tutti i processi in una sola richiesta
+            post_dest = 'new/bulk' if args.load_rewrite is False else 'new/bulk/rewrite'
+            res = _post(post_dest, to_load)
+            _parse_retmsg(res)
+
     elif args.subparser == 'version':
         import importlib.metadata
         version = importlib.metadata.version('PM3')
@@ -1,8 +1,8 @@
 import time
 
-import requests
 from PM3.model.pm3_protocol import RetMsg
 from PM3.model.process import Process
+from PM3.libs.client import Client
 from rich import print
 from pathlib import Path
 from configparser import ConfigParser
@@ -15,21 +15,12 @@ if not Path(config_file).is_file():
 
 config = ConfigParser()
 config.read(config_file)
-base_url = config['backend'].get('url')
 sleep_time = int(config['cron_checker'].get('sleep_time'))
 
+client = Client(config)
+
 def _get(path) -> RetMsg:
-    #TODO: duplicato presente in cli.py
-    try:
-        r = requests.get(f'{base_url}/{path}')
-    except requests.exceptions.ConnectionError as e:
-        return RetMsg(err=True, msg=str(e))
-
-    if r.status_code == 200:
-        ret = r.json()
-        return RetMsg(**ret)
-    else:
-        return RetMsg(err=True, msg='Connection Error')
+    return client.get(path)
 
 def check_autostart():
     res = _get("ls/autorun_enabled")
@@ -0,0 +1,60 @@
+import requests
+from pydantic import ValidationError
+from PM3.model.pm3_protocol import RetMsg
+from PM3.libs.unixsocket import backend_session
+
+
+class Client:
+    """
+    Backend client shared by the cli and the cron checker: one pooled
+    session for all the calls of the process (keep-alive on the Unix socket
+    or TCP) and the same timeouts everywhere. The transport is chosen again
+    after a connection error, e.g. when the backend has been (re)started.
+    """
+    def __init__(self, config):
+        backend = config['backend']
+        self.config = config
+        self.timeout = (backend.getfloat('connect_timeout', fallback=5.0),
+                        backend.getfloat('read_timeout', fallback=60.0))
+        self._session = None
+        self.base_url = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session, self.base_url = backend_session(self.config)
+        return self._session
+
+    def reset(self):
+        if self._session is not None:
+            self._session.close()
+        self._session = None
+
+    def _call(self, method: str, path: str, **kwargs) -> RetMsg:
+        session = self.session
+        try:
+            r = session.request(method, f'{self.base_url}/{path}', timeout=self.timeout, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            self.reset()
+            return RetMsg(err=True, msg=str(e))
+        except requests.exceptions.Timeout as e:
+            return RetMsg(err=True, msg=f'Timeout ({e})')
+
+        if r.status_code == 200:
+            return RetMsg(**r.json())
+        try:
+            # Errors of the backend (e.g. 400 for a bad query) carry a RetMsg
+            return RetMsg(**r.json())
+        except (ValueError, TypeError, ValidationError):
+            return RetMsg(err=True, msg=f'Connection Error ({r.status_code})')
+
+    def get(self, path: str, params: dict = None) -> RetMsg:
+        return self._call('GET', path, params=params)
+
+    def post(self, path: str, jdata) -> RetMsg:
+        return self._call('POST', path, json=jdata)
+
+    def stream(self, path: str, params: dict = None) -> requests.Response:
+        """Streamed response (context manager), no read timeout"""
+        return self.session.get(f'{self.base_url}/{path}', params=params,
+                                stream=True, timeout=(self.timeout[0], None))
@@ -0,0 +1,23 @@
+import time
+import threading
+from collections import deque
+
+
+class EventLog:
+    """Last maxlen events of the backend (exits, crashes, restarts), numbered by seq"""
+    def __init__(self, maxlen: int = 100):
+        self._events = deque(maxlen=maxlen)
+        self.last_seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, **data) -> dict:
+        with self._lock:
+            self.last_seq += 1
+            event = {'seq': self.last_seq, 'time': time.time(), 'kind': kind, **data}
+            self._events.append(event)
+        return event
+
+    def since(self, seq: int = 0, pm3_ids: set = None) -> list:
+        with self._lock:
+            return [e for e in self._events
+                    if e['seq'] > seq and (pm3_ids is None or e.get('pm3_id') in pm3_ids)]
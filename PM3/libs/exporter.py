@@ -0,0 +1,121 @@
+import threading
+from PM3.libs.metrics import own_rows, tree_sample
+
+# Prometheus text exposition format 0.0.4
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _value(v) -> str:
+    if isinstance(v, bool):
+        return '1' if v else '0'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+class Histogram:
+    """Cumulative histogram with one series per label value"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # key = label value, value = [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, value: float):
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for n, b in enumerate(self.buckets):
+                if value <= b:
+                    series[n] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self, name: str, label: str) -> list:
+        out = []
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for key, series in sorted(items):
+            for n, b in enumerate(self.buckets):
+                out.append((f'{name}_bucket', {label: key, 'le': _value(float(b))}, series[n]))
+            out.append((f'{name}_bucket', {label: key, 'le': '+Inf'}, series[-1]))
+            out.append((f'{name}_sum', {label: key}, series[-2]))
+            out.append((f'{name}_count', {label: key}, series[-1]))
+        return out
+
+
+class Exposition:
+    """Builder of a text exposition page"""
+    def __init__(self):
+        self._lines = []
+
+    def add(self, name: str, metric_type: str, help_text: str, samples: list):
+        """samples: list of (labels, value) or (name, labels, value)"""
+        self._lines.append(f'# HELP {name} {help_text}')
+        self._lines.append(f'# TYPE {name} {metric_type}')
+        for sample in samples:
+            sample_name, labels, value = sample if len(sample) == 3 else (name, *sample)
+            if value is None:
+                continue
+            self._lines.append(f'{sample_name}{_labels(labels)} {_value(value)}')
+
+    def render(self) -> str:
+        return '\n'.join(self._lines) + '\n'
+
+
+def render(docs: list, snapshot: dict, stats: dict, http: Histogram, now: float) -> str:
+    """
+    docs: process documents of the registry
+    snapshot: last psutil snapshot, key = root pid, value = as_dict() rows
+    stats: Pm3Table.stats()
+    """
+    exp = Exposition()
+    up, restarts, cpu, rss, uptime, exit_code, crash_loop = [], [], [], [], [], [], []
+    # The processes started by the backend are also in its tree
+    managed = {doc['pid'] for doc in docs if doc['pid'] and doc['pid'] > 0}
+    for doc in sorted(docs, key=lambda x: x['pm3_id']):
+        labels = {'pm3_id': doc['pm3_id'], 'pm3_name': doc['pm3_name']}
+        rows = snapshot.get(doc['pid']) if doc['pid'] and doc['pid'] > 0 else None
+        up.append((labels, rows is not None))
+        restarts.append((labels, max(doc.get('restart') or 0, 0)))
+        crash_loop.append((labels, bool(doc.get('crash_loop'))))
+        exit_code.append((labels, doc.get('exit_code')))
+        if rows:
+            sample = tree_sample(own_rows(rows, managed), now)
+            cpu.append((labels, sample['cpu_percent']))
+            rss.append((labels, int(sample['rss'])))
+            started = rows[0].get('create_time') or doc.get('started_at')
+            if started:
+                uptime.append((labels, round(now - started, 3)))
+
+    exp.add('pm3_process_up', 'gauge', 'Process is running', up)
+    exp.add('pm3_process_restarts_total', 'counter', 'Restarts of the process', restarts)
+    exp.add('pm3_process_cpu_percent', 'gauge', 'CPU percent of the process tree', cpu)
+    exp.add('pm3_process_resident_memory_bytes', 'gauge', 'RSS of the process tree', rss)
+    exp.add('pm3_process_uptime_seconds', 'gauge', 'Seconds since the process started', uptime)
+    exp.add('pm3_process_exit_code', 'gauge', 'Exit code of the last run', exit_code)
+    exp.add('pm3_process_crash_loop', 'gauge', 'Process is in crash-loop', crash_loop)
+
+    exp.add('pm3_http_request_duration_seconds', 'histogram', 'Latency of the backend requests',
+            http.samples('pm3_http_request_duration_seconds', 'endpoint'))
+    exp.add('pm3_db_flushes_total', 'counter', 'Writes of the process table', [({}, stats['flush_count'])])
+    exp.add('pm3_db_records_written_total', 'counter', 'Records written to the process table',
+            [({}, stats['records_written'])])
+    exp.add('pm3_table_lock_waits_total', 'counter', 'Contended acquisitions of the table lock',
+            [({}, stats['lock_waits'])])
+    exp.add('pm3_table_lock_wait_seconds_total', 'counter', 'Time spent waiting for the table lock',
+            [({}, round(stats['lock_wait_seconds'], 6))])
+    return exp.render()
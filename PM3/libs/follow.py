@@ -0,0 +1,237 @@
+import os
+import sys
+import errno
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+from PM3.libs.logindex import tail
+
+READ_SIZE = 1 << 16
+# A line longer than this is printed in pieces
+MAX_PARTIAL = 1 << 16
+COLORS = ('36', '33', '32', '35', '34', '91', '96', '93', '92', '95', '94')
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+def line_head(prefix: str, color: str = None) -> str:
+    if color:
+        return f'\x1b[{color}m{prefix} |\x1b[0m '
+    return f'{prefix} | '
+
+
+class Inotify:
+    """Minimal inotify binding with ctypes, Linux only"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def read(self) -> list:
+        """[(wd, mask, name)] of the pending events"""
+        events = []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return events
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0').decode(errors='replace')
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FollowedFile:
+    """
+    Read position of a followed file. A new inode at the same path is a
+    rotation (the old file is read to the end first), a size smaller than
+    the position is a truncation (reading restarts from 0).
+    """
+    def __init__(self, path: str, prefix: str, color: str = None):
+        self.path = path
+        self.prefix = prefix
+        self.color = color
+        self._f = None
+        self._ino = None
+        self._partial = b''
+
+    def open(self, at_end: bool = True):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        self._ino = os.fstat(f.fileno()).st_ino
+        if at_end:
+            f.seek(0, os.SEEK_END)
+        self._f = f
+
+    def _read_all(self) -> list:
+        lines = []
+        while True:
+            data = self._f.read(READ_SIZE)
+            if not data:
+                return lines
+            data = self._partial + data
+            parts = data.split(b'\n')
+            self._partial = parts.pop()
+            lines.extend(parts)
+            if len(self._partial) > MAX_PARTIAL:
+                lines.append(self._partial)
+                self._partial = b''
+
+    def read(self) -> list:
+        """New complete lines (bytes, without newline)"""
+        if self._f is None:
+            self.open(at_end=False)
+            if self._f is None:
+                return []
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        lines = []
+        if st is not None and st.st_ino != self._ino:
+            # Rotated: end of the old file, then the new one from the start
+            lines = self._read_all()
+            self._f.close()
+            self._partial = b''
+            self.open(at_end=False)
+        elif st is not None and st.st_size < self._f.tell():
+            # Truncated
+            self._f.seek(0)
+            self._partial = b''
+        return lines + self._read_all()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+class Follower:
+    """
+    Follow many log files in one asyncio loop and interleave their lines
+    with a prefix. inotify watches the directories (rotation creates new
+    files), without inotify the files are polled every poll_interval.
+    """
+    def __init__(self, files: list, lines: int = 10, colors: bool = None,
+                 poll_interval: float = 0.5, out=None):
+        # files: [(path, prefix)]
+        self.out = out or sys.stdout
+        self.colors = self.out.isatty() if colors is None else colors
+        width = max((len(prefix) for _, prefix in files), default=0)
+        self.files = []
+        for n, (path, prefix) in enumerate(files):
+            color = COLORS[n % len(COLORS)] if self.colors else None
+            self.files.append(FollowedFile(path, prefix.ljust(width), color))
+        self.lines = lines
+        self.poll_interval = poll_interval
+        self._inotify = None
+        # key = watch descriptor, value = {file name: FollowedFile}
+        self._watches = {}
+        self._dirty = set()
+        self._event = None
+
+    def _write(self, ff: FollowedFile, lines: list):
+        if not lines:
+            return
+        head = line_head(ff.prefix, ff.color)
+        self.out.write(''.join(f'{head}{line}\n' for line in lines))
+        self.out.flush()
+
+    def _setup_inotify(self) -> bool:
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError):
+            return False
+        by_dir = {}
+        for ff in self.files:
+            by_dir.setdefault(os.path.dirname(os.path.abspath(ff.path)), []).append(ff)
+        mask = IN_MODIFY | IN_ATTRIB | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+        for directory, files in by_dir.items():
+            try:
+                wd = self._inotify.add_watch(directory, mask)
+            except OSError as e:
+                if e.errno in (errno.ENOSPC, errno.EMFILE):
+                    # Out of watches: poll everything
+                    self._inotify.close()
+                    self._inotify = None
+                    return False
+                continue
+            watch = self._watches.setdefault(wd, {})
+            for ff in files:
+                watch[os.path.basename(ff.path)] = ff
+        return True
+
+    def _on_inotify(self):
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self._dirty.update(self.files)
+                continue
+            ff = self._watches.get(wd, {}).get(name)
+            if ff is not None:
+                self._dirty.add(ff)
+        if self._dirty:
+            self._event.set()
+
+    async def run(self):
+        for ff in self.files:
+            if self.lines and os.path.isfile(ff.path):
+                self._write(ff, [line.rstrip('\n') for line in tail(ff.path, self.lines)])
+            ff.open(at_end=True)
+        self._event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # With inotify the timeout only recovers files missing at start
+        timeout = self.poll_interval
+        if self._setup_inotify():
+            loop.add_reader(self._inotify.fd, self._on_inotify)
+            timeout = 5.0
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout)
+                    dirty, self._dirty = self._dirty, set()
+                except asyncio.TimeoutError:
+                    dirty = self.files
+                self._event.clear()
+                for ff in dirty:
+                    self._write(ff, [line.decode(errors='replace') for line in ff.read()])
+        finally:
+            if self._inotify is not None:
+                loop.remove_reader(self._inotify.fd)
+                self._inotify.close()
+            for ff in self.files:
+                ff.close()
+
+
+def follow(files: list, lines: int = 10, colors: bool = None):
+    """Blocking: follow [(path, prefix)] until CTRL+C"""
+    try:
+        asyncio.run(Follower(files, lines=lines, colors=colors).run())
+    except KeyboardInterrupt:
+        pass
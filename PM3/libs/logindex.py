@@ -0,0 +1,164 @@
+import os
+import time
+import struct
+from bisect import bisect_right
+
+# Sidecar <log>.idx: fixed size records (byte offset, line number, timestamp).
+# The offset is always at the beginning of a line, line numbers count from
+# the first indexed byte, the timestamp is when the line was captured.
+RECORD = struct.Struct('<QQd')
+BLOCK_SIZE = 1 << 16
+
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+
+class IndexWriter:
+    """
+    Append a record every index_bytes bytes or index_seconds seconds of
+    output, whichever comes first: the index stays sparse for chatty
+    processes and keeps a fine time resolution for quiet ones.
+    """
+    def __init__(self, path: str, offset: int, index_bytes: int = 1 << 20, index_seconds: float = 1.0):
+        self.path = index_path(path)
+        self.index_bytes = index_bytes
+        self.index_seconds = index_seconds
+        self._f = open(self.path, 'ab')
+        entries = read_index(path, size=offset)
+        if entries and self._f.tell() == len(entries) * RECORD.size:
+            # Continue the existing index, count the lines after its last record
+            last_offset, last_line, _ = entries[-1]
+            self.line = last_line + _count_lines(path, last_offset, offset)
+            self._last = entries[-1]
+        else:
+            # Missing, truncated or stale index: start from here
+            self._reset(offset)
+
+    def _reset(self, offset: int):
+        self._f.truncate(0)
+        self.line = 0
+        self._last = (offset, 0, time.time())
+        self._f.write(RECORD.pack(*self._last))
+
+    def observe(self, data: bytes, offset: int):
+        """data was written at offset of the log file"""
+        newlines = data.count(b'\n')
+        if newlines == 0:
+            return
+        now = time.time()
+        end = offset + len(data)
+        if end - self._last[0] >= self.index_bytes or now - self._last[2] >= self.index_seconds:
+            # Record the beginning of the line after the last complete one
+            pos = data.rfind(b'\n') + 1
+            self._last = (offset + pos, self.line + newlines, now)
+            self._f.write(RECORD.pack(*self._last))
+        self.line += newlines
+
+    def truncated(self, offset: int):
+        self._reset(offset)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def _count_lines(path: str, start: int, end: int) -> int:
+    n = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            block = f.read(min(BLOCK_SIZE, end - start))
+            if not block:
+                break
+            n += block.count(b'\n')
+            start += len(block)
+    return n
+
+
+def read_index(path: str, size: int = None) -> list:
+    """Records of the index of path, without the ones beyond its size"""
+    try:
+        with open(index_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return []
+    n = len(data) // RECORD.size
+    entries = [RECORD.unpack_from(data, i * RECORD.size) for i in range(n)]
+    if entries and entries[0][0] > size:
+        # The log has been truncated after the last write of the index
+        return []
+    # Records of data still in the write buffer of the log
+    while entries and entries[-1][0] > size:
+        entries.pop()
+    return entries
+
+
+def tail(path: str, lines: int = 10) -> list:
+    """Last lines of path, reading backward by blocks"""
+    if lines <= 0:
+        return []
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        blocks = []
+        newlines = 0
+        while pos > 0 and newlines <= lines:
+            step = min(BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+    data = b''.join(reversed(blocks))
+    return [i.decode(errors='replace') for i in data.splitlines(keepends=True)[-lines:]]
+
+
+def read_from(path: str, offset: int = 0, lines: int = None, until_offset: int = None) -> tuple:
+    """
+    Lines starting at byte offset, at most lines (None = all) and not
+    beyond until_offset. Return (lines, offset of the next line).
+    """
+    out = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while lines is None or len(out) < lines:
+            if until_offset is not None and offset >= until_offset:
+                break
+            line = f.readline()
+            if not line:
+                break
+            if not line.endswith(b'\n'):
+                # Incomplete line still being written
+                break
+            out.append(line.decode(errors='replace'))
+            offset += len(line)
+    return out, offset
+
+
+def time_range(path: str, since: float = None, until: float = None) -> tuple:
+    """
+    Byte offsets (start, end) of the lines captured between since and until,
+    at the resolution of the index. end is None for the end of the file.
+    Without an index the whole file is returned.
+    """
+    entries = read_index(path)
+    if not entries:
+        return 0, None
+    times = [e[2] for e in entries]
+    start = 0
+    if since is not None:
+        # Last record not after since: the lines before it are older
+        i = bisect_right(times, since) - 1
+        start = entries[i][0] if i >= 0 else 0
+    end = None
+    if until is not None:
+        i = bisect_right(times, until)
+        end = entries[i][0] if i < len(entries) else None
+    return start, end
@@ -0,0 +1,365 @@
+import os
+import glob
+import gzip
+import time
+import queue
+import shutil
+import logging
+import selectors
+import threading
+from datetime import datetime
+from PM3.libs.logindex import IndexWriter, index_path
+from PM3.libs.tailbuf import TailPool
+
+READ_SIZE = 1 << 16
+# Max bytes read from one pipe before serving the others
+READ_BURST = 16 * READ_SIZE
+
+
+def _compress(path: str):
+    try:
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.unlink(path)
+    except OSError as e:
+        logging.error(f'compressing {path} failed: {e}')
+
+
+class Compressor(threading.Thread):
+    """Gzip the rotated segments out of the capture loop"""
+    def __init__(self):
+        super().__init__(name='pm3_log_compressor', daemon=True)
+        self.queue = queue.Queue()
+
+    def run(self):
+        while True:
+            _compress(self.queue.get())
+            self.queue.task_done()
+
+
+class RotatingWriter:
+    """
+    Buffered append-only writer of a log file.
+    The file is rotated to <path>.<YYYYmmdd-HHMMSS-micros> when it is bigger than
+    max_bytes or older than rotate_interval seconds (0 = never),
+    only the last backup_count segments are kept.
+    With index_bytes > 0 the live file has a sparse <path>.idx (see logindex).
+    """
+    def __init__(self, path: str, max_bytes: int = 0, rotate_interval: float = 0,
+                 backup_count: int = 10, compressor: Compressor = None, buffer_size: int = 1 << 18,
+                 index_bytes: int = 0):
+        self.path = path
+        self.index_bytes = index_bytes
+        self.index = None
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compressor = compressor
+        self.buffer_size = buffer_size
+        self._f = None
+        self._open()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._f = open(self.path, 'ab', buffering=self.buffer_size)
+        self.size = self._f.tell()
+        self.opened_at = time.time()
+        if self.index_bytes:
+            self.index = IndexWriter(self.path, self.size, index_bytes=self.index_bytes)
+
+    def write(self, data: bytes):
+        self._f.write(data)
+        if self.index is not None:
+            self.index.observe(data, self.size)
+        self.size += len(data)
+        if self.max_bytes and self.size >= self.max_bytes:
+            # The file may have been truncated by `pm3 flush`
+            self._f.flush()
+            self.size = os.fstat(self._f.fileno()).st_size
+            if self.size >= self.max_bytes:
+                self.rotate()
+
+    def flush(self):
+        # Data first: the index never points beyond the file
+        self._f.flush()
+        if self.index is not None:
+            self.index.flush()
+
+    def tick(self, now: float):
+        if self.index is not None:
+            size = os.fstat(self._f.fileno()).st_size
+            if size < self.size:
+                # Truncated by `pm3 flush`
+                self.size = size
+                self.index.truncated(size)
+        if self.rotate_interval and now - self.opened_at >= self.rotate_interval:
+            if self.size > 0:
+                self.rotate()
+            else:
+                self.opened_at = now
+
+    def rotate(self):
+        self._close()
+        # Microseconds keep the names unique and sorted by age
+        target = f'{self.path}.{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}'
+        try:
+            os.rename(self.path, target)
+        except FileNotFoundError:
+            target = None
+        self._open()
+        if target is not None and self.compressor is not None:
+            self.compressor.queue.put(target)
+        self._prune()
+
+    def segments(self) -> list:
+        """Rotated segments, the oldest first"""
+        return sorted(glob.glob(glob.escape(self.path) + '.[0-9]*'))
+
+    def _prune(self):
+        if self.backup_count <= 0:
+            return
+        for old in self.segments()[:-self.backup_count]:
+            try:
+                os.unlink(old)
+            except OSError:
+                pass
+
+    def _close(self):
+        self._f.close()
+        if self.index is not None:
+            # Only the live file is indexed
+            self.index.close()
+            self.index = None
+            try:
+                os.unlink(index_path(self.path))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self._f.close()
+        if self.index is not None:
+            self.index.close()
+
+
+class LogCapture(threading.Thread):
+    """
+    Reads stdout/stderr of the children from pipes with a single selector
+    loop and writes them with RotatingWriter. Reads are done in blocks of
+    64 KiB, there is no per-line work. Buffers are flushed every
+    flush_interval seconds.
+
+        out_fd, err_fd = capture.attach(proc.stdout, proc.stderr, proc.pm3_id)
+        p = sp.Popen(cmd, stdout=out_fd, stderr=err_fd)
+        capture.release(out_fd, err_fd)
+
+    With a key the recent output is also kept in memory, in tails[key].
+    """
+    def __init__(self, max_bytes: int = 0, rotate_interval: float = 0, backup_count: int = 10,
+                 compress: bool = False, buffer_size: int = 1 << 18, flush_interval: float = 1.0,
+                 index_bytes: int = 1 << 20, tail_bytes: int = 64 * 1024,
+                 tail_max_bytes: int = 16 * 1024 * 1024):
+        super().__init__(name='pm3_log_capture', daemon=True)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.index_bytes = index_bytes
+        self.compressor = Compressor() if compress else None
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        # (read fd, path, TailBuffer, stream) waiting to be registered in the selector
+        self._pending = []
+        # key = path, value = [RotatingWriter, number of pipes writing it]
+        self._writers = {}
+        self._last_flush = time.monotonic()
+        # key = attach() key, value = TailBuffer
+        self.tails = TailPool(tail_max_bytes, tail_bytes)
+        # key = attach() key, value = pipes still open
+        self._open_pipes = {}
+        # Notified after new output, see wait_output()
+        self._output = threading.Condition()
+
+    def attach(self, stdout: str, stderr: str, key=None, tail_bytes: int = None) -> tuple:
+        """
+        Return the write ends of the pipes for the child (stdout, stderr).
+        tail_bytes: size of the in-memory buffer of key (None = default, 0 = none)
+        """
+        tail = None
+        tail_bytes = self.tails.default_bytes if tail_bytes is None else tail_bytes
+        if key is not None and tail_bytes > 0:
+            tail = self.tails.buffer(key, tail_bytes)
+        elif key is not None:
+            self.tails.remove(key)
+        fds = []
+        pending = []
+        for path, stream in ((stdout, 'out'), (stderr, 'err')):
+            r, w = os.pipe()
+            os.set_blocking(r, False)
+            pending.append((r, path, key, tail, stream))
+            fds.append(w)
+        with self._lock:
+            self._pending.extend(pending)
+            if key is not None:
+                self._open_pipes[key] = self._open_pipes.get(key, 0) + len(pending)
+        self.wake()
+        return tuple(fds)
+
+    def forget(self, key):
+        self.tails.remove(key)
+
+    def wait_closed(self, key, timeout: float) -> bool:
+        """Wait until the output of key has been read to the end (EOF)"""
+        deadline = time.monotonic() + timeout
+        with self._output:
+            while self._open_pipes.get(key):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._output.wait(remaining)
+        return True
+
+    def wait_output(self, timeout: float) -> bool:
+        """Wait for new output of any process"""
+        with self._output:
+            return self._output.wait(timeout)
+
+    def release(self, *fds):
+        """Close the write ends in the backend after the fork"""
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def flush(self):
+        with self._lock:
+            for writer, _ in self._writers.values():
+                try:
+                    writer.flush()
+                except (OSError, ValueError):
+                    pass
+
+    def _register_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            for r, path, key, tail, stream in pending:
+                entry = self._writers.get(path)
+                if entry is None:
+                    try:
+                        writer = RotatingWriter(path, self.max_bytes, self.rotate_interval,
+                                                self.backup_count, self.compressor, self.buffer_size,
+                                                self.index_bytes)
+                    except OSError as e:
+                        logging.error(f'cannot open log {path}: {e}')
+                        os.close(r)
+                        self._pipe_closed(key)
+                        continue
+                    entry = self._writers[path] = [writer, 0]
+                entry[1] += 1
+                self._selector.register(r, selectors.EVENT_READ, (path, key, tail, stream))
+
+    def _pipe_closed(self, key):
+        if key is None:
+            return
+        with self._output:
+            self._open_pipes[key] -= 1
+            if self._open_pipes[key] <= 0:
+                del self._open_pipes[key]
+            self._output.notify_all()
+
+    def _close_pipe(self, fd, path, key):
+        self._selector.unregister(fd)
+        os.close(fd)
+        with self._lock:
+            entry = self._writers[path]
+            entry[1] -= 1
+            if entry[1] == 0:
+                entry[0].close()
+                del self._writers[path]
+        self._pipe_closed(key)
+
+    def _read(self, fd, path, key, tail, stream):
+        writer = self._writers[path][0]
+        total = 0
+        while total < READ_BURST:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logging.error(f'reading log pipe of {path} failed: {e}')
+                data = b''
+            if not data:
+                # EOF: all the writers (child and grandchildren) are gone
+                self._close_pipe(fd, path, key)
+                break
+            try:
+                writer.write(data)
+            except OSError as e:
+                logging.error(f'writing {path} failed: {e}')
+            if tail is not None:
+                self.tails.append(tail, stream, data)
+            total += len(data)
+        if total and tail is not None:
+            with self._output:
+                self._output.notify_all()
+
+    def _tick(self):
+        now = time.monotonic()
+        if now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        wall = time.time()
+        with self._lock:
+            for writer, _ in self._writers.values():
+                try:
+                    writer.flush()
+                    writer.tick(wall)
+                except OSError as e:
+                    logging.error(f'flushing {writer.path} failed: {e}')
+
+    def start(self):
+        if self.compressor is not None:
+            self.compressor.start()
+        super().start()
+
+    def run(self):
+        while True:
+            for key, _ in self._selector.select(self.flush_interval):
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self._register_pending()
+                else:
+                    self._read(key.fd, *key.data)
+            self._tick()
+
+
+def make_capture(log_section) -> LogCapture:
+    """LogCapture from the [log] section of config.ini, None if disabled"""
+    if not log_section.getboolean('capture', fallback=True):
+        return None
+    return LogCapture(max_bytes=log_section.getint('max_bytes', fallback=50 * 1024 * 1024),
+                      rotate_interval=log_section.getfloat('rotate_interval', fallback=0),
+                      backup_count=log_section.getint('backup_count', fallback=10),
+                      compress=log_section.getboolean('compress', fallback=False),
+                      buffer_size=log_section.getint('buffer_size', fallback=1 << 18),
+                      flush_interval=log_section.getfloat('flush_interval', fallback=1.0),
+                      index_bytes=(log_section.getint('index_bytes', fallback=1 << 20)
+                                   if log_section.getboolean('index', fallback=True) else 0),
+                      tail_bytes=log_section.getint('tail_bytes', fallback=64 * 1024),
+                      tail_max_bytes=log_section.getint('tail_max_bytes', fallback=16 * 1024 * 1024))
@@ -0,0 +1,108 @@
+import json
+import time
+from PM3.libs.follow import FollowedFile
+from PM3.libs.logindex import tail
+from PM3.libs.tailbuf import LineSplitter
+
+STREAMS = ('out', 'err', 'both')
+# Silence longer than this sends an empty line: a client that is gone is noticed
+HEARTBEAT = 15.0
+
+
+class _Source:
+    """Output of one process: its TailBuffer, or its files when not captured"""
+    def __init__(self, proc, capture, stream: str):
+        self.proc = proc
+        self.capture = capture
+        self.stream = stream
+        self.splitter = LineSplitter()
+        self.seq = 0
+        self.files = []
+
+    def _paths(self) -> list:
+        paths = []
+        for stream, path in (('out', self.proc.stdout), ('err', self.proc.stderr)):
+            if self.stream in (stream, 'both') and path not in [p for _, p in paths]:
+                paths.append((stream, path))
+        return paths
+
+    def _tail(self):
+        return self.capture.tails.get(self.proc.pm3_id) if self.capture is not None else None
+
+    def initial(self, lines: int, follow: bool) -> list:
+        """Last lines, from memory when the buffer has enough of them"""
+        buf = self._tail()
+        if buf is not None:
+            self.seq, chunks = buf.since(0, self.stream)
+            out = []
+            for _, _, stream, data, starts_line in chunks:
+                out.extend(self.splitter.feed(stream, data, starts_line))
+            if not follow:
+                out.extend(self.splitter.flush())
+            if len(out) >= lines:
+                return out[-lines:] if lines > 0 else []
+        # Not enough in memory: the files (flushed first)
+        if self.capture is not None:
+            self.capture.flush()
+        out = []
+        for stream, path in self._paths():
+            try:
+                for line in tail(path, lines):
+                    # With a buffer the incomplete line comes from the splitter
+                    if line.endswith('\n') or buf is None or not follow:
+                        out.append((stream, line.rstrip('\n')))
+            except FileNotFoundError:
+                pass
+        if buf is None and follow:
+            # Not captured (nohup): follow the files
+            for stream, path in self._paths():
+                ff = FollowedFile(path, stream)
+                ff.open(at_end=True)
+                self.files.append(ff)
+        return out[-lines:] if lines > 0 else []
+
+    def new_lines(self) -> list:
+        out = []
+        # Followed from the files (no buffer at the start): a buffer created
+        # later has the same lines, it is not read
+        buf = self._tail() if not self.files else None
+        if buf is not None:
+            self.seq, chunks = buf.since(self.seq, self.stream)
+            for _, _, stream, data, starts_line in chunks:
+                out.extend(self.splitter.feed(stream, data, starts_line))
+        for ff in self.files:
+            out.extend((ff.prefix, line.decode(errors='replace')) for line in ff.read())
+        return out
+
+    def rows(self, lines: list) -> str:
+        return ''.join(json.dumps({'pm3_id': self.proc.pm3_id, 'pm3_name': self.proc.pm3_name,
+                                   'stream': stream, 'line': line}) + '\n' for stream, line in lines)
+
+    def close(self):
+        for ff in self.files:
+            ff.close()
+
+
+def log_lines(procs: list, capture, lines: int = 10, follow: bool = False,
+              stream: str = 'out', poll_interval: float = 0.5):
+    """NDJSON rows {pm3_id, pm3_name, stream, line} of the output of procs"""
+    sources = [_Source(proc, capture, stream) for proc in procs]
+    try:
+        for source in sources:
+            yield source.rows(source.initial(lines, follow))
+        last_sent = time.monotonic()
+        while follow:
+            if capture is not None:
+                capture.wait_output(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            chunk = ''.join(source.rows(source.new_lines()) for source in sources)
+            if chunk:
+                last_sent = time.monotonic()
+                yield chunk
+            elif time.monotonic() - last_sent > HEARTBEAT:
+                last_sent = time.monotonic()
+                yield '\n'
+    finally:
+        for source in sources:
+            source.close()
@@ -0,0 +1,73 @@
+from array import array
+
+# Metriche registrate per ogni processo (processo + figli)
+METRICS = ('time', 'cpu_percent', 'rss', 'num_threads', 'num_fds', 'read_bytes', 'write_bytes')
+
+
+class MetricsRing:
+    """
+    Fixed size ring buffer of samples, one array('d') per metric:
+    size * len(METRICS) * 8 bytes per process, whatever the uptime.
+    """
+    __slots__ = ('size', '_data', '_next', '_count')
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data = {m: array('d', bytes(8 * size)) for m in METRICS}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample: dict):
+        for m in METRICS:
+            self._data[m][self._next] = sample.get(m) or 0.0
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def to_dict(self, last: int = None) -> dict:
+        """Samples from the oldest to the newest"""
+        n = self._count if last is None else min(last, self._count)
+        start = (self._next - n) % self.size
+        out = {}
+        for m in METRICS:
+            data = self._data[m]
+            if start + n <= self.size:
+                out[m] = data[start:start + n].tolist()
+            else:
+                out[m] = data[start:].tolist() + data[:(start + n) % self.size].tolist()
+        return out
+
+
+def own_rows(rows: list, managed) -> list:
+    """
+    as_dict() rows of a process tree (root first, every parent before its
+    children) without the other managed processes and their subtrees:
+    they have their own totals
+    """
+    root = rows[0]['pid'] if rows else None
+    skipped = set()
+    out = []
+    for row in rows:
+        if row['pid'] != root and (row['pid'] in managed or row.get('ppid') in skipped):
+            skipped.add(row['pid'])
+            continue
+        out.append(row)
+    return out
+
+
+def tree_sample(rows: list, now: float) -> dict:
+    """Sum of the psutil as_dict() rows of a process tree"""
+    sample = dict.fromkeys(METRICS, 0.0)
+    sample['time'] = now
+    for row in rows:
+        sample['cpu_percent'] += row.get('cpu_percent') or 0.0
+        sample['num_threads'] += row.get('num_threads') or 0
+        sample['num_fds'] += row.get('num_fds') or 0
+        if row.get('memory_info') is not None:
+            sample['rss'] += row['memory_info'].rss
+        if row.get('io_counters') is not None:
+            sample['read_bytes'] += row['io_counters'].read_bytes
+            sample['write_bytes'] += row['io_counters'].write_bytes
+    return sample
@@ -1,10 +1,11 @@
 import os
-from time import sleep
+import heapq
+import threading
+from contextlib import contextmanager
 from PM3.model.pm3_protocol import ION
-from PM3.model.process import Process
-from tinydb import where
-from tinydb.table import Table
-import fcntl
+from PM3.model.process import Process, pid_alive, status_fields
+from PM3.libs.storage import StorageEngine
+from PM3.libs.rwlock import RWLock
 
 def hidden_proc(x: str) -> bool:
     return x.startswith('__') and x.endswith('__')
@@ -13,111 +14,358 @@ from filelock import FileLock
 
 
 class Pm3Table:
-    def __init__(self, tbl: Table, lock_file: str):
-        self.tbl = tbl
+    def __init__(self, engine: StorageEngine, lock_file: str, id_reuse: bool = False):
+        self.engine = engine
         self.lock_file_name = lock_file
 
-        self.locked_all = self.locked_function(self.tbl.all)
-        self.locked_contains = self.locked_function(self.tbl.contains)
-        self.locked_get = self.locked_function(self.tbl.get)
-        self.locked_remove = self.locked_function(self.tbl.remove)
-        self.locked_update = self.locked_function(self.tbl.update)
+        self.locked_load = self.locked_function(self.engine.load)
+        self.locked_save = self.locked_function(self.engine.save)
+
+        # In-memory registry: the backend is the only writer of the table,
+        # so reads are served from here and changes are written back by flush().
+        # key = pm3_id, value = process document
+        self._procs = {}
+        # key = pm3_name, value = pm3_id
+        self._names = {}
+        # key = group / tag, value = set of pm3_id
+        self._groups = {}
+        self._tags = {}
+        # pm3_id changed since the last flush
+        self._dirty = set()
+        # Id allocator: highest id ever given (persisted with the table) and,
+        # with id_reuse, a heap of the free id ranges (first, last) below it
+        self.id_reuse = id_reuse
+        self._high_water = 0
+        self._free = []
+        # Shared lock for reads, exclusive lock for writes
+        self._lock = RWLock()
+        self._flush_lock = threading.Lock()
+        # Write stats, exposed by /metrics
+        self.flush_count = 0
+        self.records_written = 0
+        self.reload()
 
     def locked_function(this, func):
+        # The FileLock protects the database file from other processes,
+        # threads of the backend are already serialized by flush()
         def inner(*args, **kwargs):
-            print(f"locking for func  {func}...", flush=True)
-            sleep(0.1)
             with FileLock(this.lock_file_name):
-                print(f"> acquired lock...", flush=True)
-                output = func(*args, **kwargs)
-                #sleep(0.1)
-                print("> unlocking...", flush=True)
-            # sleep(0.1)
-            print("unlocked", flush=True)
-            return output
+                return func(*args, **kwargs)
         return inner
-    
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several operations under one exclusive lock acquisition:
+            with ptbl.transaction():
+                pm3_id = ptbl.next_id()
+                ptbl.insert(proc)
+        """
+        with self._lock.write_locked():
+            yield self
+
+    def reload(self):
+        docs = self.locked_load()
+        meta = self.engine.load_meta()
+        with self._lock.write_locked():
+            self._procs = {i['pm3_id']: dict(i) for i in docs}
+            self._names = {i['pm3_name']: i['pm3_id'] for i in docs}
+            self._groups, self._tags = {}, {}
+            for doc in self._procs.values():
+                self._index(doc)
+            self._high_water = max(int(meta.get('high_water', 0)), max(self._procs, default=0))
+            self._free = []
+            if self.id_reuse:
+                # The gaps between the ids, O(n log n) whatever the ids
+                prev = 0
+                for pm3_id in sorted(self._procs) + [self._high_water + 1]:
+                    if pm3_id > prev + 1:
+                        self._free.append((prev + 1, pm3_id - 1))
+                    prev = pm3_id
+                heapq.heapify(self._free)
+
+    def _index(self, doc):
+        # Called with the write lock, records of older versions have no group/tags
+        if doc.get('group'):
+            self._groups.setdefault(doc['group'], set()).add(doc['pm3_id'])
+        for tag in doc.get('tags') or ():
+            self._tags.setdefault(tag, set()).add(doc['pm3_id'])
+
+    def _unindex(self, doc):
+        for index, keys in ((self._groups, [doc.get('group')] if doc.get('group') else []),
+                            (self._tags, doc.get('tags') or [])):
+            for key in keys:
+                members = index.get(key)
+                if members is not None:
+                    members.discard(doc['pm3_id'])
+                    if not members:
+                        index.pop(key)
+
+    def _get_doc(self, val, col='pm3_id'):
+        # O(1) lookup on the indexed columns
+        with self._lock.read_locked():
+            if col == 'pm3_id':
+                return self._procs.get(val)
+            elif col == 'pm3_name':
+                pm3_id = self._names.get(val)
+                return None if pm3_id is None else self._procs.get(pm3_id)
+            for doc in self._procs.values():
+                if doc.get(col) == val:
+                    return doc
+            return None
+
+    def all(self) -> list:
+        """Copy of all the process documents"""
+        with self._lock.read_locked():
+            return [dict(i) for i in self._procs.values()]
+
+    def _all_docs(self):
+        with self._lock.read_locked():
+            return list(self._procs.values())
+
+    def pids(self) -> dict:
+        """key = pid, value = pm3_id of the processes with a pid"""
+        with self._lock.read_locked():
+            return {i['pid']: i['pm3_id'] for i in self._procs.values() if i['pid'] is not None and i['pid'] > 0}
+
     def next_id(self, start_from=None):
-        if start_from:
-            # Next Id start from specific id
-            pm3_id = start_from
-            while self.check_exist(pm3_id):
-                pm3_id += 1
-            return pm3_id
-        else:
-            all_docs = self.locked_all()
-            if len(all_docs) > 0:
-                return max([i['pm3_id'] for i in all_docs])+1
+        """The id reserve_id() would give, nothing is reserved"""
+        with self._lock.read_locked():
+            if start_from:
+                # Next Id start from specific id
+                pm3_id = start_from
+                while pm3_id in self._procs:
+                    pm3_id += 1
+                return pm3_id
+            elif self._free:
+                return self._free[0][0]
+            else:
+                return self._high_water + 1
+
+    def reserve_id(self) -> int:
+        """
+        Allocate a new id in O(1) (O(log n) from the free-list). Call it
+        inside transaction() with the insert, concurrent inserts can't get
+        the same id; release_id() gives back an id that was not inserted.
+        """
+        with self._lock.write_locked():
+            if self._free:
+                first, last = heapq.heappop(self._free)
+                if first < last:
+                    heapq.heappush(self._free, (first + 1, last))
+                return first
+            self._high_water += 1
+            return self._high_water
+
+    def release_id(self, pm3_id: int):
+        with self._lock.write_locked():
+            if pm3_id in self._procs:
+                return
+            if pm3_id == self._high_water:
+                self._high_water -= 1
             else:
-                return 1
+                self._free_id(pm3_id)
+
+    def _claim_id(self, pm3_id: int):
+        # Called with the write lock, for the ids chosen by the caller
+        if pm3_id > self._high_water:
+            old, self._high_water = self._high_water, pm3_id
+            if self.id_reuse and pm3_id > old + 1:
+                # The ids skipped by the caller, one range however far
+                heapq.heappush(self._free, (old + 1, pm3_id - 1))
+        elif self._free:
+            for n, (first, last) in enumerate(self._free):
+                if first <= pm3_id <= last:
+                    # Rare: an explicit id taken from the middle of the free-list
+                    self._free[n:n + 1] = [r for r in ((first, pm3_id - 1), (pm3_id + 1, last)) if r[0] <= r[1]]
+                    heapq.heapify(self._free)
+                    break
+
+    def _free_id(self, pm3_id: int):
+        # Called with the write lock, pm3_id not in the table any more
+        # (so not in the free-list either)
+        if self.id_reuse and 0 < pm3_id <= self._high_water:
+            heapq.heappush(self._free, (pm3_id, pm3_id))
 
     def check_exist(self, val, col='pm3_id'):
-            return self.locked_contains(where(col) == val)
+        return self._get_doc(val, col) is not None
 
     def select(self, proc, col='pm3_id'):
-        return self.locked_get(where(col) == proc.model_dump()[col])
+        doc = self._get_doc(proc.model_dump()[col], col)
+        return None if doc is None else dict(doc)
+
+    # Writes only touch the registry and mark the record as dirty,
+    # flush() writes all the pending changes in a single atomic write.
+    def _dump(self, proc) -> dict:
+        doc = proc.model_dump()
+        # Fields set after the validation (e.g. pid by run()): the stored
+        # document stays ready to be listed as it is
+        doc.update(status_fields(doc))
+        return doc
+
+    def insert(self, proc):
+        doc = self._dump(proc)
+        with self._lock.write_locked():
+            self._claim_id(doc['pm3_id'])
+            old = self._procs.get(doc['pm3_id'])
+            if old is not None:
+                # Rewrite of an existing id
+                self._unindex(old)
+            self._procs[doc['pm3_id']] = doc
+            self._names[doc['pm3_name']] = doc['pm3_id']
+            self._index(doc)
+            self._dirty.add(doc['pm3_id'])
 
     def delete(self, proc, col='pm3_id'):
-        if self.select(proc, col):
-            self.locked_remove(where(col) == proc.model_dump()[col])
+        with self._lock.write_locked():
+            doc = self._get_doc(proc.model_dump()[col], col)
+            if doc is None:
+                return False
+            self._procs.pop(doc['pm3_id'], None)
+            if self._names.get(doc['pm3_name']) == doc['pm3_id']:
+                self._names.pop(doc['pm3_name'])
+            self._unindex(doc)
+            self._dirty.add(doc['pm3_id'])
+            self._free_id(doc['pm3_id'])
             return True
-        else:
-            return False
 
     def update(self, proc, col='pm3_id'):
-        if self.select(proc, col):
-            self.locked_update(proc, where(col) == proc.model_dump()[col])
+        new_doc = self._dump(proc)
+        with self._lock.write_locked():
+            doc = self._get_doc(new_doc[col], col)
+            if doc is None:
+                return False
+            if doc == new_doc:
+                # Nothing changed, nothing to write
+                return True
+            if self._names.get(doc['pm3_name']) == doc['pm3_id']:
+                self._names.pop(doc['pm3_name'])
+            self._procs.pop(doc['pm3_id'], None)
+            self._unindex(doc)
+            if new_doc['pm3_id'] != doc['pm3_id']:
+                self._claim_id(new_doc['pm3_id'])
+            self._procs[new_doc['pm3_id']] = new_doc
+            self._names[new_doc['pm3_name']] = new_doc['pm3_id']
+            self._index(new_doc)
+            self._dirty.update((doc['pm3_id'], new_doc['pm3_id']))
+            if new_doc['pm3_id'] != doc['pm3_id']:
+                self._free_id(doc['pm3_id'])
             return True
-        else:
-            return False
 
-    def find_id_or_name(self, id_or_name, hidden=False) -> ION:
+    def set_fields(self, pm3_id, fields: dict, where: dict = None) -> bool:
+        """
+        Change only some fields of a record (not pm3_id, pm3_name, group or
+        tags), the others keep what the other threads wrote in the meantime.
+        where: the record is changed only if it has these values.
+        Return False if the record does not exist or does not match.
+        """
+        with self._lock.write_locked():
+            doc = self._procs.get(pm3_id)
+            if doc is None or any(doc.get(k) != v for k, v in (where or {}).items()):
+                return False
+            new_doc = {**doc, **fields}
+            new_doc.update(status_fields(new_doc))
+            if new_doc != doc:
+                self._procs[pm3_id] = new_doc
+                self._dirty.add(pm3_id)
+            return True
+
+    @property
+    def dirty(self) -> bool:
+        return len(self._dirty) > 0
+
+    def flush(self) -> bool:
+        """
+        Write the dirty records with the storage engine.
+        Return False when there was nothing to write.
+        """
+        with self._flush_lock:
+            with self._lock.write_locked():
+                if not self._dirty:
+                    return False
+                dirty = self._dirty
+                self._dirty = set()
+                procs = dict(self._procs)
+                meta = {'high_water': self._high_water}
+            try:
+                self.locked_save(procs, dirty, meta)
+            except Exception:
+                with self._lock.write_locked():
+                    self._dirty |= dirty
+                raise
+            self.flush_count += 1
+            self.records_written += len(dirty)
+            return True
+
+    def stats(self) -> dict:
+        return {
+            'flush_count': self.flush_count,
+            'records_written': self.records_written,
+            'lock_waits': self._lock.waits,
+            'lock_wait_seconds': self._lock.wait_time,
+        }
+
+    def find_docs(self, id_or_name) -> ION:
+        """Like find_id_or_name, with copies of the documents instead of Process"""
         if id_or_name == 'all':
             # Tutti (nascosti esclusi)
-            out = ION('special',
-                    id_or_name,
-                    [Process(**i) for i in self.locked_all() if not hidden_proc(i['pm3_name'])]
-                    )
-            return out
-
+            docs = [i for i in self._all_docs() if not hidden_proc(i['pm3_name'])]
         elif id_or_name == 'ALL':
             # Proprio tutti (compresi i nascosti)
-            out = ION('special', id_or_name, [Process(**i) for i in self.locked_all()])
-            return out
+            docs = self._all_docs()
         elif id_or_name == 'hidden_only':
             # Solo i nascosti (nascosti esclusi)
-            out = ION('special',
-                    id_or_name,
-                    [Process(**i) for i in self.locked_all() if hidden_proc(i['pm3_name'])]
-                    )
-            return out
-
+            docs = [i for i in self._all_docs() if hidden_proc(i['pm3_name'])]
         elif id_or_name == 'autorun_only':
             # Tutti gli autorun (compresi i sospesi)
-            out = ION('special',
-                    id_or_name,
-                    [Process(**i) for i in self.locked_all() if i['autorun'] is True])
-            return out
+            docs = [i for i in self._all_docs() if i['autorun'] is True]
         elif id_or_name == 'autorun_enabled':
             # Gruppo di autorun non sospesi
-            out = ION('special',
-                    id_or_name,
-                    [Process(**i) for i in self.locked_all() if i['autorun'] is True and i['autorun_exclude'] is False])
-            return out
-
-        try:
-            id_or_name = int(id_or_name)
-        except ValueError:
-            if self.check_exist(id_or_name, col='pm3_name'):
-                p_data = self.locked_get(where('pm3_name') == id_or_name)
-                out = ION('pm3_name', id_or_name, [Process(**p_data), ])
-            else:
-                out = ION('pm3_name', id_or_name, [])
-
+            docs = [i for i in self._all_docs() if i['autorun'] is True and i['autorun_exclude'] is False]
+        elif isinstance(id_or_name, str) and id_or_name.startswith(('group:', 'tag:')):
+            # Dall'indice, O(dimensione del gruppo)
+            col, key = id_or_name.split(':', 1)
+            return ION(col, key, self.members(col, key))
         else:
-            if self.check_exist(id_or_name, col='pm3_id'):
-                p_data = self.locked_get(where('pm3_id') == id_or_name)
-                out = ION('pm3_id', id_or_name, [Process(**p_data), ])
+            try:
+                id_or_name = int(id_or_name)
+            except ValueError:
+                col = 'pm3_name'
             else:
-                out = ION('pm3_id', id_or_name, [])
-        return out
+                col = 'pm3_id'
+            p_data = self._get_doc(id_or_name, col=col)
+            return ION(col, id_or_name, [] if p_data is None else [dict(p_data)])
+        return ION('special', id_or_name, [dict(i) for i in docs])
+
+    def members(self, col: str, key: str) -> list:
+        """Copies of the documents of a group (col='group') or a tag (col='tag'), by pm3_id"""
+        index = self._groups if col == 'group' else self._tags
+        with self._lock.read_locked():
+            return [dict(self._procs[i]) for i in sorted(index.get(key, ()))]
+
+    def refresh(self, doc: dict) -> dict:
+        """
+        doc (a copy from find_docs) with an up to date liveness. A Process is
+        built (and validated) only to write the exit of a process or for a
+        record without identity.
+        """
+        if doc['pid'] is None:
+            # Accepted by /new and load: never started
+            doc['pid'] = -1
+        pid, create_time = doc['pid'], doc.get('pid_create_time')
+        if pid <= 0 or (create_time is not None and pid_alive(pid, create_time)):
+            # Records written by older versions can have stale status fields
+            doc.update(status_fields(doc))
+            return doc
+        proc = Process(**doc)
+        proc.is_running
+        # Only the identity: the exit fields are written by the reaper
+        fields = {'pid': proc.pid, 'pid_create_time': proc.pid_create_time}
+        self.set_fields(doc['pm3_id'], fields, where={'pid': pid})
+        doc.update(fields)
+        doc.update(status_fields(doc))
+        return doc
+
+    def find_id_or_name(self, id_or_name, hidden=False) -> ION:
+        ion = self.find_docs(id_or_name)
+        return ION(ion.type, ion.data, [Process(**i) for i in ion.proc])
@@ -0,0 +1,94 @@
+# Projection, filter, sort and limit of the rows served by /ls and /ps:
+#   ?fields=pid,cpu_percent,memory_info   only these fields (pm3_id and pm3_name always)
+#   ?autorun=true&status=running          equality filters, comma = any of the values
+#   ?sort=-cpu_percent&limit=10           sort (- = descending), then the first N
+
+RESERVED = ('fields', 'sort', 'limit', 'format')
+# Always in a projected row: the rows must stay recognizable
+KEY_FIELDS = ('pm3_id', 'pm3_name')
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Query:
+    def __init__(self, args, known: set, aliases: dict = None):
+        """
+        args: the request args, known: the names accepted as fields and
+        filters (None = any), aliases: filters computed from the row,
+        key = name, value = function(row)
+        """
+        self.known = known
+        self.aliases = aliases or {}
+        self.fields = None
+        if args.get('fields'):
+            self.fields = [i.strip() for i in args['fields'].split(',') if i.strip()]
+            self._check(self.fields)
+        self.filters = {}
+        for key in args:
+            if key in RESERVED:
+                continue
+            values = [_norm(v) for value in args.getlist(key) for v in value.split(',')]
+            self.filters[key] = values
+        self._check([k for k in self.filters if k not in self.aliases])
+        self.sort = args.get('sort') or None
+        self.reverse = False
+        if self.sort and self.sort.startswith('-'):
+            self.sort, self.reverse = self.sort[1:], True
+        if self.sort:
+            self._check([self.sort])
+        try:
+            self.limit = int(args['limit']) if args.get('limit') else None
+        except ValueError:
+            raise QueryError(f"limit must be an integer, not {args['limit']}")
+
+    def _check(self, names):
+        if self.known is None:
+            return
+        unknown = [i for i in names if i not in self.known]
+        if unknown:
+            raise QueryError(f'unknown field {", ".join(unknown)}')
+
+    def needed(self) -> set:
+        """Names the rows must contain for the filters, the sort and the projection"""
+        out = set(self.fields or ()) | {k for k in self.filters if k not in self.aliases}
+        if self.sort:
+            out.add(self.sort)
+        return out
+
+    def match(self, row: dict) -> bool:
+        for key, values in self.filters.items():
+            value = self.aliases[key](row) if key in self.aliases else row.get(key)
+            if _norm(value) not in values:
+                return False
+        return True
+
+    def apply(self, rows: list) -> list:
+        """Filter, sort and limit, the rows are not projected"""
+        rows = [row for row in rows if self.match(row)]
+        if self.sort:
+            # None last, whatever the direction
+            present = [row for row in rows if row.get(self.sort) is not None]
+            missing = [row for row in rows if row.get(self.sort) is None]
+            try:
+                present.sort(key=lambda row: row[self.sort], reverse=self.reverse)
+            except TypeError:
+                raise QueryError(f'{self.sort} cannot be sorted')
+            rows = present + missing
+        return rows if self.limit is None else rows[:max(self.limit, 0)]
+
+    def columns(self, default: tuple) -> tuple:
+        if self.fields is None:
+            return default
+        return tuple(dict.fromkeys(KEY_FIELDS + tuple(self.fields)))
+
+    def project(self, row: dict) -> dict:
+        if self.fields is None:
+            return row
+        return {k: row.get(k) for k in self.columns(())}
+
+
+def _norm(value) -> str:
+    # 'true' matches True, '5' matches 5
+    return str(value).lower()
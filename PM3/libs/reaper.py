@@ -0,0 +1,101 @@
+import os
+import errno
+import signal
+import logging
+import selectors
+import threading
+
+
+class ChildReaper(threading.Thread):
+    """
+    Waits for the exit of the processes started by the backend and calls
+    the callback registered with watch() as soon as a child is gone.
+
+    On Linux >= 5.3 every child has a pidfd in a selector, elsewhere
+    SIGCHLD (install_sigchld() from the main thread) wakes up the loop
+    and all the watched children are polled.
+    """
+    def __init__(self):
+        super().__init__(name='pm3_reaper', daemon=True)
+        self.use_pidfd = hasattr(os, 'pidfd_open')
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        # Popen waiting to be registered in the selector
+        self._pending = []
+        # key = pid, value = (Popen, callback)
+        self._children = {}
+
+    def watch(self, popen, callback):
+        """callback(popen) is called from the reaper thread after the child exit"""
+        with self._lock:
+            self._pending.append((popen, callback))
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            # The loop has already been woken up
+            pass
+
+    def install_sigchld(self):
+        if not self.use_pidfd:
+            signal.signal(signal.SIGCHLD, lambda signum, frame: self.wake())
+
+    def _register_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for popen, callback in pending:
+            self._children[popen.pid] = (popen, callback)
+            if not self.use_pidfd:
+                continue
+            try:
+                pidfd = os.pidfd_open(popen.pid)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    # Already reaped by someone else
+                    self._reap(popen.pid)
+                    continue
+                # pidfd not supported by the kernel, from now on SIGCHLD + poll
+                logging.warning(f'pidfd_open not available ({e}), polling children')
+                self.use_pidfd = False
+                continue
+            self._selector.register(pidfd, selectors.EVENT_READ, popen.pid)
+
+    def _reap(self, pid):
+        popen, callback = self._children.pop(pid, (None, None))
+        if popen is None:
+            return
+        popen.poll()
+        try:
+            callback(popen)
+        except Exception as e:
+            logging.exception(f'error handling the exit of pid {pid}: {e}')
+
+    def _poll_all(self):
+        for pid, (popen, _) in list(self._children.items()):
+            if popen.poll() is not None:
+                self._reap(pid)
+
+    def run(self):
+        while True:
+            # Without pidfd a lost SIGCHLD is recovered by the 1 second timeout
+            timeout = None if self.use_pidfd else 1
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self._register_pending()
+                else:
+                    self._selector.unregister(key.fd)
+                    os.close(key.fd)
+                    self._reap(key.data)
+            if not self.use_pidfd:
+                self._poll_all()
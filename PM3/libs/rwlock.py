@@ -0,0 +1,98 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """
+    Reader/writer lock with writer preference.
+    Many threads can hold the read side at the same time, the write side is
+    exclusive and reentrant: the writer can also take the read side.
+    A reader must not try to become a writer (deadlock).
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+        # Contention stats: acquisitions that had to wait and total wait
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _my_reads(self) -> int:
+        return getattr(self._local, 'reads', 0)
+
+    def _waited(self, t0: float):
+        # Called with self._cond held
+        self.waits += 1
+        self.wait_time += time.perf_counter() - t0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if self._my_reads() == 0:
+                # Nested reads never wait, or a waiting writer would deadlock us
+                if self._writer is not None or self._waiting_writers > 0:
+                    t0 = time.perf_counter()
+                    while self._writer is not None or self._waiting_writers > 0:
+                        self._cond.wait()
+                    self._waited(t0)
+            self._readers += 1
+            self._local.reads = self._my_reads() + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth -= 1
+                return
+            self._readers -= 1
+            self._local.reads = self._my_reads() - 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._waiting_writers += 1
+            try:
+                if self._writer is not None or self._readers > 0:
+                    t0 = time.perf_counter()
+                    while self._writer is not None or self._readers > 0:
+                        self._cond.wait()
+                    self._waited(t0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+import psutil
+from PM3.libs.metrics import MetricsRing, own_rows, tree_sample
+
+# psutil attributes sampled every period: the ones of pm3 ps and of the
+# metrics. The expensive ones (open_files, net_connections, environ,
+# memory_maps...) are read only when a request asks for them.
+SAMPLE_ATTRS = ('pid', 'ppid', 'name', 'exe', 'cmdline', 'status', 'username', 'create_time', 'cwd',
+                'cpu_percent', 'cpu_times', 'memory_info', 'memory_percent', 'num_threads', 'num_fds',
+                'io_counters', 'ionice', 'uids', 'gids')
+
+
+class MetricsSampler(threading.Thread):
+    """
+    Samples psutil data of the managed processes (and of their children)
+    every period seconds. The psutil.Process handles are kept between
+    samples, so cpu_percent is the delta since the previous sample and
+    nobody has to sleep: /ps is served from the last snapshot.
+    A snapshot older than max_staleness is refreshed on read.
+    Every history_period seconds the totals of each process tree are
+    appended to a MetricsRing of history_size samples (key = pm3_id).
+    """
+    def __init__(self, get_pids, period: float = 2.0, max_staleness: float = 10.0,
+                 history_period: float = 10.0, history_size: int = 360):
+        super().__init__(name='pm3_sampler', daemon=True)
+        # get_pids() -> {pid: pm3_id} of the managed processes
+        self.get_pids = get_pids
+        self.period = period
+        self.max_staleness = max_staleness
+        self.history_period = history_period
+        self.history_size = history_size
+        # key = pm3_id, value = MetricsRing
+        self.history = {}
+        self._history_time = 0.0
+        # key = pid, value = psutil.Process
+        self._handles = {}
+        # key = root pid, value = [as_dict() of the root, as_dict() of the children...]
+        self._snapshot = {}
+        self._snapshot_time = 0.0
+        self._lock = threading.Lock()
+
+    def _handle(self, ps: psutil.Process) -> psutil.Process:
+        h = self._handles.get(ps.pid)
+        # psutil.Process equality checks pid and create_time (pid reuse)
+        if h is None or h != ps:
+            h = self._handles[ps.pid] = ps
+        return h
+
+    def _sample_tree(self, pid, managed=frozenset()) -> list:
+        # The other managed processes (started by the backend, so also its
+        # children) and their subtrees are sampled only as their own roots:
+        # a second cpu_percent() on the same handle would measure ~0
+        root = self._handle(psutil.Process(pid))
+        rows = []
+        skipped = set()
+        for ps in [root] + root.children(recursive=True):
+            if ps.pid != pid:
+                try:
+                    # children() lists every parent before its children
+                    skip = ps.pid in managed or (skipped and ps.ppid() in skipped)
+                except psutil.NoSuchProcess:
+                    skip = True
+                if skip:
+                    skipped.add(ps.pid)
+                    continue
+            ps = self._handle(ps)
+            try:
+                rows.append(ps.as_dict(attrs=SAMPLE_ATTRS))
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return rows
+
+    def sample(self, pids=None):
+        """Sample the given pids (default: all the managed processes)"""
+        full = pids is None
+        pid_map = self.get_pids()
+        pids = list(pid_map) if full else pids
+        managed = set(pid_map)
+        with self._lock:
+            snapshot = {}
+            for pid in pids:
+                try:
+                    snapshot[pid] = self._sample_tree(pid, managed)
+                except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                    continue
+            if full:
+                # Forget the handles of dead processes
+                alive = {row['pid'] for rows in snapshot.values() for row in rows}
+                self._handles = {pid: h for pid, h in self._handles.items() if pid in alive}
+                self._snapshot = snapshot
+                self._snapshot_time = time.time()
+                if self._snapshot_time - self._history_time >= self.history_period:
+                    self._record_history(pid_map, snapshot, self._snapshot_time)
+            else:
+                self._snapshot = {**self._snapshot, **snapshot}
+
+    def _record_history(self, pid_map: dict, snapshot: dict, now: float):
+        self._history_time = now
+        for pid, rows in snapshot.items():
+            pm3_id = pid_map[pid]
+            if pm3_id not in self.history:
+                self.history[pm3_id] = MetricsRing(self.history_size)
+            # Managed processes started by the backend are also its children,
+            # count them (and their children) only once
+            self.history[pm3_id].append(tree_sample(own_rows(rows, pid_map), now))
+
+    def forget(self, pm3_id):
+        self.history.pop(pm3_id, None)
+
+    def snapshot(self) -> dict:
+        """Last snapshot as is, never samples"""
+        return self._snapshot
+
+    def get(self, pid, attrs=None) -> list:
+        """
+        Rows of the tree of pid. attrs not sampled are read now with the
+        cached handles (ValueError for an unknown attribute).
+        """
+        if time.time() - self._snapshot_time > self.max_staleness:
+            self.sample()
+        elif pid not in self._snapshot:
+            # Started after the last sample
+            self.sample([pid])
+        rows = self._snapshot.get(pid, [])
+        extra = [i for i in attrs or () if i not in SAMPLE_ATTRS]
+        if not extra:
+            return rows
+        out = []
+        for row in rows:
+            h = self._handles.get(row['pid'])
+            try:
+                more = h.as_dict(attrs=extra) if h is not None else dict.fromkeys(extra)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                more = dict.fromkeys(extra)
+            out.append({**row, **more})
+        return out
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logging.exception(f'metrics sampling failed: {e}')
+            time.sleep(self.period)
@@ -0,0 +1,409 @@
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import itertools
+import queue
+import selectors
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote_to_bytes
+from werkzeug.wsgi import LimitedStream
+
+SERVERS = ('dev', 'threaded', 'waitress')
+
+
+class KeepAliveWSGIHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 WSGI handler: the client can send many requests on one
+    connection. The request body is read through a LimitedStream and
+    drained after the response, so the next request line is never
+    mistaken for body (the reason the werkzeug server closes every
+    connection). Responses without Content-Length are chunked, or sent
+    as they are and followed by a close for HTTP/1.0 clients.
+    After a response the handler is parked (the server waits for the
+    next request without a worker) unless a pipelined request is
+    already buffered.
+    An application serving an endless response (log follow) calls
+    environ['pm3.detach']() first: the request leaves the worker pool.
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PM3'
+    # Headers and body are separate writes: no Nagle delay on keep-alive
+    disable_nagle_algorithm = True
+    parked = False
+
+    def handle(self):
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self._pending():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def finish(self):
+        # A parked connection keeps its files for the next request
+        if not self.parked:
+            super().finish()
+
+    def resume(self):
+        """Handle the next request of a parked connection"""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def _pending(self) -> bool:
+        # Pipelined request already read into rfile (or on the socket): the selector would not see it
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def log_request(self, code='-', size='-'):
+        # No access log line per request, errors are still logged
+        pass
+
+    def log_error(self, format, *args):
+        if format.startswith('Request timed out'):
+            # Idle keep-alive connection
+            return
+        logging.error(f'{self.address_string()} {format % args}')
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def make_environ(self, body) -> dict:
+        path, _, query = self.path.partition('?')
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': self.headers.get('Content-Length', ''),
+            'SERVER_NAME': self.server.server_name,
+            'SERVER_PORT': str(self.server.server_port),
+            'SERVER_PROTOCOL': self.request_version,
+            'REMOTE_ADDR': self.address_string(),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'pm3.detach': self.detach,
+        }
+        for key, value in self.headers.items():
+            key = 'HTTP_' + key.upper().replace('-', '_')
+            if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                continue
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def detach(self):
+        # The connection ends with the response, the thread is not a worker any more
+        self.close_connection = True
+        self.server.detach()
+
+    def run_wsgi(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            # Chunked request bodies are not supported
+            self.send_error(411)
+            self.close_connection = True
+            return
+        body = LimitedStream(self.rfile, int(self.headers.get('Content-Length') or 0))
+        environ = self.make_environ(body)
+        state = {'status': None, 'headers': None, 'sent': False, 'chunked': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'], state['headers'] = status, headers
+            return write
+
+        def write(data: bytes):
+            if not state['sent']:
+                code, _, msg = state['status'].partition(' ')
+                self.send_response(int(code), msg)
+                keys = set()
+                for key, value in state['headers']:
+                    self.send_header(key, value)
+                    keys.add(key.lower())
+                if ('content-length' not in keys and self.command != 'HEAD'
+                        and int(code) not in (204, 304) and int(code) >= 200):
+                    if self.request_version in ('HTTP/0.9', 'HTTP/1.0'):
+                        # No chunked encoding before HTTP/1.1: the close ends the body
+                        self.send_header('Connection', 'close')
+                    else:
+                        state['chunked'] = True
+                        self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                state['sent'] = True
+            if data:
+                if state['chunked']:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    self.wfile.write(data)
+                self.wfile.flush()
+
+        result = self.server.app(environ, start_response)
+        try:
+            for data in result:
+                write(data)
+            if not state['sent']:
+                write(b'')
+            if state['chunked']:
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            # Body not read by the application
+            body.exhaust()
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = do_OPTIONS = run_wsgi
+
+
+class _WorkerPoolMixIn:
+    """
+    Requests handled by a fixed pool of worker threads instead of a thread
+    each. A worker running an endless response calls detach(): a new worker
+    takes its place, so open follow streams never lock out the other clients.
+    Idle keep-alive connections wait in a selector, not in a worker: they
+    go back to the pool when the next request arrives and are closed after
+    keep_alive seconds.
+    """
+    def _setup_pool(self, app, workers: int, keep_alive: float):
+        self.app = app
+        self.workers = workers
+        self.keep_alive = keep_alive
+        self._requests = queue.SimpleQueue()
+        self._worker_ids = itertools.count()
+        self._detached = threading.local()
+        for _ in range(workers):
+            self._add_worker()
+        self._parked = queue.SimpleQueue()
+        self._park_lock = threading.Lock()
+        self._park_closed = False
+        self._wake_r, self._wake_w = os.pipe()
+        threading.Thread(target=self._idle_loop, name='pm3_http_idle', daemon=True).start()
+
+    def _add_worker(self):
+        threading.Thread(target=self._worker, name=f'pm3_http_{next(self._worker_ids)}', daemon=True).start()
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            self._process_request(*item)
+            if getattr(self._detached, 'value', False):
+                # Replaced while streaming
+                return
+
+    def detach(self):
+        """Called by the worker thread of a long-lived request"""
+        if not getattr(self._detached, 'value', False):
+            self._detached.value = True
+            self._add_worker()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _process_request(self, request, client_address, handler=None):
+        parked = False
+        try:
+            if handler is None:
+                handler = self.finish_request(request, client_address)
+            else:
+                handler.resume()
+            parked = handler.parked
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if parked:
+                self._park(request, client_address, handler)
+            else:
+                self.shutdown_request(request)
+
+    def _park(self, request, client_address, handler):
+        with self._park_lock:
+            if not self._park_closed:
+                self._parked.put((request, client_address, handler))
+                os.write(self._wake_w, b'\0')
+                return
+        self.shutdown_request(request)
+
+    def _idle_loop(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self._wake_r, selectors.EVENT_READ)
+        idle = {}
+        while True:
+            now = time.monotonic()
+            timeout = max(0, min(idle.values()) - now) if idle else None
+            for key, _ in sel.select(timeout):
+                if key.fileobj == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                    continue
+                # Next request: back to the pool
+                sel.unregister(key.fileobj)
+                del idle[key.fileobj]
+                self._requests.put(key.data)
+            while True:
+                try:
+                    item = self._parked.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    for key in list(sel.get_map().values()):
+                        if key.fileobj != self._wake_r:
+                            self._close_parked(*key.data)
+                    sel.close()
+                    os.close(self._wake_r)
+                    os.close(self._wake_w)
+                    return
+                sel.register(item[0], selectors.EVENT_READ, item)
+                idle[item[0]] = time.monotonic() + self.keep_alive
+            now = time.monotonic()
+            for request in [k for k, deadline in idle.items() if deadline <= now]:
+                del idle[request]
+                self._close_parked(*sel.unregister(request).data)
+
+    def _close_parked(self, request, client_address, handler):
+        handler.parked = False
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in range(self.workers):
+            self._requests.put(None)
+        with self._park_lock:
+            if self._park_closed:
+                return
+            self._park_closed = True
+            self._parked.put(None)
+            os.write(self._wake_w, b'\0')
+
+
+def _handler(keep_alive: float, tcp: bool = True):
+    # TCP_NODELAY does not exist on Unix sockets
+    return type('PoolRequestHandler', (KeepAliveWSGIHandler,),
+                {'timeout': keep_alive, 'disable_nagle_algorithm': tcp})
+
+
+class PoolWSGIServer(_WorkerPoolMixIn, socketserver.TCPServer):
+    """
+    WSGI server with a fixed pool of worker threads and keep-alive
+    connections. Everything runs in the backend process, so the state
+    shared by the requests (process table, Popen objects) stays one.
+    An idle keep-alive connection holds no worker and is closed after
+    keep_alive seconds.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, host: str, port: int, app, workers: int = 16, keep_alive: float = 5.0):
+        super().__init__((host, port), _handler(keep_alive))
+        self._setup_pool(app, workers, keep_alive)
+        self.server_name = host
+        self.server_port = self.server_address[1]
+
+
+class UnixPoolWSGIServer(_WorkerPoolMixIn, socketserver.UnixStreamServer):
+    """
+    PoolWSGIServer on a Unix domain socket: no TCP handshake per call and
+    access limited by the permissions of the socket file (owner only).
+    """
+    request_queue_size = 128
+
+    def __init__(self, path: str, app, workers: int = 16, keep_alive: float = 5.0):
+        _remove_stale_socket(path)
+        super().__init__(path, _handler(keep_alive, tcp=False))
+        self._setup_pool(app, workers, keep_alive)
+        self.path = path
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_bind(self):
+        super().server_bind()
+        # Before listen(): nobody can connect with the default permissions
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(path: str):
+    """Unlink the socket left by a dead backend, refuse to steal a live one"""
+    if not os.path.exists(path):
+        return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise OSError(f'{path} is in use by another backend')
+    finally:
+        s.close()
+
+
+def serve_unix(app, path: str, backend_section) -> UnixPoolWSGIServer:
+    """Start the Unix socket listener in a thread, None if it cannot bind"""
+    try:
+        server = UnixPoolWSGIServer(path, app,
+                                    workers=backend_section.getint('workers', fallback=16),
+                                    keep_alive=backend_section.getfloat('keep_alive', fallback=5.0))
+    except OSError as e:
+        logging.warning(f'unix socket {path} not available: {e}')
+        return None
+    threading.Thread(target=server.serve_forever, name='pm3_unix', daemon=True).start()
+    return server
+
+
+def serve(app, host: str, port: int, backend_section):
+    """Run app with the server chosen by [backend] server (dev, threaded, waitress)"""
+    server = backend_section.get('server', fallback='threaded')
+    workers = backend_section.getint('workers', fallback=16)
+    keep_alive = backend_section.getfloat('keep_alive', fallback=5.0)
+    if server not in SERVERS:
+        logging.warning(f'unknown server {server}, using threaded')
+        server = 'threaded'
+
+    if server == 'waitress':
+        try:
+            import waitress
+        except ImportError:
+            logging.warning('waitress is not installed, using threaded')
+            server = 'threaded'
+        else:
+            # waitress is single process too: threads share the backend state
+            waitress.serve(app, host=host, port=port, threads=workers, channel_timeout=keep_alive)
+            return
+
+    if server == 'dev':
+        app.run(debug=False, use_reloader=False, host=host, port=port)
+    else:
+        PoolWSGIServer(host, port, app, workers=workers, keep_alive=keep_alive).serve_forever()
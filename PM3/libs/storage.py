@@ -0,0 +1,164 @@
+import os
+import json
+import sqlite3
+from pathlib import Path
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+
+
+class AtomicJSONStorage(JSONStorage):
+    """
+    JSONStorage che scrive su un file temporaneo e lo sostituisce con os.replace,
+    un crash durante la scrittura non lascia mai il database a metà
+    """
+    def __init__(self, path: str, encoding=None, **kwargs):
+        super().__init__(path, encoding=encoding, **kwargs)
+        self._path = path
+        self._encoding = encoding
+
+    def write(self, data):
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w', encoding=self._encoding) as f:
+            f.write(json.dumps(data, **self.kwargs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        # The old handle points to the replaced inode
+        self._handle.close()
+        self._handle = open(self._path, mode=self._mode, encoding=self._encoding)
+
+
+class StorageEngine:
+    """
+    Persistence of the process table used by Pm3Table.
+    procs is the whole table (key = pm3_id), changed the pm3_id written
+    or deleted since the last save, meta the table state saved with them
+    (e.g. the id high-water mark).
+    """
+    def load(self) -> list:
+        raise NotImplementedError
+
+    def load_meta(self) -> dict:
+        return {}
+
+    def save(self, procs: dict, changed: set, meta: dict = None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TinyDBEngine(StorageEngine):
+    # TinyDB serializes the whole document anyway, every save rewrites the table
+    def __init__(self, path: str, table_name: str):
+        self.path = path
+        self.db = TinyDB(path, storage=AtomicJSONStorage)
+        self.tbl = self.db.table(table_name)
+
+    def load(self) -> list:
+        return [dict(i) for i in self.tbl.all()]
+
+    def load_meta(self) -> dict:
+        data = self.tbl.storage.read() or {}
+        return dict(data.get('pm3_meta', {}).get('1', {}))
+
+    def save(self, procs: dict, changed: set, meta: dict = None):
+        docs = [procs[i] for i in sorted(procs)]
+        storage = self.tbl.storage
+        data = storage.read() or {}
+        data[self.tbl.name] = {str(n): doc for n, doc in enumerate(docs, start=1)}
+        if meta:
+            # Same file, same atomic write as the processes
+            data['pm3_meta'] = {'1': {**data.get('pm3_meta', {}).get('1', {}), **meta}}
+        storage.write(data)
+        self.tbl.clear_cache()
+
+    def close(self):
+        self.db.close()
+
+
+class SQLiteEngine(StorageEngine):
+    # One row per process, the document is stored as json,
+    # pm3_id and pm3_name are real indexed columns.
+    def __init__(self, path: str, table_name: str):
+        self.path = path
+        self.table_name = table_name
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
+                          'pm3_id INTEGER PRIMARY KEY, '
+                          'pm3_name TEXT NOT NULL, '
+                          'doc TEXT NOT NULL)')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_pm3_name" ON "{table_name}" (pm3_name)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pm3_meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def load(self) -> list:
+        rows = self.conn.execute(f'SELECT doc FROM "{self.table_name}" ORDER BY pm3_id')
+        return [json.loads(doc) for (doc, ) in rows]
+
+    def load_meta(self) -> dict:
+        return dict(self.conn.execute('SELECT key, value FROM pm3_meta'))
+
+    def save(self, procs: dict, changed: set, meta: dict = None):
+        upserts = [(i, procs[i]['pm3_name'], json.dumps(procs[i])) for i in changed if i in procs]
+        deletes = [(i, ) for i in changed if i not in procs]
+        cur = self.conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            cur.executemany(f'DELETE FROM "{self.table_name}" WHERE pm3_id = ?', deletes)
+            cur.executemany(f'INSERT OR REPLACE INTO "{self.table_name}" (pm3_id, pm3_name, doc) VALUES (?, ?, ?)',
+                            upserts)
+            cur.executemany('INSERT OR REPLACE INTO pm3_meta (key, value) VALUES (?, ?)',
+                            [(k, str(v)) for k, v in (meta or {}).items()])
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+        cur.execute('COMMIT')
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM pm3_meta WHERE key = ?', (key, )).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO pm3_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_tinydb(json_path: str, table_name: str, engine: SQLiteEngine) -> int:
+    """
+    One-shot import of an existing pm3_db.json into the SQLite engine.
+    The json file is left untouched, return the number of imported processes.
+    """
+    if engine.get_meta('migrated_from') is not None:
+        return 0
+    n = 0
+    if Path(json_path).is_file() and os.path.getsize(json_path) > 0:
+        old = TinyDBEngine(json_path, table_name)
+        procs = {i['pm3_id']: i for i in old.load()}
+        old.close()
+        engine.save(procs, set(procs))
+        n = len(procs)
+    engine.set_meta('migrated_from', json_path)
+    return n
+
+
+def make_engine(main_section) -> StorageEngine:
+    """
+    Storage engine from the [main_section] of config.ini
+    pm3_db_engine = tinydb (default) | sqlite
+    """
+    engine_name = main_section.get('pm3_db_engine', fallback='tinydb')
+    table_name = main_section.get('pm3_db_process_table')
+    pm3_db = main_section.get('pm3_db')
+    if engine_name == 'tinydb':
+        return TinyDBEngine(pm3_db, table_name)
+    elif engine_name == 'sqlite':
+        default_path = Path(pm3_db).with_suffix('.sqlite').as_posix()
+        engine = SQLiteEngine(main_section.get('pm3_db_sqlite', fallback=default_path), table_name)
+        migrate_tinydb(pm3_db, table_name, engine)
+        return engine
+    else:
+        raise ValueError(f'unknown pm3_db_engine {engine_name}')
@@ -0,0 +1,65 @@
+import time
+import logging
+import threading
+from PM3.libs.pm3table import Pm3Table
+
+
+class Supervisor(threading.Thread):
+    """
+    Autorun supervision inside the backend, same rules of the cron checker:
+    every autorun_enabled process that is not running is started,
+    once its restart backoff (Process.next_restart_at) is over.
+    The check runs every interval seconds, as soon as wake() is called
+    or when the first pending backoff expires.
+    """
+    def __init__(self, ptbl: Pm3Table, start_process, interval: float = 5, debug: bool = False):
+        super().__init__(name='pm3_supervisor', daemon=True)
+        self.ptbl = ptbl
+        # start_process(proc, ion) -> RetMsg
+        self.start_process = start_process
+        self.interval = interval
+        self.debug = debug
+        self._wakeup = threading.Event()
+        self._next_check = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def check_autostart(self) -> list:
+        out = []
+        now = time.time()
+        self._next_check = None
+        ion = self.ptbl.find_id_or_name('autorun_enabled')
+        for proc in ion.proc:
+            if proc.is_running:
+                if self.debug:
+                    logging.info(f'process running: {proc}')
+                continue
+            if proc.next_restart_at is None and proc.started_at is not None:
+                # Exit not seen by the reaper (e.g. started by a previous backend)
+                proc.register_exit(now)
+                self.ptbl.update(proc)
+            if proc.next_restart_at is not None and proc.next_restart_at > now:
+                # Still in backoff
+                if self._next_check is None or proc.next_restart_at < self._next_check:
+                    self._next_check = proc.next_restart_at
+                continue
+            ret = self.start_process(proc, ion)
+            if ret.err:
+                logging.error(ret.msg)
+            else:
+                logging.info(ret.msg)
+            out.append(ret)
+        return out
+
+    def run(self):
+        while True:
+            timeout = self.interval
+            if self._next_check is not None:
+                timeout = max(0.0, min(timeout, self._next_check - time.time()))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            try:
+                self.check_autostart()
+            except Exception as e:
+                logging.exception(f'autorun check failed: {e}')
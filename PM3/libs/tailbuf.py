@@ -0,0 +1,157 @@
+import time
+import threading
+from collections import deque
+
+
+class LineSplitter:
+    """Split chunks of many streams in lines, keeping the partial line of each stream"""
+    def __init__(self):
+        # key = stream, value = incomplete last line
+        self._partial = {}
+
+    def feed(self, stream: str, data: bytes, starts_line: bool = True) -> list:
+        if stream not in self._partial and not starts_line:
+            # The beginning of this line has been dropped from the buffer
+            pos = data.find(b'\n')
+            if pos < 0:
+                return []
+            data = data[pos + 1:]
+        data = self._partial.get(stream, b'') + data
+        lines = data.split(b'\n')
+        self._partial[stream] = lines.pop()
+        return [(stream, line.decode(errors='replace')) for line in lines]
+
+    def flush(self) -> list:
+        """Incomplete lines, e.g. the last output of a crashed process"""
+        out = [(stream, data.decode(errors='replace')) for stream, data in self._partial.items() if data]
+        self._partial = {stream: b'' for stream in self._partial}
+        return out
+
+
+class TailBuffer:
+    """
+    Recent output of one process: a ring of the chunks read from its pipes
+    (seq, time, stream, data, starts_line) within max_bytes. Chunks are
+    stored as read, lines are split only when somebody asks for them.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.last_seq = 0
+        self._chunks = deque()
+        # key = stream, value = the last chunk ended with a newline
+        self._line_end = {}
+        # Removed from its TailPool
+        self.removed = False
+        self._lock = threading.Lock()
+
+    def append(self, stream: str, data: bytes, now: float = None) -> int:
+        """Return the change of size in bytes"""
+        now = time.time() if now is None else now
+        with self._lock:
+            before = self.size
+            starts_line = self._line_end.get(stream, True)
+            self._line_end[stream] = data.endswith(b'\n')
+            if len(data) > self.max_bytes:
+                data = data[-self.max_bytes:]
+                starts_line = False
+            self.last_seq += 1
+            self._chunks.append((self.last_seq, now, stream, data, starts_line))
+            self.size += len(data)
+            self._trim(self.max_bytes)
+            return self.size - before
+
+    def _trim(self, max_bytes: int):
+        while self.size > max_bytes and self._chunks:
+            self.size -= len(self._chunks.popleft()[3])
+
+    def evict_oldest(self) -> int:
+        """Drop the oldest chunk, return the bytes freed"""
+        with self._lock:
+            if len(self._chunks) <= 1:
+                # The last chunk is kept, whatever the global cap
+                return 0
+            freed = len(self._chunks.popleft()[3])
+            self.size -= freed
+            return freed
+
+    def resize(self, max_bytes: int) -> int:
+        """Return the change of size in bytes"""
+        with self._lock:
+            before = self.size
+            self.max_bytes = max_bytes
+            self._trim(max_bytes)
+            return self.size - before
+
+    def since(self, seq: int = 0, stream: str = 'both') -> tuple:
+        """(last seq, chunks after seq)"""
+        with self._lock:
+            last_seq = self.last_seq
+            out = []
+            for chunk in reversed(self._chunks):
+                if chunk[0] <= seq:
+                    break
+                if stream == 'both' or chunk[2] == stream:
+                    out.append(chunk)
+        out.reverse()
+        return last_seq, out
+
+    def lines(self, stream: str = 'both', last: int = None) -> list:
+        """[(stream, line)] from the oldest, the incomplete lines at the end"""
+        splitter = LineSplitter()
+        out = []
+        for _, _, chunk_stream, data, starts_line in self.since(0, stream)[1]:
+            out.extend(splitter.feed(chunk_stream, data, starts_line))
+        out.extend(splitter.flush())
+        return out if last is None else out[-last:] if last > 0 else []
+
+
+class TailPool:
+    """
+    The TailBuffer of every process (key = pm3_id) under a global cap:
+    when the sum of the buffers is over max_bytes the oldest output of the
+    biggest buffer is dropped first, so a chatty process cannot wipe the
+    last lines of a quiet one.
+    """
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, default_bytes: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self.default_bytes = default_bytes
+        self.size = 0
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._buffers.get(key)
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def buffer(self, key, max_bytes: int) -> TailBuffer:
+        """The buffer of key, created or resized to max_bytes"""
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = self._buffers[key] = TailBuffer(max_bytes)
+            elif buf.max_bytes != max_bytes:
+                self.size += buf.resize(max_bytes)
+        return buf
+
+    def remove(self, key):
+        with self._lock:
+            buf = self._buffers.pop(key, None)
+            if buf is not None:
+                buf.removed = True
+                self.size -= buf.size
+
+    def append(self, buf: TailBuffer, stream: str, data: bytes):
+        delta = buf.append(stream, data)
+        if buf.removed:
+            return
+        with self._lock:
+            self.size += delta
+            while self.size > self.max_bytes:
+                biggest = max(self._buffers.values(), key=lambda b: b.size, default=None)
+                freed = biggest.evict_oldest() if biggest is not None else 0
+                if freed == 0:
+                    break
+                self.size -= freed
@@ -0,0 +1,78 @@
+import os
+import socket
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+# Base url of the backend on its Unix socket (the host part is ignored)
+UNIX_URL = 'http+unix://pm3'
+
+
+def socket_path(config) -> str:
+    """[backend] socket, default <pm3_home_dir>/pm3.sock; empty = no Unix socket"""
+    home = config['main_section'].get('pm3_home_dir', fallback='~/.pm3')
+    path = config['backend'].get('socket', fallback=str(Path(home, 'pm3.sock')))
+    return os.path.expanduser(path) if path else ''
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.unix_path = path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.unix_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    def __init__(self, path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.unix_path = path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixHTTPConnection(self.unix_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixAdapter(HTTPAdapter):
+    """requests adapter sending every request of its prefix to one Unix socket"""
+    def __init__(self, path: str, pool_maxsize: int = 10):
+        super().__init__()
+        self._pool = UnixHTTPConnectionPool(path, maxsize=pool_maxsize)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        # requests < 2.32
+        return self._pool
+
+    def request_url(self, request, proxies):
+        return request.path_url
+
+    def close(self):
+        self._pool.close()
+        super().close()
+
+
+def backend_session(config) -> tuple:
+    """
+    (session, base url) to talk to the backend: its Unix socket when the
+    file exists, otherwise the TCP url.
+    """
+    session = requests.Session()
+    path = socket_path(config)
+    if path and os.path.exists(path):
+        session.mount(UNIX_URL, UnixAdapter(path))
+        return session, UNIX_URL
+    return session, config['backend'].get('url').rstrip('/')
@@ -1,13 +1,15 @@
-from logging.handlers import RotatingFileHandler
 import threading, logging
+from collections import namedtuple
 from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional, Union
+from typing import List, Optional, Union
 import subprocess as sp
 import psutil
 import os
 from pathlib import Path
 import pendulum
 import signal
+import random
+import time
 from PM3.model.pm3_protocol import KillMsg, alive_gone
 
 # TODO: Trovare nomi milgiori
@@ -18,6 +20,100 @@ def on_terminate(proc):
     #print("process {} terminated with exit code {}".format(proc.pid, proc.returncode))
 
 
+# Identita' dei processi (pid + create_time) gia' verificate:
+# key = pid, value = (psutil.Process, time.monotonic() of the last /proc read)
+IDENTITY_TTL = 1.0
+_identities = {}
+_identities_lock = threading.Lock()
+
+
+def read_create_time(pid: int) -> Optional[float]:
+    """create_time of pid (one /proc read), None if gone or not ours"""
+    try:
+        return _handle(pid, None).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+def _handle(pid: int, create_time: Optional[float]) -> psutil.Process:
+    """Cached psutil handle of pid, a new one when the identity is unknown or different"""
+    with _identities_lock:
+        cached = _identities.get(pid)
+    if cached is not None and create_time is not None and cached[0].create_time() == create_time:
+        return cached[0]
+    h = psutil.Process(pid)
+    with _identities_lock:
+        _identities[pid] = (h, time.monotonic())
+    return h
+
+
+def pid_alive(pid: int, create_time: float) -> bool:
+    """
+    pid is still the process started at create_time. os.kill(pid, 0) costs
+    a syscall and no /proc read, the identity (pid reuse) is read again
+    from /proc at most every IDENTITY_TTL seconds with a cached handle.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        with _identities_lock:
+            _identities.pop(pid, None)
+        return False
+    except PermissionError:
+        # Another user's process: our pid has been reused
+        return False
+    with _identities_lock:
+        cached = _identities.get(pid)
+    now = time.monotonic()
+    try:
+        if cached is not None and cached[0].create_time() == create_time:
+            if now - cached[1] < IDENTITY_TTL:
+                return True
+            h = cached[0]
+            # psutil compares the create_time read again from /proc
+            alive = h.is_running()
+        else:
+            h = psutil.Process(pid)
+            alive = h.create_time() == create_time
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        alive = False
+    with _identities_lock:
+        if alive:
+            _identities[pid] = (h, now)
+        else:
+            _identities.pop(pid, None)
+    return alive
+
+
+def _label(v: Optional[str]) -> str:
+    # Nome di gruppo o tag: usato come group:<nome> e nelle liste separate da virgole
+    v = (v or '').strip()
+    if any(c.isspace() or c == ',' for c in v):
+        raise ValueError(f'invalid group or tag {v!r}: no spaces or commas')
+    return v
+
+
+def status_fields(doc: dict) -> dict:
+    """running, autorun_status and restart_status of a process (document or Process.__dict__)"""
+    out = {}
+    # Fromatting running
+    out['running'] = True if doc['pid'] is not None and doc['pid'] > 0 else False
+
+    if doc['autorun'] is False:
+        out['autorun_status'] = '[red]disabled[/red]'
+    elif doc['autorun'] and doc['autorun_exclude']:
+        out['autorun_status'] = '[yellow]suspended[/yellow]'
+    elif doc['autorun'] and not doc['autorun_exclude']:
+        out['autorun_status'] = '[green]enabled[/green]'
+
+    # Formatting restart
+    n_restart = doc['restart'] if doc['restart'] > 0 else 0
+    out['restart_status'] = f"{n_restart}/{doc['max_restart']}"
+    if doc['crash_loop']:
+        out['restart_status'] += ' [red]crash-loop[/red]'
+    return out
+
+
 class ProcessStatusLight(BaseModel):
     pm3_id: int
     pm3_name: str
@@ -48,11 +144,15 @@ class ProcessStatusLight(BaseModel):
             v = ' '.join(v)
         return v
 
-    @model_validator(mode='after')
-    def time_ago_generator(self):
-        create_time = pendulum.from_timestamp(self.create_time)
-        time_ago = pendulum.now() - create_time
-        self.time_ago = time_ago.in_words()
+    @model_validator(mode='before')
+    @classmethod
+    def time_ago_generator(cls, data):
+        # Prima della validazione: create_time viene poi formattato come stringa
+        if isinstance(data, dict) and isinstance(data.get('create_time'), (int, float)):
+            create_time = pendulum.from_timestamp(data['create_time'])
+            time_ago = pendulum.now() - create_time
+            data['time_ago'] = time_ago.in_words()
+        return data
 
     @field_validator('create_time')
     def create_time_formatter(cls, v, values, **kwargs):
@@ -63,7 +163,7 @@ class ProcessStatusLight(BaseModel):
 
 class ProcessStatus(BaseModel):
     cmdline: list
-    connections: Union[list, None]
+    connections: Union[list, None] = None  # net_connections in psutil >= 6
     cpu_percent: float
     cpu_times: list
     create_time: float
@@ -94,62 +194,6 @@ class ProcessStatus(BaseModel):
     autorun: bool
     nohup: bool
 
-class LogPipe(threading.Thread):
-
-    def __init__(self, filename, level = logging.DEBUG):
-        """Setup the object with a logger and a loglevel
-        and start the thread
-        """
-        # nuovo logger
-        from uuid import uuid4
-        logger = logging.getLogger( str(uuid4()))
-        handler = RotatingFileHandler(filename, maxBytes=1000*1000*30, backupCount=20)
-        logger.level = level
-        handler.level = level
-        logger.addHandler( handler )
-
-        threading.Thread.__init__(self)
-        self.daemon = False
-        self.level = level
-        self.logger = logger
-        self.fdRead, self.fdWrite = os.pipe()
-        self.pipeReader = os.fdopen(self.fdRead)
-
-        self.start()
-
-    def fileno(self):
-        """Return the write file descriptor of the pipe
-        """
-        return self.fdWrite
-
-    def run(self):
-        """Run the thread, logging everything.
-        """
-        for line in iter(self.pipeReader.readline, ''):
-            self.logger.log(self.level, line.strip('\n'))
-
-        self.pipeReader.close()
-
-    def close(self):
-        """Close the write end of the pipe.
-        """
-        os.close(self.fdWrite)
-
-
-    # Utilizzata per mostrare i dati in formato tabellare
-
-    pm3_name: str
-    cmd: str
-    cwd: str = Path.home().as_posix()
-    pid: Union[int, None] = -1
-    restart: Union[int, str] = ''
-    running: bool = False
-    autorun: Union[bool, str] = False
-
-
-
-
-
 class Process(BaseModel):
     # Struttura vera del processo
     pm3_id: Optional[int] = Field(default=None, json_schema_extra={'list': True})  # None significa che deve essere assegnato da next_id()
@@ -157,6 +201,7 @@ class Process(BaseModel):
     cmd: str = Field(json_schema_extra={'list': True})
     cwd: Optional[str] = Field(default= Path.home().as_posix() , json_schema_extra={'list': True})
     pid: Optional[int] = Field(default=-1, json_schema_extra={'list': True})
+    pid_create_time: Optional[float] = None  # identita' del pid (psutil create_time), contro il riuso dei pid
     pm3_home: Optional[str] = Path('~/.pm3/').expanduser().as_posix()
     restart: int = Field(default=-1)
     shell: bool = False
@@ -167,6 +212,21 @@ class Process(BaseModel):
     nohup: bool = False
     max_restart: Optional[int] = 1000
     autorun_exclude : bool = False
+    exit_code: Optional[int] = None
+    tail_buffer_bytes: Optional[int] = None  # output tenuto in memoria, None = [log] tail_bytes
+    group: Optional[str] = None  # pm3 start group:<group>
+    tags: List[str] = []  # pm3 start tag:<tag>
+    # Restart policy
+    restart_strategy: str = 'exponential'  # immediate | fixed | exponential
+    restart_delay: float = 0.1  # secondi, ritardo fisso o base del backoff
+    restart_max_delay: float = 300.0
+    restart_jitter: float = 0.1  # frazione casuale del ritardo (+/-)
+    min_uptime: float = 1.0  # un'esecuzione piu' breve e' considerata un crash
+    crash_loop_threshold: int = 10
+    started_at: Optional[float] = None
+    unstable_restarts: int = 0
+    next_restart_at: Optional[float] = None
+    crash_loop: bool = False
     running: bool = Field(default=False, json_schema_extra={'list': True})
     autorun_status: Optional[str] = Field(default=None, json_schema_extra={'list': True} )
     restart_status: Optional[str] = Field(default=None, json_schema_extra={'list': True} )
@@ -186,61 +246,90 @@ class Process(BaseModel):
         errfile = f"{self.pm3_name}_{self.pm3_id}.err"
         self.stderr = self.stdout or Path(self.pm3_home, 'log', errfile).as_posix()
 
-        # Fromatting running
-        self.running = True if self.pid > 0 else False
+        for k, v in status_fields(self.__dict__).items():
+            setattr(self, k, v)
 
-        if self.autorun is False:
-            self.autorun_status = '[red]disabled[/red]'
-        elif self.autorun and self.autorun_exclude:
-            self.autorun_status = '[yellow]suspended[/yellow]'
-        elif self.autorun and not self.autorun_exclude:
-            self.autorun_status = '[green]enabled[/green]'
+    @field_validator('group')
+    def group_validator(cls, v):
+        return _label(v) or None
 
-        # Formatting restart
-        n_restart = self.restart if self.restart > 0 else 0
-        self.restart_status = f"{n_restart}/{self.max_restart}"
+    @field_validator('tags')
+    def tags_validator(cls, v):
+        # Senza duplicati, nell'ordine dato
+        return list(dict.fromkeys(_label(i) for i in v if _label(i)))
 
-    @property
-    def is_running(self):
-        if self.pid is not None and self.pid > 0:
+    @field_validator('restart_strategy')
+    def restart_strategy_validator(cls, v):
+        if v not in ('immediate', 'fixed', 'exponential'):
+            raise ValueError(f'unknown restart_strategy {v}')
+        return v
 
-            try:
-                # Verifico che il pid esita ancora
-                ps = self.ps(full=True)
-                # Verifico che il pid appartenga all'UID corrente
-                ps_cwd = ps.cwd()
-            except psutil.NoSuchProcess:
-                self.pid = -1
-                return False
-            except psutil.AccessDenied:
-                self.pid = -1
-                return False
+    def restart_backoff(self) -> float:
+        """Seconds to wait before the next automatic restart"""
+        if self.restart_strategy == 'immediate':
+            return 0
+        elif self.restart_strategy == 'fixed':
+            delay = self.restart_delay
+        elif self.unstable_restarts == 0:
+            # Last run was stable, restart right away
+            return 0
+        else:
+            delay = self.restart_delay * 2 ** min(self.unstable_restarts - 1, 32)
+        delay = min(delay, self.restart_max_delay)
+        return max(0.0, delay * (1 + random.uniform(-self.restart_jitter, self.restart_jitter)))
+
+    def register_exit(self, now=None):
+        """Update crash-loop state and next restart time after an exit"""
+        now = now or time.time()
+        if self.started_at is not None and now - self.started_at >= self.min_uptime:
+            self.unstable_restarts = 0
+        else:
+            self.unstable_restarts += 1
+        self.crash_loop = self.unstable_restarts >= self.crash_loop_threshold
+        self.next_restart_at = now + self.restart_backoff()
 
-            if ps.status() == 'zombie':
+    @property
+    def is_running(self):
+        if self.pid is None or self.pid <= 0:
+            self.pid = -1
+            self.pid_create_time = None
+            return False
+        if self.pid_create_time is not None:
+            if pid_alive(self.pid, self.pid_create_time):
                 return True
-
-            if Path(self.cwd) == Path(ps_cwd):
-                # Minimal check for error in pid
-                return ps.is_running()
             self.pid = -1
+            self.pid_create_time = None
             return False
-        else:
+
+        # No stored identity (older record, or pid set by hand):
+        # full check once, then the identity is kept
+        try:
+            # Verifico che il pid esita ancora
+            ps = self.ps(full=True)
+            # Verifico che il pid appartenga all'UID corrente
+            ps_cwd = ps.cwd()
+            zombie = ps.status() == 'zombie'
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
             self.pid = -1
             return False
 
+        if zombie or (Path(self.cwd) == Path(ps_cwd) and ps.is_running()):
+            self.pid_create_time = ps.create_time()
+            return True
+        self.pid = -1
+        return False
+
     def ps(self, full=False):
         if full:
-            return psutil.Process(self.pid)
+            # Cached handle, checked against the stored identity
+            return _handle(self.pid, self.pid_create_time)
         else:
             return ProcessStatus(**psutil.Process(self.pid).as_dict())
 
     @staticmethod
-    def kill_proc_tree(pid, sig=signal.SIGTERM, include_parent=True,
-                       timeout=5, on_terminate=on_terminate):
-        """Kill a process tree (including grandchildren) with signal
-        "sig" and return a (gone, still_alive) tuple.
-        "on_terminate", if specified, is a callback function which is
-        called as soon as a child terminates.
+    def signal_proc_tree(pid, sig=signal.SIGTERM, include_parent=True):
+        """Send signal "sig" to a process tree (including grandchildren)
+        without waiting, return the list of signalled psutil.Process.
         """
         parent = psutil.Process(pid)
         # Kill Parent and Children
@@ -253,6 +342,17 @@ class Process(BaseModel):
                 p.send_signal(sig)
             except psutil.NoSuchProcess:
                 pass
+        return children
+
+    @staticmethod
+    def kill_proc_tree(pid, sig=signal.SIGTERM, include_parent=True,
+                       timeout=5, on_terminate=on_terminate):
+        """Kill a process tree (including grandchildren) with signal
+        "sig" and return a (gone, still_alive) tuple.
+        "on_terminate", if specified, is a callback function which is
+        called as soon as a child terminates.
+        """
+        children = Process.signal_proc_tree(pid, sig=sig, include_parent=include_parent)
         try:
             gone, alive = psutil.wait_procs(children, timeout=timeout,
                                             callback=on_terminate)
@@ -277,12 +377,11 @@ class Process(BaseModel):
             self.pid = -1
             return KillMsg(msg='OK', alive=alive, gone=gone)
 
-    def run(self):
-        #fErrHandler = RotatingFileHandler(self.stderr, maxBytes=1000*1000*10, backupCount=5)
-        #fout = LogPipe(self.stderr)
-        #ferr = LogPipe(self.stdout)
-        fout = open(self.stdout, 'a')
-        ferr = open(self.stderr, 'a')
+    def run(self, fout=None, ferr=None):
+        # fout/ferr: fd o file per stdout/stderr (es. le pipe di LogCapture),
+        # altrimenti il processo scrive direttamente sui file di log
+        fout = fout if fout is not None else open(self.stdout, 'a')
+        ferr = ferr if ferr is not None else open(self.stderr, 'a')
         if isinstance(self.cmd, list):
             cmd = self.cmd
         elif isinstance(self.cmd, str):
@@ -314,9 +413,47 @@ class Process(BaseModel):
                          stderr=ferr,
                          bufsize=0)
         self.pid = p.pid
+        self.pid_create_time = read_create_time(p.pid)
+        self.exit_code = None
+        self.started_at = time.time()
+        self.next_restart_at = None
         self.restart += 1
         self.autorun_exclude = False
         return p
 
     def reset(self):
-        self.restart = 0
\ No newline at end of file
+        self.restart = 0
+        self.unstable_restarts = 0
+        self.next_restart_at = None
+        self.crash_loop = False
+
+
+def stop_trees(pids, timeout=5, sig=signal.SIGTERM) -> dict:
+    """
+    Signal the process tree of every pid first and then wait for all of
+    them with one shared deadline: stopping N processes takes as long as
+    the slowest one, not the sum.
+    key = pid, value = (gone, alive) lists of psutil.Process, both empty
+    for a pid already gone.
+    """
+    trees = {}
+    for pid in pids:
+        try:
+            trees[pid] = Process.signal_proc_tree(pid, sig=sig)
+        except psutil.NoSuchProcess:
+            trees[pid] = []
+    to_wait = [ps for tree in trees.values() for ps in tree]
+    try:
+        _, still_alive = psutil.wait_procs(to_wait, timeout=timeout)
+    except psutil.NoSuchProcess:
+        still_alive = []
+    alive_pids = {ps.pid for ps in still_alive}
+    return {pid: ([ps for ps in tree if ps.pid not in alive_pids], [ps for ps in tree if ps.pid in alive_pids])
+            for pid, tree in trees.items()}
+
+
+# Colonne di pm3 ls (i campi list=True). Una riga di ls e' una tupla costruita
+# dal documento gia' validato in scrittura, senza passare di nuovo da Process
+LIST_FIELDS = tuple(k for k, f in Process.model_fields.items()
+                    if f.json_schema_extra is not None and f.json_schema_extra.get('list') is True)
+ProcessRow = namedtuple('ProcessRow', LIST_FIELDS + ('autorun', ))
\ No newline at end of file
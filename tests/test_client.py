@@ -0,0 +1,78 @@
+import os
+import tempfile
+import threading
+import unittest
+from configparser import ConfigParser
+
+from flask import Flask, request
+
+from PM3.libs.client import Client
+from PM3.libs.server import UnixPoolWSGIServer
+
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        self.accepted = 0
+
+        @app.get('/ping')
+        def ping():
+            return {'err': False, 'msg': 'PONG', 'payload': []}
+
+        @app.post('/echo')
+        def echo():
+            return {'err': False, 'msg': '', 'payload': [request.get_json()]}
+
+        @app.get('/bad')
+        def bad():
+            return {'err': True, 'msg': 'unknown field bogus', 'payload': None}, 400
+
+        @app.get('/boom')
+        def boom():
+            return 'no', 500
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = UnixPoolWSGIServer(os.path.join(self.tmp.name, 'pm3.sock'), app, workers=4)
+        get_request = self.server.get_request
+
+        def count_accepted():
+            # una connessione accettata per ogni connessione del client
+            self.accepted += 1
+            return get_request()
+        self.server.get_request = count_accepted
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        config = ConfigParser()
+        config.read_dict({'main_section': {'pm3_home_dir': self.tmp.name},
+                          'backend': {'url': 'http://127.0.0.1:1/', 'read_timeout': 3}})
+        self.client = Client(config)
+
+    def tearDown(self):
+        self.client.reset()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_01_reuse(self):
+        for _ in range(5):
+            assert self.client.get('ping').msg == 'PONG'
+        # Una sola connessione per tutte le chiamate
+        assert self.accepted == 1
+        assert self.client.timeout == (5.0, 3.0)
+
+    def test_02_post_and_errors(self):
+        res = self.client.post('echo', {'a': 1})
+        assert res.err is False and res.payload == [{'a': 1}]
+        res = self.client.get('boom')
+        assert res.err and res.msg == 'Connection Error (500)'
+        # il messaggio del backend arriva al client
+        res = self.client.get('bad')
+        assert res.err and res.msg == 'unknown field bogus'
+
+    def test_03_connection_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        res = self.client.get('ping')
+        assert res.err
+        # Il trasporto viene scelto di nuovo: senza socket si passa al TCP
+        self.client.session
+        assert self.client.base_url == 'http://127.0.0.1:1'
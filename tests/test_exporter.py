@@ -0,0 +1,43 @@
+import unittest
+
+from PM3.libs.exporter import Histogram, render
+
+
+class TestExporter(unittest.TestCase):
+    def test_01_histogram(self):
+        h = Histogram(buckets=(0.1, 1))
+        h.observe('/ls', 0.05)
+        h.observe('/ls', 0.5)
+        h.observe('/ls', 5)
+        samples = {(name, labels.get('le')): value for name, labels, value in h.samples('lat', 'endpoint')}
+        assert samples[('lat_bucket', '0.1')] == 1
+        assert samples[('lat_bucket', '1')] == 2
+        assert samples[('lat_bucket', '+Inf')] == 3
+        assert samples[('lat_count', None)] == 3
+
+    def test_02_render(self):
+        docs = [{'pm3_id': 1, 'pm3_name': 'web "a"', 'pid': 100, 'restart': 2, 'exit_code': None,
+                 'crash_loop': False, 'started_at': 900.0},
+                {'pm3_id': 2, 'pm3_name': 'stopped', 'pid': -1, 'restart': -1, 'exit_code': 1,
+                 'crash_loop': True, 'started_at': None}]
+        snapshot = {100: [{'pid': 100, 'cpu_percent': 12.5, 'create_time': 950.0}]}
+        stats = {'flush_count': 3, 'records_written': 7, 'lock_waits': 0, 'lock_wait_seconds': 0.0}
+        text = render(docs, snapshot, stats, Histogram(), now=1000.0)
+        assert 'pm3_process_up{pm3_id="1",pm3_name="web \\"a\\""} 1' in text
+        assert 'pm3_process_up{pm3_id="2",pm3_name="stopped"} 0' in text
+        assert 'pm3_process_restarts_total{pm3_id="1",pm3_name="web \\"a\\""} 2' in text
+        assert 'pm3_process_uptime_seconds{pm3_id="1",pm3_name="web \\"a\\""} 50' in text
+        assert 'pm3_process_exit_code{pm3_id="2",pm3_name="stopped"} 1' in text
+        assert 'pm3_process_exit_code{pm3_id="1"' not in text
+        assert 'pm3_db_records_written_total 7' in text
+        assert text.endswith('\n')
+
+    def test_03_backend_without_managed(self):
+        docs = [{'pm3_id': 0, 'pm3_name': '__backend__', 'pid': 10, 'restart': 0},
+                {'pm3_id': 1, 'pm3_name': 'busy', 'pid': 11, 'restart': 0}]
+        busy = [{'pid': 11, 'ppid': 10, 'cpu_percent': 87.9}, {'pid': 12, 'ppid': 11, 'cpu_percent': 1.0}]
+        snapshot = {10: [{'pid': 10, 'ppid': 1, 'cpu_percent': 2.0}] + busy, 11: busy}
+        stats = {'flush_count': 0, 'records_written': 0, 'lock_waits': 0, 'lock_wait_seconds': 0.0}
+        text = render(docs, snapshot, stats, Histogram(), now=1000.0)
+        assert 'pm3_process_cpu_percent{pm3_id="0",pm3_name="__backend__"} 2' in text
+        assert 'pm3_process_cpu_percent{pm3_id="1",pm3_name="busy"} 88.9' in text
@@ -0,0 +1,64 @@
+import io
+import os
+import asyncio
+import tempfile
+import unittest
+
+from PM3.libs.follow import Follower
+
+
+class TestFollower(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.a = os.path.join(self.tmp.name, 'a.log')
+        self.b = os.path.join(self.tmp.name, 'b.log')
+        with open(self.a, 'w') as f:
+            f.write('old a\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def append(self, path, text):
+        with open(path, 'a') as f:
+            f.write(text)
+
+    async def scenario(self, follower):
+        task = asyncio.ensure_future(follower.run())
+        await asyncio.sleep(0.2)
+        self.append(self.a, 'a1\n')
+        # b non esiste ancora all'avvio
+        self.append(self.b, 'b1\npart')
+        await asyncio.sleep(0.3)
+        self.append(self.b, 'ial\n')
+        # rotazione: rename e nuovo file
+        os.rename(self.a, self.a + '.1')
+        self.append(self.a, 'a2\n')
+        await asyncio.sleep(0.3)
+        # troncamento
+        open(self.a, 'w').close()
+        await asyncio.sleep(0.3)
+        self.append(self.a, 'a3\n')
+        await asyncio.sleep(0.7)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def check(self, inotify: bool):
+        out = io.StringIO()
+        follower = Follower([(self.a, 'a'), (self.b, 'bb')], lines=1, colors=False,
+                            poll_interval=0.1, out=out)
+        if not inotify:
+            follower._setup_inotify = lambda: False
+        asyncio.run(self.scenario(follower))
+        lines = out.getvalue().splitlines()
+        assert lines[0] == 'a  | old a'
+        assert [i for i in lines if i.startswith('a ')] == ['a  | old a', 'a  | a1', 'a  | a2', 'a  | a3']
+        assert [i for i in lines if i.startswith('bb')] == ['bb | b1', 'bb | partial']
+
+    def test_01_inotify(self):
+        self.check(inotify=True)
+
+    def test_02_polling(self):
+        self.check(inotify=False)
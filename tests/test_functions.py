@@ -1,5 +1,5 @@
 from importlib import import_module
-import json, os
+import json, os, time
 from subprocess import run
 from types import SimpleNamespace as Namespace
 import unittest
@@ -38,6 +38,11 @@ def dump_and_read_json():
     with open(file_name) as f:
         return json.loads( f.read())
 
+def group_pids():
+    result = shell(f"python -m {module}.cli ls group:ingest -j --fields pid")
+    assert result.exit_code == 0
+    return json.loads(result.stdout)
+
 
 
 class TestShell(unittest.TestCase):
@@ -128,6 +133,79 @@ class TestShell(unittest.TestCase):
         result = shell(f"python -m {module}.cli restart {test_process_name}")
         assert result.exit_code == 0
 
+    def test_12b_test_load(self):
+        # load di piu' processi con una sola richiesta bulk
+        file_name = "test0dump_load_" + datetime.now().strftime("%d%m%Y-%H%M%S.%f") + ".json"
+        with open(file_name, 'w') as f:
+            json.dump([{'cmd': 'sleep 1', 'pm3_name': f'bulk_{i}'} for i in range(3)], f)
+        result = shell(f"python -m {module}.cli load -y -f {file_name}")
+        os.remove(file_name)
+        assert result.exit_code == 0
+        names = {p['pm3_name']: p['pm3_id'] for p in dump_and_read_json()}
+        assert {'bulk_0', 'bulk_1', 'bulk_2'} <= set(names)
+        assert len({names[f'bulk_{i}'] for i in range(3)}) == 3
+        for i in range(3):
+            assert shell(f"python -m {module}.cli rm bulk_{i}").exit_code == 0
+
+    def test_12c_test_group(self):
+        # start/stop di un gruppo e di un tag, con il riepilogo
+        for i in range(3):
+            tag = '-t gpu' if i < 2 else ''
+            result = shell(f"python -m {module}.cli new 'sleep 100' -n group_{i} -g ingest {tag}")
+            assert result.exit_code == 0
+        result = shell(f"python -m {module}.cli start group:ingest")
+        assert result.exit_code == 0
+        assert 'group=ingest: 3 processes, results 3 ok' in result.stdout
+        running = {p['pm3_name']: p['pid'] for p in group_pids()}
+        assert all(running[f'group_{i}'] > 0 for i in range(3))
+        result = shell(f"python -m {module}.cli stop tag:gpu")
+        assert 'tag=gpu: 2 processes' in result.stdout
+        stopped = {p['pm3_name']: p['pid'] for p in group_pids()}
+        assert stopped['group_0'] == stopped['group_1'] == -1
+        assert stopped['group_2'] > 0
+        for i in range(3):
+            assert shell(f"python -m {module}.cli rm group_{i}").exit_code == 0
+
+    def test_12d_test_stop_event(self):
+        # un processo fermato da stop non e' un crash
+        from PM3.cli import _get
+        assert shell(f"python -m {module}.cli new 'sleep 100' -n stop_event").exit_code == 0
+        assert shell(f"python -m {module}.cli start stop_event").exit_code == 0
+        assert shell(f"python -m {module}.cli stop stop_event").exit_code == 0
+        for _ in range(20):
+            # l'evento e' scritto dal reaper
+            res = _get('events', {'id_or_name': 'stop_event'})
+            if res.payload:
+                break
+            time.sleep(0.1)
+        assert [e['kind'] for e in res.payload] == ['stop']
+        assert shell(f"python -m {module}.cli rm stop_event").exit_code == 0
+
+    def test_12f_test_stop_not_running(self):
+        # stop di un processo non in esecuzione non lo esclude dall'autorun
+        assert shell(f"python -m {module}.cli new 'sleep 100' -n stop_idle").exit_code == 0
+        assert shell(f"python -m {module}.cli stop stop_idle").exit_code == 0
+        result = shell(f"python -m {module}.cli ls stop_idle -j --fields autorun_exclude")
+        assert [i['autorun_exclude'] for i in json.loads(result.stdout)] == [False]
+        assert shell(f"python -m {module}.cli rm stop_idle").exit_code == 0
+
+    def test_12e_test_fast_exit(self):
+        # processi che escono subito: l'uscita non si perde
+        for i in range(6):
+            assert shell(f"python -m {module}.cli new false -n fast_{i} -g fast").exit_code == 0
+        assert shell(f"python -m {module}.cli start group:fast").exit_code == 0
+        from PM3.cli import _get
+        for _ in range(100):
+            docs = _get('ls/group:fast', {'fields': 'pid,exit_code,unstable_restarts,next_restart_at'}).payload
+            if all(d['exit_code'] == 1 and d['next_restart_at'] is not None for d in docs):
+                break
+            time.sleep(0.1)
+        for d in docs:
+            assert d['pid'] == -1 and d['exit_code'] == 1
+            assert d['unstable_restarts'] == 1 and d['next_restart_at'] is not None
+        for i in range(6):
+            assert shell(f"python -m {module}.cli rm fast_{i}").exit_code == 0
+
     def test_13_async_daemon_stop(self):
         result = shell(f"python -m {module}.cli daemon stop")
         assert result.exit_code == 0
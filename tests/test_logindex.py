@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from PM3.libs import logindex
+from PM3.libs.logpipe import RotatingWriter
+
+
+class TestLogIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'proc.log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_lines(self, writer, start, stop):
+        writer.write(b''.join(f'line {i}\n'.encode() for i in range(start, stop)))
+
+    def test_01_tail(self):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(f'{i}\n'.encode() for i in range(100000)))
+        assert logindex.tail(self.path, 3) == ['99997\n', '99998\n', '99999\n']
+        assert len(logindex.tail(self.path, 50000)) == 50000
+        assert logindex.tail(self.path, 0) == []
+
+    def test_02_sparse_index(self):
+        w = RotatingWriter(self.path, index_bytes=1000)
+        for i in range(100):
+            self.write_lines(w, i * 50, (i + 1) * 50)
+        w.flush()
+        entries = logindex.read_index(self.path)
+        # indice sparso: molte meno voci che righe
+        assert 1 < len(entries) < 100
+        for offset, line, _ in entries:
+            lines, _ = logindex.read_from(self.path, offset, lines=1)
+            if lines:
+                assert lines[0] == f'line {line}\n'
+        w.close()
+
+    def test_03_time_range(self):
+        # 3 blocchi di righe catturati a t=100, t=200 e t=300
+        with open(self.path, 'wb') as f:
+            f.write(b'a1\na2\nb1\nb2\nc1\nc2\n')
+        with open(logindex.index_path(self.path), 'wb') as f:
+            for record in [(0, 0, 100.0), (6, 2, 200.0), (12, 4, 300.0)]:
+                f.write(logindex.RECORD.pack(*record))
+        start, end = logindex.time_range(self.path, since=250)
+        assert logindex.read_from(self.path, start, until_offset=end)[0] == ['b1\n', 'b2\n', 'c1\n', 'c2\n']
+        start, end = logindex.time_range(self.path, since=200, until=250)
+        assert logindex.read_from(self.path, start, until_offset=end)[0] == ['b1\n', 'b2\n']
+        assert logindex.time_range(self.path, until=50) == (0, 0)
+
+    def test_04_offset_paging(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'a\nbb\nccc\npartial')
+        lines, offset = logindex.read_from(self.path, 0, lines=2)
+        assert lines == ['a\n', 'bb\n'] and offset == 5
+        lines, offset = logindex.read_from(self.path, offset)
+        # la riga incompleta non viene restituita
+        assert lines == ['ccc\n'] and offset == 9
+
+    def test_05_truncated_log(self):
+        w = RotatingWriter(self.path, index_bytes=100)
+        self.write_lines(w, 0, 1000)
+        w.flush()
+        open(self.path, 'w').close()
+        assert len(logindex.read_index(self.path)) <= 1
+        w.tick(0)
+        self.write_lines(w, 0, 10)
+        w.flush()
+        entries = logindex.read_index(self.path)
+        assert entries[0][0] == 0
+        w.close()
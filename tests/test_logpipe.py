@@ -0,0 +1,66 @@
+import os
+import gzip
+import time
+import tempfile
+import unittest
+import subprocess as sp
+
+from PM3.libs.logpipe import LogCapture, RotatingWriter, Compressor
+
+
+class TestRotatingWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'proc.log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_01_size_rotation(self):
+        w = RotatingWriter(self.path, max_bytes=100, backup_count=2)
+        for i in range(10):
+            w.write(b'x' * 60 + b'\n')
+        w.close()
+        segments = w.segments()
+        assert len(segments) == 2
+        assert os.path.getsize(self.path) < 100
+        for seg in segments:
+            assert os.path.getsize(seg) >= 100
+
+    def test_02_time_rotation_and_compress(self):
+        compressor = Compressor()
+        compressor.start()
+        w = RotatingWriter(self.path, rotate_interval=10, compressor=compressor)
+        w.write(b'hello\n')
+        w.tick(w.opened_at + 11)
+        w.write(b'world\n')
+        w.close()
+        compressor.queue.join()
+        segments = w.segments()
+        assert len(segments) == 1 and segments[0].endswith('.gz')
+        with gzip.open(segments[0]) as f:
+            assert f.read() == b'hello\n'
+        with open(self.path, 'rb') as f:
+            assert f.read() == b'world\n'
+
+
+class TestLogCapture(unittest.TestCase):
+    def test_01_capture(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out, err = os.path.join(tmp, 'p.log'), os.path.join(tmp, 'p.err')
+            capture = LogCapture(flush_interval=0.1)
+            capture.start()
+            fds = capture.attach(out, err)
+            p = sp.Popen(['sh', '-c', 'seq 1 20000; echo oops >&2'], stdout=fds[0], stderr=fds[1])
+            capture.release(*fds)
+            p.wait()
+            deadline = time.time() + 5
+            while capture._writers and time.time() < deadline:
+                time.sleep(0.05)
+            # EOF su entrambe le pipe: writer chiusi e file completi
+            assert not capture._writers
+            with open(out) as f:
+                lines = f.read().splitlines()
+            assert len(lines) == 20000 and lines[-1] == '20000'
+            with open(err) as f:
+                assert f.read() == 'oops\n'
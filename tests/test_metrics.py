@@ -0,0 +1,37 @@
+import unittest
+
+from PM3.libs.metrics import MetricsRing, METRICS, own_rows, tree_sample
+
+
+class TestMetricsRing(unittest.TestCase):
+    def test_01_wrap_around(self):
+        ring = MetricsRing(4)
+        for i in range(10):
+            ring.append({'time': i, 'cpu_percent': i * 10})
+        assert len(ring) == 4
+        data = ring.to_dict()
+        # dal piu' vecchio al piu' recente
+        assert data['time'] == [6, 7, 8, 9]
+        assert data['cpu_percent'] == [60, 70, 80, 90]
+        assert ring.to_dict(last=2)['time'] == [8, 9]
+        assert set(data) == set(METRICS)
+
+    def test_02_partial(self):
+        ring = MetricsRing(4)
+        ring.append({'time': 1, 'rss': 1024})
+        assert ring.to_dict()['rss'] == [1024]
+        assert ring.to_dict(last=10)['time'] == [1]
+
+
+class TestTreeSample(unittest.TestCase):
+    def test_01_own_rows(self):
+        # backend (1) -> managed (2) -> figlio (3), backend -> figlio proprio (4)
+        rows = [{'pid': 1, 'ppid': 0, 'cpu_percent': 1.0},
+                {'pid': 2, 'ppid': 1, 'cpu_percent': 50.0},
+                {'pid': 4, 'ppid': 1, 'cpu_percent': 2.0},
+                {'pid': 3, 'ppid': 2, 'cpu_percent': 30.0}]
+        assert [r['pid'] for r in own_rows(rows, {1, 2})] == [1, 4]
+        assert tree_sample(own_rows(rows, {1, 2}), 0)['cpu_percent'] == 3.0
+        # la radice resta anche se gestita
+        assert [r['pid'] for r in own_rows(rows[1:2] + rows[3:], {1, 2})] == [2, 3]
+        assert own_rows([], {1}) == []
@@ -2,7 +2,7 @@ from importlib import import_module
 import json
 import math, random
 from subprocess import run
-from time import sleep
+from time import sleep, monotonic
 from types import SimpleNamespace as Namespace
 import unittest
 unittest.TestLoader.sortTestMethodsUsing = None
@@ -59,6 +59,27 @@ class TestMultithreading(unittest.TestCase):
         pool = ThreadPool(10)
         results = pool.map(my_function, range(30))
 
+    def test_02_concurrent_inserts(self):
+        """
+        Richieste concorrenti al backend senza la cli: nessuna sleep sul lock
+        (0.1 s per richiesta prima del RWLock) e nessun id duplicato.
+        """
+        from multiprocessing.dummy import Pool as ThreadPool
+        from PM3.cli import _get, _post
+        from PM3.model.process import Process
+        names = [f'concurrent_{i}' for i in range(100)]
+        pool = ThreadPool(10)
+        start = monotonic()
+        results = pool.map(lambda name: _post('new', Process(pm3_name=name, cmd='sleep 100').model_dump()), names)
+        elapsed = monotonic() - start
+        try:
+            assert all(not res.err and 'was added' in res.msg for res in results)
+            docs = [i for i in _get('ls/all').payload if i['pm3_name'] in names]
+            assert len({i['pm3_id'] for i in docs}) == len(names)
+            assert elapsed < 5
+        finally:
+            pool.map(lambda name: _get(f'rm/{name}'), names)
+
     
 if __name__ == "__main__":
     test = TestMultithreading()
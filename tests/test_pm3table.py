@@ -0,0 +1,322 @@
+import time
+import tempfile
+import subprocess
+import threading
+import unittest
+from pathlib import Path
+
+from PM3.libs.storage import StorageEngine, SQLiteEngine, TinyDBEngine
+from PM3.libs.pm3table import Pm3Table
+from PM3.model.process import Process, read_create_time
+
+table_name = 'pm3_procs'
+
+
+class MemoryEngine(StorageEngine):
+    # Conta le letture e registra ogni scrittura
+    def __init__(self, docs=()):
+        self.docs = {i['pm3_id']: dict(i) for i in docs}
+        self.loads = 0
+        self.saves = []
+
+    def load(self) -> list:
+        self.loads += 1
+        return [dict(i) for i in self.docs.values()]
+
+    def save(self, procs: dict, changed: set, meta: dict = None):
+        self.saves.append(set(changed))
+        self.docs = {k: dict(v) for k, v in procs.items()}
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lock_file = Path(self.tmp_dir.name, 'pm3_db.lock').as_posix()
+        docs = [Process(pm3_id=i, pm3_name=f'process_{i}', cmd='sleep 100').model_dump() for i in (1, 2)]
+        self.engine = MemoryEngine(docs)
+        self.ptbl = Pm3Table(self.engine, lock_file=self.lock_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_01_reads_from_memory(self):
+        for _ in range(3):
+            assert self.ptbl.find_id_or_name('process_1').proc[0].pm3_id == 1
+            assert self.ptbl.find_id_or_name('2').proc[0].pm3_name == 'process_2'
+            assert len(self.ptbl.find_id_or_name('all').proc) == 2
+        # il database e' letto solo all'avvio
+        assert self.engine.loads == 1
+        assert self.ptbl.find_id_or_name('missing').proc == []
+
+    def test_02_copies(self):
+        doc = self.ptbl.select(Process(pm3_id=1, pm3_name='x', cmd='x'))
+        doc['cmd'] = 'changed'
+        self.ptbl.all()[0]['cmd'] = 'changed'
+        assert self.ptbl.find_docs('1').proc[0]['cmd'] == 'sleep 100'
+
+    def test_03_name_index(self):
+        proc = self.ptbl.find_id_or_name('process_1').proc[0]
+        proc.pm3_name = 'renamed'
+        assert self.ptbl.update(proc) is True
+        assert self.ptbl.find_id_or_name('process_1').proc == []
+        assert self.ptbl.find_id_or_name('renamed').proc[0].pm3_id == 1
+        assert self.ptbl.check_exist('renamed', col='pm3_name')
+
+        assert self.ptbl.delete(proc) is True
+        assert self.ptbl.find_id_or_name('renamed').proc == []
+        assert self.ptbl.delete(proc) is False
+        assert self.ptbl.update(proc) is False
+
+    def test_04_pids(self):
+        proc = self.ptbl.find_id_or_name('process_2').proc[0]
+        proc.pid = 4321
+        self.ptbl.update(proc)
+        assert self.ptbl.pids() == {4321: 2}
+
+
+class TestTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sqlite_path = Path(self.tmp_dir.name, 'pm3_db.sqlite').as_posix()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_01_flush(self):
+        engine = SQLiteEngine(self.sqlite_path, table_name)
+        ptbl = Pm3Table(engine, lock_file=self.sqlite_path + '.lock')
+        ptbl.insert(Process(pm3_id=1, pm3_name='first', cmd='sleep 100'))
+        assert ptbl.flush() is True
+        # niente da scrivere
+        assert ptbl.flush() is False
+        proc = ptbl.find_id_or_name('first').proc[0]
+        assert ptbl.update(proc) is True
+        assert ptbl.flush() is False
+
+        proc.pm3_name = 'second'
+        ptbl.update(proc)
+        assert ptbl.flush() is True
+        assert Pm3Table(engine, lock_file=self.sqlite_path + '.lock').find_id_or_name('second').proc[0].pm3_id == 1
+
+    def test_02_find_docs(self):
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        ptbl.insert(Process(pm3_id=1, pm3_name='first', cmd='sleep 100'))
+        ptbl.insert(Process(pm3_id=2, pm3_name='__hidden__', cmd='sleep 100'))
+        proc = Process(pm3_id=3, pm3_name='third', cmd='sleep 100')
+        # pid impostato dopo la validazione: lo stato salvato e' aggiornato
+        proc.pid = 1234
+        ptbl.insert(proc)
+        assert [i['pm3_id'] for i in ptbl.find_docs('all').proc] == [1, 3]
+        assert len(ptbl.find_docs('ALL').proc) == 3
+        assert ptbl.find_docs('third').proc[0]['running'] is True
+        assert ptbl.find_docs('3').type == 'pm3_id'
+        # copie: modificarle non tocca la tabella
+        ptbl.find_docs('first').proc[0]['cmd'] = 'changed'
+        assert ptbl.find_id_or_name('first').proc[0].cmd == 'sleep 100'
+
+    def test_03_groups_and_tags(self):
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        ptbl.insert(Process(pm3_id=1, pm3_name='w1', cmd='sleep 100', group='ingest', tags=['gpu']))
+        ptbl.insert(Process(pm3_id=2, pm3_name='w2', cmd='sleep 100', group='ingest'))
+        ptbl.insert(Process(pm3_id=3, pm3_name='w3', cmd='sleep 100', tags=['gpu', 'big']))
+        ion = ptbl.find_docs('group:ingest')
+        assert (ion.type, ion.data) == ('group', 'ingest')
+        assert [i['pm3_id'] for i in ion.proc] == [1, 2]
+        assert [i['pm3_id'] for i in ptbl.find_docs('tag:gpu').proc] == [1, 3]
+        assert ptbl.find_docs('group:other').proc == []
+
+        # l'indice segue update e delete
+        proc = ptbl.find_id_or_name('w2').proc[0]
+        proc.group = 'export'
+        ptbl.update(proc)
+        assert [i['pm3_id'] for i in ptbl.find_docs('group:ingest').proc] == [1]
+        assert [i['pm3_id'] for i in ptbl.find_docs('group:export').proc] == [2]
+        ptbl.delete(ptbl.find_id_or_name('w3').proc[0])
+        assert [i['pm3_id'] for i in ptbl.find_docs('tag:gpu').proc] == [1]
+        assert ptbl.find_docs('tag:big').proc == []
+
+        # e viene ricostruito dal database
+        ptbl.flush()
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        assert [i['pm3_id'] for i in ptbl.find_docs('group:export').proc] == [2]
+        assert [i['pm3_id'] for i in ptbl.find_docs('tag:gpu').proc] == [1]
+
+    def test_04_refresh_dead_process(self):
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        p = subprocess.Popen(['sleep', '100'])
+        proc = Process(pm3_id=1, pm3_name='dead', cmd='sleep 100')
+        proc.pid, proc.pid_create_time = p.pid, read_create_time(p.pid)
+        ptbl.insert(proc)
+        doc = ptbl.refresh(ptbl.find_docs('dead').proc[0])
+        assert doc['running'] is True
+        p.kill()
+        p.wait()
+        # gia' al primo ls dopo l'uscita
+        doc = ptbl.refresh(ptbl.find_docs('dead').proc[0])
+        assert doc['pid'] == -1 and doc['running'] is False
+        assert ptbl.find_docs('dead').proc[0]['running'] is False
+
+    def test_05_refresh_pid_none(self):
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        ptbl.insert(Process(pm3_id=1, pm3_name='new', cmd='sleep 100', pid=None))
+        doc = ptbl.refresh(ptbl.find_docs('new').proc[0])
+        assert doc['pid'] == -1 and doc['running'] is False
+
+    def test_06_set_fields(self):
+        ptbl = Pm3Table(SQLiteEngine(self.sqlite_path, table_name), lock_file=self.sqlite_path + '.lock')
+        proc = Process(pm3_id=1, pm3_name='stopped', cmd='sleep 100')
+        proc.pid, proc.pid_create_time = 1234, 100.0
+        ptbl.insert(proc)
+        snapshot = ptbl.find_id_or_name('stopped').proc[0]
+        # il reaper scrive l'uscita mentre /stop aspetta
+        exited = ptbl.find_id_or_name('stopped').proc[0]
+        exited.pid, exited.pid_create_time, exited.exit_code = -1, None, -15
+        ptbl.update(exited)
+        # /stop scrive solo il pid, e solo se e' ancora quello fermato
+        assert ptbl.set_fields(1, {'pid': -1, 'pid_create_time': None}, where={'pid': snapshot.pid}) is False
+        doc = ptbl.find_docs('stopped').proc[0]
+        assert doc['exit_code'] == -15 and doc['pid_create_time'] is None
+        assert ptbl.set_fields(1, {'autorun_exclude': True, 'autorun': True})
+        doc = ptbl.find_docs('stopped').proc[0]
+        assert doc['exit_code'] == -15 and doc['autorun_status'] == '[yellow]suspended[/yellow]'
+        assert ptbl.set_fields(99, {'pid': -1}) is False
+
+
+class FailingEngine(MemoryEngine):
+    # La prima scrittura fallisce
+    def save(self, procs: dict, changed: set, meta: dict = None):
+        if not self.saves:
+            self.saves.append(None)
+            raise OSError('disk full')
+        super().save(procs, changed, meta)
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lock_file = Path(self.tmp_dir.name, 'pm3_db.lock').as_posix()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_01_batched(self):
+        engine = MemoryEngine()
+        ptbl = Pm3Table(engine, lock_file=self.lock_file)
+        for i in range(1, 4):
+            ptbl.insert(Process(pm3_id=i, pm3_name=f'process_{i}', cmd='sleep 100'))
+        proc = ptbl.find_id_or_name('process_1').proc[0]
+        for pid in range(100, 110):
+            proc.pid = pid
+            ptbl.update(proc)
+        # niente e' scritto prima del flush
+        assert engine.saves == [] and ptbl.dirty
+        assert ptbl.flush() is True
+        # una sola scrittura con tutti i record cambiati
+        assert engine.saves == [{1, 2, 3}]
+        assert engine.docs[1]['pid'] == 109
+        assert not ptbl.dirty and ptbl.flush() is False
+
+        ptbl.delete(proc)
+        ptbl.flush()
+        assert engine.saves[-1] == {1} and 1 not in engine.docs
+        assert ptbl.stats()['flush_count'] == 2 and ptbl.stats()['records_written'] == 4
+
+    def test_02_failed_write_is_retried(self):
+        engine = FailingEngine()
+        ptbl = Pm3Table(engine, lock_file=self.lock_file)
+        ptbl.insert(Process(pm3_id=1, pm3_name='first', cmd='sleep 100'))
+        with self.assertRaises(OSError):
+            ptbl.flush()
+        # i record restano da scrivere
+        ptbl.insert(Process(pm3_id=2, pm3_name='second', cmd='sleep 100'))
+        assert ptbl.flush() is True
+        assert engine.saves[-1] == {1, 2}
+        assert set(engine.docs) == {1, 2}
+
+    def test_03_concurrent_writes(self):
+        engine = MemoryEngine()
+        ptbl = Pm3Table(engine, lock_file=self.lock_file)
+
+        def writer(start):
+            for i in range(start, start + 50):
+                ptbl.insert(Process(pm3_id=i, pm3_name=f'process_{i}', cmd='sleep 100'))
+                if i % 10 == 0:
+                    ptbl.flush()
+
+        threads = [threading.Thread(target=writer, args=(i * 100 + 1, )) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ptbl.flush()
+        # nessuna scrittura persa tra i flush
+        assert len(engine.docs) == 200
+        assert set().union(*engine.saves) == set(engine.docs)
+
+
+class TestIdAllocator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lock_file = Path(self.tmp_dir.name, 'pm3_db.lock').as_posix()
+        self.json_path = Path(self.tmp_dir.name, 'pm3_db.json').as_posix()
+        self.sqlite_path = Path(self.tmp_dir.name, 'pm3_db.sqlite').as_posix()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_01_id_high_water(self):
+        for engine in (SQLiteEngine(self.sqlite_path, table_name), TinyDBEngine(self.json_path, table_name)):
+            ptbl = Pm3Table(engine, lock_file=self.sqlite_path + '.lock')
+            for n in range(3):
+                with ptbl.transaction():
+                    ptbl.insert(Process(pm3_id=ptbl.reserve_id(), pm3_name=f'p{n}', cmd='sleep 100'))
+            assert ptbl.next_id() == 4
+            # l'id piu' alto rimosso non viene riusato, nemmeno dopo il reload
+            ptbl.delete(ptbl.find_id_or_name('p2').proc[0])
+            ptbl.flush()
+            ptbl = Pm3Table(engine, lock_file=self.sqlite_path + '.lock')
+            assert ptbl.reserve_id() == 4
+            # un id esplicito alza il limite
+            ptbl.insert(Process(pm3_id=10, pm3_name='p10', cmd='sleep 100'))
+            assert ptbl.next_id() == 11
+            # un id non usato viene restituito
+            pm3_id = ptbl.reserve_id()
+            ptbl.release_id(pm3_id)
+            assert ptbl.next_id() == pm3_id
+
+    def test_02_id_reuse(self):
+        engine = SQLiteEngine(self.sqlite_path, table_name)
+        ptbl = Pm3Table(engine, lock_file=self.sqlite_path + '.lock', id_reuse=True)
+        for n in range(1, 6):
+            ptbl.insert(Process(pm3_id=ptbl.reserve_id(), pm3_name=f'p{n}', cmd='sleep 100'))
+        for n in (4, 2):
+            ptbl.delete(ptbl.find_id_or_name(f'p{n}').proc[0])
+        ptbl.flush()
+        # il piu' piccolo libero per primo, anche dopo il reload
+        ptbl = Pm3Table(engine, lock_file=self.sqlite_path + '.lock', id_reuse=True)
+        assert ptbl.next_id() == 2
+        # id esplicito preso dalla free-list
+        ptbl.insert(Process(pm3_id=2, pm3_name='explicit', cmd='sleep 100'))
+        assert ptbl.reserve_id() == 4
+        assert ptbl.reserve_id() == 6
+        # buchi lasciati da un id esplicito
+        ptbl.insert(Process(pm3_id=9, pm3_name='p9', cmd='sleep 100'))
+        assert [ptbl.reserve_id() for _ in range(3)] == [7, 8, 10]
+
+    def test_03_far_explicit_id(self):
+        for id_reuse in (False, True):
+            engine = MemoryEngine()
+            ptbl = Pm3Table(engine, lock_file=self.lock_file, id_reuse=id_reuse)
+            ptbl.insert(Process(pm3_id=1, pm3_name='first', cmd='sleep 100'))
+            start = time.monotonic()
+            ptbl.insert(Process(pm3_id=30000000, pm3_name='far', cmd='sleep 100'))
+            ptbl.flush()
+            ptbl = Pm3Table(engine, lock_file=self.lock_file, id_reuse=id_reuse)
+            # il buco non viene percorso id per id
+            assert time.monotonic() - start < 0.5
+            if id_reuse:
+                assert [ptbl.reserve_id() for _ in range(2)] == [2, 3]
+                ptbl.insert(Process(pm3_id=5, pm3_name='explicit', cmd='sleep 100'))
+                assert [ptbl.reserve_id() for _ in range(2)] == [4, 6]
+            else:
+                assert ptbl.reserve_id() == 30000001
@@ -0,0 +1,122 @@
+import os
+import time
+import unittest
+import subprocess
+
+import psutil
+
+from PM3.model.process import Process, ProcessRow, LIST_FIELDS, pid_alive, status_fields, stop_trees
+
+
+class TestRestartPolicy(unittest.TestCase):
+    def make_process(self, **kwargs):
+        return Process(pm3_id=1, pm3_name='crashing', cmd='false', restart_jitter=0, **kwargs)
+
+    def test_01_exponential_backoff(self):
+        proc = self.make_process(restart_delay=1, restart_max_delay=10)
+        delays = []
+        for _ in range(6):
+            proc.started_at = 1000
+            proc.register_exit(now=1000.1)
+            delays.append(round(proc.next_restart_at - 1000.1, 3))
+        assert delays == [1, 2, 4, 8, 10, 10]
+
+    def test_02_stable_run_resets(self):
+        proc = self.make_process(min_uptime=5)
+        for _ in range(3):
+            proc.started_at = 1000
+            proc.register_exit(now=1001)
+        assert proc.unstable_restarts == 3
+        proc.started_at = 1000
+        proc.register_exit(now=1010)
+        assert proc.unstable_restarts == 0
+        assert proc.next_restart_at == 1010
+
+    def test_03_crash_loop(self):
+        proc = self.make_process(restart_strategy='fixed', restart_delay=2, crash_loop_threshold=3)
+        for _ in range(3):
+            proc.started_at = 1000
+            proc.register_exit(now=1000)
+        assert proc.crash_loop is True
+        assert proc.next_restart_at == 1002
+        # lo stato deve essere visibile in ls
+        assert 'crash-loop' in Process(**proc.model_dump()).restart_status
+        proc.reset()
+        assert proc.crash_loop is False
+
+
+class TestLiveness(unittest.TestCase):
+    def setUp(self):
+        self.proc = Process(pm3_id=1, pm3_name='sleeper', cmd='sleep 30', cwd='/tmp',
+                            stdout=os.devnull)
+        self.popen = self.proc.run()
+
+    def tearDown(self):
+        self.popen.kill()
+        self.popen.wait()
+
+    def test_01_identity(self):
+        # create_time salvato all'avvio
+        assert self.proc.pid_create_time == psutil.Process(self.popen.pid).create_time()
+        assert self.proc.is_running
+        self.popen.kill()
+        self.popen.wait()
+        assert not self.proc.is_running
+        assert self.proc.pid == -1 and self.proc.pid_create_time is None
+
+    def test_02_pid_reuse(self):
+        # Stesso pid, altro processo: create_time diverso
+        other = Process(**{**self.proc.model_dump(), 'pid_create_time': self.proc.pid_create_time - 100})
+        assert not other.is_running
+        assert other.pid == -1
+
+    def test_03_legacy_record(self):
+        # Record senza identita': controllo completo una volta, poi l'identita' resta
+        legacy = Process(**{**self.proc.model_dump(), 'pid_create_time': None})
+        assert legacy.is_running
+        assert legacy.pid_create_time == self.proc.pid_create_time
+        assert pid_alive(legacy.pid, legacy.pid_create_time)
+
+
+class TestListing(unittest.TestCase):
+    def test_01_status_fields(self):
+        proc = Process(pm3_id=1, pm3_name='p', cmd='sleep 1', autorun=True, restart=3)
+        doc = proc.model_dump()
+        # Campi calcolati uguali a quelli della validazione
+        assert status_fields(doc) == {k: doc[k] for k in ('running', 'autorun_status', 'restart_status')}
+        doc.update(pid=123, autorun_exclude=True, crash_loop=True)
+        assert status_fields(doc) == {'running': True, 'autorun_status': '[yellow]suspended[/yellow]',
+                                      'restart_status': '3/1000 [red]crash-loop[/red]'}
+
+    def test_02_row(self):
+        doc = Process(pm3_id=7, pm3_name='p', cmd='sleep 1').model_dump()
+        row = ProcessRow._make(doc[k] for k in ProcessRow._fields)
+        assert row.pm3_id == 7 and row.pid == -1 and row.autorun is False
+        assert LIST_FIELDS == ProcessRow._fields[:-1]
+
+
+class TestStopTrees(unittest.TestCase):
+    # Esce un secondo dopo SIGTERM
+    SLOW = "trap 'sleep 1; exit 0' TERM; while true; do sleep 0.1; done"
+
+    def test_01_shared_deadline(self):
+        procs = [subprocess.Popen(['sh', '-c', self.SLOW]) for _ in range(3)]
+        time.sleep(0.2)
+        start = time.monotonic()
+        trees = stop_trees([p.pid for p in procs], timeout=5)
+        # in parallelo: circa quanto il piu' lento, non la somma
+        assert time.monotonic() - start < 2.5
+        for p in procs:
+            gone, alive = trees[p.pid]
+            assert p.pid in [ps.pid for ps in gone] and alive == []
+
+    def test_02_alive_and_gone(self):
+        stubborn = subprocess.Popen(['sh', '-c', "trap '' TERM; while true; do sleep 0.1; done"])
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        time.sleep(0.2)
+        trees = stop_trees([stubborn.pid, dead.pid], timeout=0.5)
+        assert stubborn.pid in [ps.pid for ps in trees[stubborn.pid][1]]
+        assert trees[dead.pid] == ([], [])
+        stubborn.kill()
+        stubborn.wait()
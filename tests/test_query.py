@@ -0,0 +1,45 @@
+import unittest
+
+from werkzeug.datastructures import MultiDict
+
+from PM3.libs.query import Query, QueryError
+
+ROWS = [
+    {'pm3_id': 1, 'pm3_name': 'a', 'autorun': True, 'cpu_percent': 5.0, 'pid': 10},
+    {'pm3_id': 2, 'pm3_name': 'b', 'autorun': False, 'cpu_percent': None, 'pid': -1},
+    {'pm3_id': 3, 'pm3_name': 'c', 'autorun': True, 'cpu_percent': 20.0, 'pid': 30},
+]
+KNOWN = {'pm3_id', 'pm3_name', 'autorun', 'cpu_percent', 'pid', 'status'}
+ALIASES = {'status': lambda row: 'running' if row['pid'] > 0 else 'stopped'}
+
+
+def query(**args):
+    return Query(MultiDict(args), known=KNOWN, aliases=ALIASES)
+
+
+class TestQuery(unittest.TestCase):
+    def test_01_filter(self):
+        assert [r['pm3_id'] for r in query(autorun='true').apply(ROWS)] == [1, 3]
+        assert [r['pm3_id'] for r in query(status='stopped').apply(ROWS)] == [2]
+        # virgola = uno qualsiasi dei valori
+        assert [r['pm3_id'] for r in query(pm3_name='a,c', status='running').apply(ROWS)] == [1, 3]
+
+    def test_02_sort_limit(self):
+        # None sempre in fondo
+        assert [r['pm3_id'] for r in query(sort='-cpu_percent').apply(ROWS)] == [3, 1, 2]
+        assert [r['pm3_id'] for r in query(sort='cpu_percent', limit='1').apply(ROWS)] == [1]
+
+    def test_03_projection(self):
+        q = query(fields='cpu_percent')
+        assert q.project(ROWS[0]) == {'pm3_id': 1, 'pm3_name': 'a', 'cpu_percent': 5.0}
+        assert q.columns(('x', )) == ('pm3_id', 'pm3_name', 'cpu_percent')
+        assert q.needed() == {'cpu_percent'}
+        assert query().project(ROWS[0]) is ROWS[0]
+
+    def test_04_errors(self):
+        with self.assertRaises(QueryError):
+            query(fields='nope')
+        with self.assertRaises(QueryError):
+            query(nope='1')
+        with self.assertRaises(QueryError):
+            query(limit='x')
@@ -0,0 +1,63 @@
+import time
+import threading
+import unittest
+import subprocess
+
+from PM3.libs.reaper import ChildReaper
+
+
+class TestReaper(unittest.TestCase):
+    def _watch(self, reaper, cmd):
+        done = threading.Event()
+        out = {}
+
+        def callback(p):
+            out['returncode'] = p.returncode
+            out['time'] = time.monotonic()
+            done.set()
+
+        p = subprocess.Popen(cmd)
+        reaper.watch(p, callback)
+        return p, done, out
+
+    def test_01_pidfd(self):
+        reaper = ChildReaper()
+        if not reaper.use_pidfd:
+            self.skipTest('pidfd_open not available')
+        reaper.start()
+        p, done, out = self._watch(reaper, ['sh', '-c', 'sleep 0.2; exit 3'])
+        assert done.wait(5)
+        assert out['returncode'] == 3
+        # nessun processo zombie: il figlio e' stato raccolto
+        assert p.poll() == 3
+
+    def test_02_already_exited(self):
+        # Il figlio esce prima di essere registrato nel selector
+        reaper = ChildReaper()
+        p = subprocess.Popen(['true'])
+        p.wait()
+        done = threading.Event()
+        reaper.watch(p, lambda popen: done.set())
+        reaper.start()
+        assert done.wait(5)
+
+    def test_03_poll_fallback(self):
+        reaper = ChildReaper()
+        reaper.use_pidfd = False
+        reaper.start()
+        start = time.monotonic()
+        p, done, out = self._watch(reaper, ['sh', '-c', 'exit 1'])
+        # senza SIGCHLD il timeout di 1 secondo recupera l'uscita
+        assert done.wait(5)
+        assert out['returncode'] == 1
+        assert out['time'] - start < 3
+
+    def test_04_callback_error(self):
+        # Un errore nella callback non ferma il reaper
+        reaper = ChildReaper()
+        reaper.start()
+        p = subprocess.Popen(['true'])
+        reaper.watch(p, lambda popen: 1 / 0)
+        p, done, out = self._watch(reaper, ['true'])
+        assert done.wait(5)
+        assert out['returncode'] == 0
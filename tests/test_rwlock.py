@@ -0,0 +1,58 @@
+import threading
+import time
+import unittest
+
+from PM3.libs.rwlock import RWLock
+
+
+class TestRWLock(unittest.TestCase):
+    def test_01_shared_readers(self):
+        lock = RWLock()
+        inside = []
+        barrier = threading.Barrier(5, timeout=2)
+
+        def reader():
+            with lock.read_locked():
+                # tutti i lettori devono poter stare dentro insieme
+                barrier.wait()
+                inside.append(1)
+
+        threads = [threading.Thread(target=reader) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(inside) == 5
+
+    def test_02_exclusive_writer(self):
+        lock = RWLock()
+        events = []
+
+        def writer():
+            with lock.write_locked():
+                events.append('w_in')
+                time.sleep(0.2)
+                events.append('w_out')
+
+        def reader():
+            with lock.read_locked():
+                events.append('r')
+
+        tw = threading.Thread(target=writer)
+        tw.start()
+        time.sleep(0.05)
+        tr = threading.Thread(target=reader)
+        tr.start()
+        tw.join()
+        tr.join()
+        assert events == ['w_in', 'w_out', 'r']
+
+    def test_03_reentrant_writer(self):
+        lock = RWLock()
+        with lock.write_locked():
+            with lock.write_locked():
+                with lock.read_locked():
+                    pass
+        # il lock deve essere di nuovo libero
+        with lock.read_locked():
+            pass
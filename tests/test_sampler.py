@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import unittest
+import subprocess
+
+import psutil
+from PM3.libs.sampler import MetricsSampler
+
+# Processo che consuma CPU e lancia un figlio (sleep)
+BUSY = "import subprocess\nsubprocess.Popen(['sleep', '100'])\nwhile True: pass\n"
+
+
+class TestSampler(unittest.TestCase):
+    def setUp(self):
+        self.busy = subprocess.Popen([sys.executable, '-c', BUSY])
+        # il figlio sleep del processo busy
+        for _ in range(50):
+            children = psutil.Process(self.busy.pid).children()
+            if children:
+                break
+            time.sleep(0.05)
+        self.grandchild = children[0].pid
+
+    def tearDown(self):
+        for ps in psutil.Process(self.busy.pid).children(recursive=True):
+            ps.kill()
+        self.busy.kill()
+        self.busy.wait()
+
+    def test_01_managed_child_sampled_once(self):
+        # Come il backend: il suo pid (prima nel dict) e un processo che ha avviato
+        pids = {os.getpid(): 1, self.busy.pid: 2}
+        sampler = MetricsSampler(lambda: pids, history_period=0)
+        sampler.sample()
+        time.sleep(0.5)
+        sampler.sample()
+        snapshot = sampler.snapshot()
+        parent_pids = [row['pid'] for row in snapshot[os.getpid()]]
+        # il processo gestito e il suo sottoalbero non sono nell'albero del parent
+        assert self.busy.pid not in parent_pids
+        assert self.grandchild not in parent_pids
+        assert [row['pid'] for row in snapshot[self.busy.pid]] == [self.busy.pid, self.grandchild]
+        assert snapshot[self.busy.pid][0]['cpu_percent'] > 20
+
+    def test_02_partial_sample(self):
+        pids = {os.getpid(): 1, self.busy.pid: 2}
+        sampler = MetricsSampler(lambda: pids)
+        sampler.sample([os.getpid()])
+        assert self.busy.pid not in [row['pid'] for row in sampler.snapshot()[os.getpid()]]
+
+    def test_03_history_without_managed_subtrees(self):
+        pids = {os.getpid(): 1, self.busy.pid: 2}
+        sampler = MetricsSampler(lambda: pids, history_period=0)
+        # righe del parent con dentro il sottoalbero gestito, come prima del campionamento separato
+        snapshot = {os.getpid(): [{'pid': os.getpid(), 'ppid': 1, 'num_threads': 1},
+                                  {'pid': self.busy.pid, 'ppid': os.getpid(), 'num_threads': 1},
+                                  {'pid': self.grandchild, 'ppid': self.busy.pid, 'num_threads': 1}]}
+        sampler._record_history(pids, snapshot, 1.0)
+        assert sampler.history[1].to_dict()['num_threads'] == [1.0]
@@ -0,0 +1,186 @@
+import os
+import stat
+import socket
+import tempfile
+import time
+import threading
+import http.client
+import unittest
+from configparser import ConfigParser
+
+from flask import Flask, Response, request
+
+from PM3.libs.server import PoolWSGIServer, UnixPoolWSGIServer
+from PM3.libs.unixsocket import backend_session, UNIX_URL
+
+
+class TestPoolServer(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+
+        @app.get('/ping')
+        def ping():
+            return {'thread': threading.current_thread().name}
+
+        @app.get('/follow')
+        def follow():
+            # Come /log?follow=1: una risposta senza fine
+            request.environ['pm3.detach']()
+
+            def lines():
+                while True:
+                    yield b'{}\n'
+                    time.sleep(0.1)
+            return Response(lines(), content_type='application/x-ndjson')
+
+        @app.get('/stream')
+        def stream():
+            # senza Content-Length
+            return Response(iter([b'a\n', b'b\n', b'c\n']), content_type='text/plain')
+
+        self.server = PoolWSGIServer('127.0.0.1', 0, app, workers=2, keep_alive=2)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_01_keep_alive(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+        for _ in range(3):
+            conn.request('GET', '/ping')
+            r = conn.getresponse()
+            assert r.status == 200
+            assert r.read()
+            # la stessa connessione serve piu' richieste
+            assert not r.will_close
+        conn.close()
+
+    def test_02_workers(self):
+        names = set()
+        for _ in range(4):
+            conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+            conn.request('GET', '/ping')
+            names.add(conn.getresponse().read())
+            conn.close()
+        assert all(b'pm3_http' in i for i in names)
+
+    def test_03_follow_streams(self):
+        # workers stream aperti non bloccano le altre richieste
+        streams = []
+        for _ in range(self.server.workers):
+            conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+            conn.request('GET', '/follow')
+            r = conn.getresponse()
+            assert r.readline() == b'{}\n'
+            streams.append(conn)
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+        conn.request('GET', '/ping')
+        assert conn.getresponse().status == 200
+        conn.close()
+        for i in streams:
+            i.close()
+
+    def test_04_http10(self):
+        # Niente chunked per un client HTTP/1.0: il corpo finisce con la chiusura
+        s = socket.create_connection(('127.0.0.1', self.server.server_port), timeout=5)
+        s.sendall(b'GET /stream HTTP/1.0\r\n\r\n')
+        data = b''
+        while chunk := s.recv(4096):
+            data += chunk
+        s.close()
+        head, _, body = data.partition(b'\r\n\r\n')
+        assert b'Transfer-Encoding' not in head
+        assert b'Connection: close' in head
+        assert body == b'a\nb\nc\n'
+
+    def test_05_pipelined(self):
+        # Due richieste in un solo invio: la seconda e' gia' nel buffer della prima
+        s = socket.create_connection(('127.0.0.1', self.server.server_port), timeout=5)
+        s.sendall(b'GET /ping HTTP/1.1\r\nHost: x\r\n\r\n' * 2 + b'GET /stream HTTP/1.1\r\nHost: x\r\n\r\n')
+        f = s.makefile('rb')
+        for _ in range(2):
+            assert f.readline().startswith(b'HTTP/1.1 200')
+            headers = dict(i.split(b': ', 1) for i in iter(f.readline, b'\r\n'))
+            assert b'thread' in f.read(int(headers[b'Content-Length']))
+        assert f.readline().startswith(b'HTTP/1.1 200')
+        headers = dict(i.split(b': ', 1) for i in iter(f.readline, b'\r\n'))
+        assert headers[b'Transfer-Encoding'] == b'chunked\r\n'
+        f.close()
+        s.close()
+
+    def test_06_idle_connections(self):
+        # Connessioni keep-alive inattive non occupano i workers
+        idle = []
+        for _ in range(self.server.workers + 1):
+            conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+            conn.request('GET', '/ping')
+            assert conn.getresponse().read()
+            idle.append(conn)
+        start = time.monotonic()
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=5)
+        conn.request('GET', '/ping')
+        assert conn.getresponse().status == 200
+        assert time.monotonic() - start < 1
+        # e vengono riprese alla richiesta successiva
+        for i in idle:
+            i.request('GET', '/ping')
+            assert i.getresponse().status == 200
+            i.close()
+        conn.close()
+
+
+class TestUnixServer(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+
+        @app.get('/ping')
+        def ping():
+            return {'remote': request.remote_addr}
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'pm3.sock')
+        self.server = UnixPoolWSGIServer(self.path, app, workers=2, keep_alive=2)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.config = ConfigParser()
+        self.config.read_dict({'main_section': {'pm3_home_dir': self.tmp.name},
+                               'backend': {'url': 'http://127.0.0.1:1/'}})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_01_session(self):
+        session, base_url = backend_session(self.config)
+        assert base_url == UNIX_URL
+        for _ in range(3):
+            r = session.get(f'{base_url}/ping', timeout=5)
+            assert r.status_code == 200
+            assert r.json() == {'remote': 'unix'}
+        # solo il proprietario puo' connettersi
+        assert stat.S_IMODE(os.stat(self.path).st_mode) == 0o600
+
+    def test_02_fallback_tcp(self):
+        # Senza socket si usa l'url TCP
+        self.config['backend']['socket'] = ''
+        assert backend_session(self.config)[1] == 'http://127.0.0.1:1'
+        self.config['backend']['socket'] = os.path.join(self.tmp.name, 'missing.sock')
+        assert backend_session(self.config)[1] == 'http://127.0.0.1:1'
+
+    def test_03_stale_socket(self):
+        # Un socket attivo non viene rubato, uno orfano viene rimosso
+        with self.assertRaises(OSError):
+            UnixPoolWSGIServer(self.path, None)
+        self.server.shutdown()
+        self.server.server_close()
+        assert not os.path.exists(self.path)
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.path)
+        s.close()
+        self.server = UnixPoolWSGIServer(self.path, None)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        assert os.path.exists(self.path)
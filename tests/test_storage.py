@@ -0,0 +1,60 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from PM3.libs.storage import TinyDBEngine, SQLiteEngine, migrate_tinydb
+from PM3.model.process import Process
+
+table_name = 'pm3_procs'
+
+
+def make_procs(n):
+    return {i: Process(pm3_id=i, pm3_name=f'process_{i}', cmd='sleep 100').model_dump() for i in range(1, n+1)}
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.json_path = Path(self.tmp_dir.name, 'pm3_db.json').as_posix()
+        self.sqlite_path = Path(self.tmp_dir.name, 'pm3_db.sqlite').as_posix()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_01_tinydb_roundtrip(self):
+        engine = TinyDBEngine(self.json_path, table_name)
+        procs = make_procs(3)
+        engine.save(procs, set(procs))
+        engine.close()
+
+        # il file deve restare un database TinyDB valido
+        with open(self.json_path) as f:
+            assert len(json.load(f)[table_name]) == 3
+        assert TinyDBEngine(self.json_path, table_name).load() == list(procs.values())
+
+    def test_02_sqlite_roundtrip(self):
+        engine = SQLiteEngine(self.sqlite_path, table_name)
+        procs = make_procs(3)
+        engine.save(procs, set(procs))
+
+        procs.pop(2)
+        procs[3]['pm3_name'] = 'renamed'
+        engine.save(procs, {2, 3})
+        docs = engine.load()
+        assert [i['pm3_id'] for i in docs] == [1, 3]
+        assert docs[1]['pm3_name'] == 'renamed'
+
+    def test_03_migrate(self):
+        old = TinyDBEngine(self.json_path, table_name)
+        procs = make_procs(5)
+        old.save(procs, set(procs))
+        old.close()
+
+        engine = SQLiteEngine(self.sqlite_path, table_name)
+        assert migrate_tinydb(self.json_path, table_name, engine) == 5
+        assert engine.load() == list(procs.values())
+        # one-shot: una seconda migrazione non deve reimportare nulla
+        engine.save({}, set(procs))
+        assert migrate_tinydb(self.json_path, table_name, engine) == 0
+        assert engine.load() == []
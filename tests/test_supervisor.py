@@ -0,0 +1,82 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from PM3.libs.storage import SQLiteEngine
+from PM3.libs.pm3table import Pm3Table
+from PM3.libs.supervisor import Supervisor
+from PM3.model.pm3_protocol import RetMsg
+from PM3.model.process import Process, read_create_time
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = Path(self.tmp_dir.name, 'pm3_db.sqlite').as_posix()
+        self.ptbl = Pm3Table(SQLiteEngine(path, 'pm3_procs'), lock_file=path + '.lock')
+        self.started = []
+        self.supervisor = Supervisor(self.ptbl, self.start_process, interval=60)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def start_process(self, proc, ion):
+        self.started.append(proc.pm3_name)
+        return RetMsg(msg=f'{proc.pm3_name} started')
+
+    def add(self, pm3_id, **kwargs):
+        proc = Process(pm3_id=pm3_id, pm3_name=f'process_{pm3_id}', cmd='sleep 100', autorun=True,
+                       restart_jitter=0, **kwargs)
+        self.ptbl.insert(proc)
+        return proc
+
+    def test_01_autorun_rules(self):
+        self.add(1, next_restart_at=time.time() - 1)
+        # sospeso, non autorun
+        self.add(2, autorun_exclude=True, next_restart_at=0)
+        proc = self.add(3, next_restart_at=0)
+        proc.autorun = False
+        self.ptbl.update(proc)
+        # in esecuzione
+        proc = self.add(4, next_restart_at=0)
+        proc.pid, proc.pid_create_time = os.getpid(), read_create_time(os.getpid())
+        self.ptbl.update(proc)
+        assert [i.msg for i in self.supervisor.check_autostart()] == ['process_1 started']
+        assert self.started == ['process_1']
+
+    def test_02_backoff(self):
+        at = time.time() + 30
+        self.add(1, next_restart_at=at)
+        assert self.supervisor.check_autostart() == []
+        # il prossimo controllo e' alla fine del backoff
+        assert self.supervisor._next_check == at
+
+    def test_03_exit_not_seen(self):
+        # Uscita non vista dal reaper: il backoff viene calcolato e salvato
+        self.add(1, restart_strategy='fixed', restart_delay=30, started_at=time.time() - 1)
+        self.supervisor.check_autostart()
+        assert self.started == []
+        assert self.ptbl.find_docs('process_1').proc[0]['next_restart_at'] > time.time() + 20
+        self.add(2, restart_strategy='immediate', started_at=time.time() - 1)
+        self.supervisor.check_autostart()
+        assert self.started == ['process_2']
+
+    def test_04_never_started(self):
+        # Mai avviato: nessun backoff prima del primo avvio
+        self.add(1, restart_strategy='fixed', restart_delay=30)
+        self.supervisor.check_autostart()
+        assert self.started == ['process_1']
+        doc = self.ptbl.find_docs('process_1').proc[0]
+        assert doc['unstable_restarts'] == 0 and doc['next_restart_at'] is None
+
+    def test_05_wake(self):
+        started = threading.Event()
+        self.supervisor.start_process = lambda proc, ion: started.set() or RetMsg(msg='started')
+        self.supervisor.start()
+        self.add(1, next_restart_at=0)
+        # interval=60: solo wake() fa partire il controllo
+        self.supervisor.wake()
+        assert started.wait(5)
@@ -0,0 +1,109 @@
+import os
+import json
+import tempfile
+import unittest
+
+from PM3.libs.tailbuf import TailBuffer, TailPool
+from PM3.libs.events import EventLog
+from PM3.libs.logstream import log_lines
+from PM3.model.process import Process
+
+
+class FakeCapture:
+    def __init__(self):
+        self.tails = {}
+
+    def flush(self):
+        pass
+
+    def wait_output(self, timeout):
+        return False
+
+
+class TestTailBuffer(unittest.TestCase):
+    def test_01_lines(self):
+        buf = TailBuffer(1024)
+        buf.append('out', b'one\ntw')
+        buf.append('err', b'boom\n')
+        buf.append('out', b'o\nthree')
+        assert buf.lines('out') == [('out', 'one'), ('out', 'two'), ('out', 'three')]
+        assert buf.lines('err') == [('err', 'boom')]
+        assert buf.lines('both', last=2)[-1] == ('out', 'three')
+
+    def test_02_byte_budget(self):
+        buf = TailBuffer(100)
+        for i in range(100):
+            buf.append('out', f'line {i:03d}\n'.encode())
+        assert buf.size <= 100
+        lines = buf.lines('out')
+        assert lines[-1] == ('out', 'line 099')
+        assert all(line.startswith('line ') for _, line in lines)
+        # un chunk piu' grande del budget: la riga troncata viene scartata
+        buf.append('out', b'x' * 150 + b'\nlast\n')
+        assert buf.lines('out') == [('out', 'last')]
+
+
+class TestTailPool(unittest.TestCase):
+    def test_01_global_cap(self):
+        pool = TailPool(max_bytes=1000, default_bytes=800)
+        quiet = pool.buffer(1, 800)
+        chatty = pool.buffer(2, 800)
+        for i in range(10):
+            pool.append(quiet, 'err', f'quiet {i}\n'.encode())
+        for i in range(200):
+            pool.append(chatty, 'out', f'chatty {i:04d}\n'.encode())
+        assert pool.size <= 1000
+        assert pool.size == quiet.size + chatty.size
+        # il processo che scrive di piu' non cancella l'output dell'altro
+        assert len(quiet.lines()) == 10
+        assert chatty.lines()[-1] == ('out', 'chatty 0199')
+
+    def test_02_resize_and_remove(self):
+        pool = TailPool(max_bytes=10000, default_bytes=1000)
+        buf = pool.buffer(1, 1000)
+        for i in range(100):
+            pool.append(buf, 'out', b'0123456789\n')
+        assert pool.buffer(1, 110) is buf
+        assert buf.size <= 110 and pool.size == buf.size
+        pool.remove(1)
+        pool.append(buf, 'out', b'late\n')
+        assert pool.size == 0 and pool.get(1) is None
+
+
+class TestEventLog(unittest.TestCase):
+    def test_01_since(self):
+        events = EventLog(maxlen=3)
+        for i in range(5):
+            events.add('crash', pm3_id=i % 2)
+        assert [e['seq'] for e in events.since()] == [3, 4, 5]
+        assert [e['seq'] for e in events.since(4)] == [5]
+        assert [e['seq'] for e in events.since(0, {1})] == [4]
+
+
+class TestLogStream(unittest.TestCase):
+    def test_01_from_memory(self):
+        capture = FakeCapture()
+        proc = Process(pm3_id=1, pm3_name='web', cmd='true', stdout='/nonexistent.log', stderr='/nonexistent.err')
+        capture.tails[1] = buf = TailBuffer(1024)
+        buf.append('out', b''.join(f'{i}\n'.encode() for i in range(20)))
+        rows = [json.loads(i) for i in ''.join(log_lines([proc], capture, lines=3)).splitlines()]
+        assert [r['line'] for r in rows] == ['17', '18', '19']
+        assert rows[0]['pm3_name'] == 'web' and rows[0]['stream'] == 'out'
+
+    def test_02_buffer_created_while_following(self):
+        # log -f lanciato prima del primo avvio del processo
+        capture = FakeCapture()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'late.log')
+            open(path, 'w').close()
+            proc = Process(pm3_id=1, pm3_name='late', cmd='true', stdout=path)
+            rows = log_lines([proc], capture, lines=10, follow=True, poll_interval=0.01)
+            assert next(rows) == ''
+            # avvio: il buffer e i file ricevono le stesse righe
+            capture.tails[1] = buf = TailBuffer(1024)
+            buf.append('out', b'first\nsecond\n')
+            with open(path, 'a') as f:
+                f.write('first\nsecond\n')
+            lines = [json.loads(i)['line'] for i in next(rows).splitlines()]
+            rows.close()
+            assert lines == ['first', 'second']